@@ -20,7 +20,7 @@ from .models import (
     MaterialIncome, IncomeItem,
     MaterialTransfer, TransferItem,
     MaterialWriteOff, WriteOffItem,
-    Stock
+    Stock, StockMovement, StockSnapshot, ImportJob, MaterialLocationMinimum, ApiToken, ExportJob
 )
 
 @admin.register(Unit)
@@ -33,10 +33,16 @@ class SupplierAdmin(admin.ModelAdmin):
     list_display = ("name", "phone", "email", "get_contact_name", "inn", "kpp")
     search_fields = ("name", "contact_last_name", "contact_first_name", "email", "inn")
 
+class MaterialLocationMinimumInline(admin.TabularInline):
+    model = MaterialLocationMinimum
+    extra = 0
+
 @admin.register(Material)
 class MaterialAdmin(admin.ModelAdmin):
-    list_display = ("name", "article", "unit")
+    list_display = ("name", "article", "unit", "min_quantity")
+    list_select_related = ("unit",)
     search_fields = ("name", "article")
+    inlines = [MaterialLocationMinimumInline]
 
 @admin.register(Direction)
 class DirectionAdmin(admin.ModelAdmin):
@@ -51,10 +57,12 @@ class LocationAdmin(admin.ModelAdmin):
 @admin.register(MaterialIncome)
 class MaterialIncomeAdmin(admin.ModelAdmin):
     list_display = ("date", "document_number", "supplier", "responsible", "created_at")
+    list_select_related = ("supplier", "responsible")
 
 @admin.register(IncomeItem)
 class IncomeItemAdmin(admin.ModelAdmin):
     list_display = ("income", "material", "quantity", "direction", "location")
+    list_select_related = ("income__supplier", "material__unit", "direction", "location")
 
 @admin.register(MaterialTransfer)
 class MaterialTransferAdmin(admin.ModelAdmin):
@@ -63,6 +71,7 @@ class MaterialTransferAdmin(admin.ModelAdmin):
 @admin.register(TransferItem)
 class TransferItemAdmin(admin.ModelAdmin):
     list_display = ("transfer", "material", "quantity", "from_location", "to_location")
+    list_select_related = ("transfer", "material", "from_location", "to_location")
 
 @admin.register(MaterialWriteOff)
 class MaterialWriteOffAdmin(admin.ModelAdmin):
@@ -71,7 +80,49 @@ class MaterialWriteOffAdmin(admin.ModelAdmin):
 @admin.register(WriteOffItem)
 class WriteOffItemAdmin(admin.ModelAdmin):
     list_display = ("writeoff", "material", "quantity", "direction", "location")
+    list_select_related = ("writeoff", "material", "direction", "location")
 
 @admin.register(Stock)
 class StockAdmin(admin.ModelAdmin):
-    list_display = ("material", "direction", "location", "quantity")
\ No newline at end of file
+    list_display = ("material", "direction", "location", "quantity", "min_quantity")
+    list_select_related = ("material", "direction", "location")
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ("date", "kind", "document_id", "material", "direction", "location", "quantity")
+    list_filter = ("kind",)
+    list_select_related = ("material", "direction", "location")
+    date_hierarchy = "date"
+
+    # Журнал только дописывается проведением: правка записи разошлась бы со Stock и снимками
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StockSnapshot)
+class StockSnapshotAdmin(admin.ModelAdmin):
+    list_display = ("period_end", "last_sequence", "created_at")
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ("pk", "user", "status", "last_row", "imported_rows", "error_count", "created_at", "finished_at")
+    list_filter = ("status",)
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ("pk", "kind", "user", "status", "size", "created_at", "finished_at", "last_used_at")
+    list_filter = ("status", "kind")
+
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ("name", "user", "created_at")
+    readonly_fields = ("key", "created_at")
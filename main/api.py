@@ -0,0 +1,387 @@
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .exporting import EXPORT_CHUNK_SIZE
+from .models import (
+    Supplier, MaterialIncome, MaterialTransfer, MaterialWriteOff, Stock, StockMovement, ApiToken, ApiIdempotencyKey
+)
+from .posting import INCOME_POSTING, TRANSFER_POSTING, WRITEOFF_POSTING, post_items
+from .reference import REFERENCE_MODELS, bump_reference_version, reference_objects
+from .stock import fold_deltas, lock_stock, sequence_movements, shortage_message, sync_settle_seconds
+
+API_MAX_DOCUMENTS = 1000
+API_MAX_ITEMS = 20000
+
+STOCK_STREAM_FIELDS = ("id", "material_id", "direction_id", "location_id", "quantity", "min_quantity", "updated_at")
+MOVEMENT_STREAM_FIELDS = (
+    "sequence", "id", "kind", "document_id", "date", "material_id", "direction_id", "location_id", "quantity",
+    "created_at",
+)
+
+# Вид документа в API: модель, проведение и поля позиции со справочником каждого
+DOCUMENT_TYPES = {
+    "income": (MaterialIncome, INCOME_POSTING, {
+        "material": "material", "direction": "direction", "location": "location",
+    }),
+    "transfer": (MaterialTransfer, TRANSFER_POSTING, {
+        "material": "material", "from_direction": "direction", "from_location": "location",
+        "to_direction": "direction", "to_location": "location",
+    }),
+    "writeoff": (MaterialWriteOff, WRITEOFF_POSTING, {
+        "material": "material", "direction": "direction", "location": "location",
+    }),
+}
+KIND_TYPES = {posting[2]: name for name, (_, posting, _) in DOCUMENT_TYPES.items()}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.payload = {"error": message}
+        if errors:
+            self.payload["errors"] = errors
+
+
+def api_user(request):
+    """Пользователь по заголовку ``Authorization: Token <ключ>`` или None."""
+    scheme, _, key = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+    if scheme.lower() != "token" or not key:
+        return None
+    token = ApiToken.objects.select_related("user").filter(key=key.strip()).first()
+    if token is None or not token.user.is_active:
+        return None
+    return token.user
+
+
+def stream_stock(params):
+    """Строки Stock, изменённые после курсора, в порядке (updated_at, id).
+
+    Курсор — ``updated_since`` (ISO-время) и ``after_id`` из последней
+    полученной строки; без курсора выгружаются все строки. Читается
+    серверным курсором порциями, память не зависит от числа строк.
+    Строки моложе API_SYNC_SETTLE_SECONDS не выгружаются, а строки из
+    транзакций длиннее этого окна после фиксации получают новую отметку
+    (stock._restamp_after_commit), поэтому курсор их не пропускает.
+    """
+    since = _cursor_datetime(params, "updated_since")
+    after_id = _cursor_int(params, "after_id")
+    stocks = Stock.objects.filter(updated_at__lt=_settled_before())
+    if since is not None:
+        stocks = stocks.filter(Q(updated_at__gt=since) | Q(updated_at=since, id__gt=after_id or 0))
+    elif after_id is not None:
+        raise ApiError(400, "after_id для остатков задаётся вместе с updated_since")
+    return _stream(stocks.order_by("updated_at", "id"), STOCK_STREAM_FIELDS, params)
+
+
+def stream_movements(params):
+    """Записи журнала движений с номером фиксации больше ``after_sequence``.
+
+    Журнал только дополняется (удаление документа пишет сторнирующие
+    записи), но id выдаются при INSERT, а видны записи с COMMIT: пачка,
+    зафиксированная позже, может принести меньшие id. Поэтому курсор —
+    ``sequence``, который выдаётся после фиксации в её порядке; записи без
+    номера ещё не выгружаются.
+    """
+    if params.get("after_id"):
+        raise ApiError(400, "Курсор журнала — after_sequence (поле sequence последней полученной записи)")
+    after_sequence = _cursor_int(params, "after_sequence")
+    sequence_movements()
+    movements = StockMovement.objects.filter(sequence__isnull=False)
+    if after_sequence is not None:
+        movements = movements.filter(sequence__gt=after_sequence)
+    return _stream(movements.order_by("sequence"), MOVEMENT_STREAM_FIELDS, params)
+
+
+def _stream(queryset, fields, params):
+    limit = _cursor_int(params, "limit")
+    if limit is not None:
+        queryset = queryset[:limit]
+    return queryset.values(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _settled_before():
+    return timezone.now() - timedelta(seconds=sync_settle_seconds())
+
+
+def _cursor_datetime(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ApiError(400, f"Некорректное значение {name}: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _cursor_int(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise ApiError(400, f"Некорректное значение {name}: {value}")
+    return number
+
+
+class ParsedDocument:
+    def __init__(self, index, key, type, document, items):
+        self.index = index
+        self.key = key
+        self.type = type
+        self.document = document
+        self.items = items
+
+    @property
+    def posting(self):
+        return DOCUMENT_TYPES[self.type][1]
+
+    def deltas(self):
+        deltas_fn = self.posting[3]
+        return fold_deltas(entry for item in self.items for entry in deltas_fn(item))
+
+
+def post_documents(user, payload):
+    """Проводит пачку документов из API одной транзакцией.
+
+    Все документы проверяются заранее по справочникам в памяти; при любой
+    ошибке ничего не записывается. Документы с уже известным ключом
+    идемпотентности не проводятся повторно, в ответе возвращается ранее
+    созданный документ. Остатки для перемещений и списаний проверяются по
+    заблокированным строкам Stock с учётом предыдущих документов пачки.
+    """
+    documents = _parse_batch(user, payload)
+    try:
+        with transaction.atomic():
+            existing = {
+                key: (kind, document_id)
+                for key, kind, document_id in ApiIdempotencyKey.objects.filter(
+                    user=user, key__in=[parsed.key for parsed in documents]
+                ).values_list("key", "kind", "document_id")
+            }
+            new = [parsed for parsed in documents if parsed.key not in existing]
+            _check_stock(new)
+            _save(user, new)
+    except IntegrityError:
+        # Ключ идемпотентности разбирается в _save; остальное — внешние ключи, которые
+        # проверяются при COMMIT: справочник изменился в другом процессе, а копия
+        # в памяти ещё старая. Копии сбрасываются, повтор покажет ошибки по позициям
+        for name in REFERENCE_MODELS:
+            bump_reference_version(name)
+        raise ApiError(400, "Документы ссылаются на удалённые записи справочников, проверьте пачку и повторите")
+
+    results = []
+    for parsed in documents:
+        if parsed.key in existing:
+            kind, document_id = existing[parsed.key]
+            results.append({"idempotency_key": parsed.key, "type": KIND_TYPES[kind], "id": document_id,
+                            "status": "duplicate"})
+        else:
+            results.append({"idempotency_key": parsed.key, "type": parsed.type, "id": parsed.document.pk,
+                            "status": "created"})
+    return results
+
+
+def _parse_batch(user, payload):
+    if not isinstance(payload, dict) or not isinstance(payload.get("documents"), list):
+        raise ApiError(400, "Ожидается объект с массивом documents")
+    raw_documents = payload["documents"]
+    if not raw_documents:
+        raise ApiError(400, "Пустая пачка документов")
+    if len(raw_documents) > API_MAX_DOCUMENTS:
+        raise ApiError(400, f"Не больше {API_MAX_DOCUMENTS} документов за запрос")
+    item_count = sum(
+        len(raw["items"]) for raw in raw_documents if isinstance(raw, dict) and isinstance(raw.get("items"), list)
+    )
+    if item_count > API_MAX_ITEMS:
+        raise ApiError(400, f"Не больше {API_MAX_ITEMS} позиций за запрос")
+
+    # Поставщики не входят в кэш справочников: проверяются одним запросом на пачку
+    supplier_ids = {
+        raw.get("supplier") for raw in raw_documents
+        if isinstance(raw, dict) and raw.get("type") == "income" and _is_pk(raw.get("supplier"))
+    }
+    suppliers = set(Supplier.objects.filter(pk__in=supplier_ids).values_list("pk", flat=True))
+
+    documents = []
+    errors = []
+    keys = set()
+    for index, raw in enumerate(raw_documents):
+        messages = []
+        parsed = _parse_document(user, index, raw, suppliers, messages)
+        if parsed is not None and isinstance(parsed.key, str):
+            if parsed.key in keys:
+                messages.append(f"Ключ идемпотентности повторяется в пачке: {parsed.key}")
+            keys.add(parsed.key)
+        if messages:
+            errors.append({"index": index, "errors": messages})
+        else:
+            documents.append(parsed)
+    if errors:
+        raise ApiError(400, "Документы не прошли проверку", errors)
+    return documents
+
+
+def _parse_document(user, index, raw, suppliers, messages):
+    if not isinstance(raw, dict):
+        messages.append("Документ должен быть объектом")
+        return None
+    type = raw.get("type")
+    if not isinstance(type, str) or type not in DOCUMENT_TYPES:
+        messages.append(f"Неизвестный вид документа: {type}")
+        return None
+    model, posting, item_fields = DOCUMENT_TYPES[type]
+
+    key = raw.get("idempotency_key")
+    if not isinstance(key, str) or not key or len(key) > 100:
+        messages.append("Нужен idempotency_key — непустая строка до 100 символов")
+    try:
+        doc_date = date.fromisoformat(raw.get("date") or "")
+    except (TypeError, ValueError):
+        messages.append(f"Некорректная дата: {raw.get('date')}")
+        doc_date = None
+    if doc_date and doc_date > timezone.now().date():
+        messages.append("Дата не может быть в будущем.")
+
+    document_number = raw.get("document_number")
+    if document_number is not None and not isinstance(document_number, str):
+        messages.append("document_number должен быть строкой")
+        document_number = None
+    document = model(date=doc_date, document_number=document_number or None, responsible=user)
+    if type == "income":
+        supplier = raw.get("supplier")
+        if not _is_pk(supplier) or supplier not in suppliers:
+            messages.append(f"Поставщик не найден: {supplier}")
+        else:
+            document.supplier_id = supplier
+    elif type == "writeoff":
+        reason = raw.get("reason")
+        document.reason = reason.strip() if isinstance(reason, str) else ""
+        if not document.reason:
+            messages.append("Не указана причина списания")
+    # Длины строк и прочие ограничения полей модели, как в формах; ссылки уже
+    # проверены без запросов, дата и пустая причина — своими сообщениями
+    exclude = {"date", "supplier", "responsible"}
+    if type == "writeoff" and not document.reason:
+        exclude.add("reason")
+    try:
+        document.clean_fields(exclude=exclude)
+    except ValidationError as e:
+        messages.extend(_field_messages(model, e))
+
+    raw_items = raw.get("items")
+    if not isinstance(raw_items, list) or not raw_items:
+        messages.append("Нужна хотя бы одна позиция")
+        raw_items = []
+    item_model = posting[0]
+    items = []
+    for number, raw_item in enumerate(raw_items, start=1):
+        item = _parse_item(item_model, item_fields, raw_item, number, messages)
+        if item is not None:
+            items.append(item)
+    return ParsedDocument(index, key, type, document, items)
+
+
+def _parse_item(item_model, item_fields, raw, number, messages):
+    if not isinstance(raw, dict):
+        messages.append(f"Позиция {number}: должна быть объектом")
+        return None
+    values = {}
+    for field, reference in item_fields.items():
+        pk = raw.get(field)
+        if not _is_pk(pk) or pk not in reference_objects(reference):
+            messages.append(f"Позиция {number}: неизвестное значение {field}: {pk}")
+            return None
+        values[f"{field}_id"] = pk
+    if "to_location" in item_fields and values["from_location_id"] == values["to_location_id"]:
+        messages.append(f"Позиция {number}: место отправки и получения не должны совпадать")
+        return None
+    quantity = raw.get("quantity")
+    if isinstance(quantity, bool) or not isinstance(quantity, (str, int, float)):
+        messages.append(f"Позиция {number}: количество должно быть числом или строкой")
+        return None
+    try:
+        quantity = item_model._meta.get_field("quantity").clean(quantity, None)
+    except ValidationError as e:
+        messages.append(f"Позиция {number}: некорректное количество: {' '.join(e.messages)}")
+        return None
+    if quantity <= 0:
+        messages.append(f"Позиция {number}: количество должно быть больше нуля")
+        return None
+    return item_model(quantity=quantity, **values)
+
+
+def _field_messages(model, error):
+    return [
+        f"{model._meta.get_field(field).verbose_name}: {' '.join(messages)}"
+        for field, messages in error.message_dict.items()
+    ]
+
+
+def _is_pk(value):
+    # bool — подкласс int, но true/false из JSON ключом справочника не считаются
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _check_stock(documents):
+    # Пачка проводится несколькими upsert (по виду документа), поэтому строки
+    # всех её ключей блокируются заранее одним проходом в порядке сортировки
+    balances = lock_stock({key for parsed in documents for key in parsed.deltas()})
+    keys = {key for parsed in documents if parsed.type != "income" for key, delta in parsed.deltas().items()
+            if delta < 0}
+    running = defaultdict(lambda: 0, balances)
+
+    errors = []
+    for parsed in documents:
+        messages = []
+        for key, delta in sorted(parsed.deltas().items()):
+            if key not in keys:
+                continue
+            available = running[key]
+            running[key] += delta
+            if delta < 0 and running[key] < 0:
+                messages.append(shortage_message(key, available, -delta))
+        if messages:
+            errors.append({"index": parsed.index, "errors": messages})
+    if errors:
+        raise ApiError(409, "Недостаточно остатков", errors)
+
+
+def _save(user, documents):
+    by_type = defaultdict(list)
+    for parsed in documents:
+        by_type[parsed.type].append(parsed)
+
+    for type, parsed_documents in by_type.items():
+        model, posting, _ = DOCUMENT_TYPES[type]
+        model.objects.bulk_create([parsed.document for parsed in parsed_documents])
+        items = []
+        for parsed in parsed_documents:
+            for item in parsed.items:
+                setattr(item, posting[1], parsed.document)
+                items.append(item)
+        post_items(items, posting, locked=True)
+
+    try:
+        with transaction.atomic():
+            ApiIdempotencyKey.objects.bulk_create([
+                ApiIdempotencyKey(user=user, key=parsed.key, kind=parsed.posting[2], document_id=parsed.document.pk)
+                for parsed in documents
+            ])
+    except IntegrityError:
+        # Тот же ключ параллельно провёл другой запрос: повтор вернёт его результат
+        raise ApiError(409, "Документы с этими ключами уже проводятся, повторите запрос")
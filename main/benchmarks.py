@@ -0,0 +1,366 @@
+import asyncio
+import platform
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+
+import django
+import openpyxl
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.test import AsyncRequestFactory, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import views
+from .datagen import DataGenerator
+from .importing import IncomeImporter, read_income_rows
+from .models import (
+    Supplier, Material, Direction, Location, MaterialIncome, IncomeItem, TransferItem, MaterialWriteOff, WriteOffItem,
+    Stock
+)
+from .posting import post_income, post_writeoff
+from .report_cache import REPORT_CACHE_ALIAS
+
+BENCHMARK_REPEAT = 5
+BENCHMARK_POSTING_ITEMS = 50
+BENCHMARK_IMPORT_ROWS = 1000
+CONCURRENCY_VIEWS = (
+    "export_movement_csv", "export_movement_excel", "export_deficit_excel",
+    "report_movement", "report_deficit", "report_stock",
+)
+
+
+@contextmanager
+def uncached_reports():
+    """Отключает кэш отчётов, чтобы замер включал построение отчёта, а не чтение из кэша."""
+    dummy = {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+    with override_settings(CACHES={**settings.CACHES, REPORT_CACHE_ALIAS: dummy}):
+        yield
+
+
+def item_count():
+    return IncomeItem.objects.count() + TransferItem.objects.count() + WriteOffItem.objects.count()
+
+
+class Benchmark:
+    """Замеры ключевых страниц, выгрузок, проведения и импорта.
+
+    Каждый сценарий выполняется ``repeat`` раз после одного прогревочного
+    запуска; сохраняются время (мин./медиана/макс., секунды) и число SQL-запросов.
+    Отчёты и выгрузки замеряются без кэша отчётов; сценарий ``*_cached``
+    показывает повторный просмотр из кэша. Сценарии, меняющие данные,
+    выполняются в транзакции с откатом, чтобы объём базы не рос от замера к замеру.
+    """
+
+    def __init__(self, generator, repeat=BENCHMARK_REPEAT):
+        self.generator = generator
+        self.repeat = repeat
+        self.client = Client()
+        self.client.force_login(generator.user)
+        self.today = timezone.localdate()
+
+    def scenarios(self):
+        month_ago = (self.today - timedelta(days=30)).isoformat()
+        period = {"start": month_ago, "end": self.today.isoformat()}
+        return [
+            ("report_stock", self.view("report_stock")),
+            ("report_stock_cached", self.view("report_stock", cached=True)),
+            ("report_stock_search", self.view("report_stock", {"q": "материал 00001"})),
+            ("report_stock_as_of", self.view("report_stock", {"date": month_ago})),
+            ("report_movement", self.view("report_movement", period)),
+            ("report_deficit", self.view("report_deficit")),
+            ("export_movement_excel", self.view("export_movement_excel", period)),
+            ("export_movement_csv", self.view("export_movement_csv", period)),
+            ("export_deficit_excel", self.view("export_deficit_excel")),
+            ("post_income", self.rolled_back(self.post_income)),
+            ("post_writeoff", self.rolled_back(self.post_writeoff)),
+            ("import_income", self.rolled_back(self.import_income)),
+        ]
+
+    def run(self, size):
+        results = []
+        for name, scenario in self.scenarios():
+            scenario()
+            timings = []
+            for _ in range(self.repeat):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    scenario()
+                    timings.append(time.perf_counter() - started)
+            results.append({
+                "size": size,
+                "scenario": name,
+                "runs": self.repeat,
+                "min": round(min(timings), 6),
+                "median": round(statistics.median(timings), 6),
+                "max": round(max(timings), 6),
+                "queries": len(queries),
+            })
+        return results
+
+    def view(self, url_name, params=None, cached=False):
+        def scenario():
+            # testserver — хост тестового клиента Django
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                if cached:
+                    response = self.client.get(reverse(url_name), params or {})
+                else:
+                    with uncached_reports():
+                        response = self.client.get(reverse(url_name), params or {})
+            # Потоковый ответ читается до конца, клиент закрывает его сам
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            if response.status_code != 200:
+                raise RuntimeError(f"{url_name}: HTTP {response.status_code}")
+        return scenario
+
+    def rolled_back(self, action):
+        def scenario():
+            with transaction.atomic():
+                action()
+                transaction.set_rollback(True)
+        return scenario
+
+    def post_income(self):
+        generator = self.generator
+        post_income(
+            MaterialIncome(date=self.today, supplier_id=generator.supplier_ids[0], responsible=generator.user),
+            [
+                IncomeItem(
+                    material_id=generator.material_ids[n % len(generator.material_ids)],
+                    direction_id=generator.direction_ids[0], location_id=generator.location_ids[0],
+                    quantity=Decimal("10"),
+                )
+                for n in range(BENCHMARK_POSTING_ITEMS)
+            ],
+        )
+
+    def post_writeoff(self):
+        stocks = Stock.objects.filter(quantity__gt=1).order_by("-quantity")[:BENCHMARK_POSTING_ITEMS]
+        post_writeoff(
+            MaterialWriteOff(date=self.today, reason="Замер", responsible=self.generator.user),
+            [
+                WriteOffItem(
+                    material_id=stock.material_id, direction_id=stock.direction_id,
+                    location_id=stock.location_id, quantity=Decimal("1"),
+                )
+                for stock in stocks
+            ],
+        )
+
+    def import_income(self):
+        IncomeImporter(self.generator.user).run(read_income_rows(self.import_workbook()))
+
+    def import_workbook(self):
+        # Файл импорта строится один раз и переиспользуется во всех прогонах
+        if not hasattr(self, "_import_workbook"):
+            generator = self.generator
+            supplier = Supplier.objects.get(pk=generator.supplier_ids[0]).name
+            materials = list(Material.objects.filter(pk__in=generator.material_ids[:100]).values_list("name", flat=True))
+            direction = Direction.objects.get(pk=generator.direction_ids[0]).name
+            location = Location.objects.get(pk=generator.location_ids[0]).name
+            wb = openpyxl.Workbook(write_only=True)
+            ws = wb.create_sheet()
+            ws.append(["Дата", "Поставщик", "Материал", "Количество", "Направление", "Склад"])
+            for n in range(BENCHMARK_IMPORT_ROWS):
+                ws.append([self.today, supplier, materials[n % len(materials)], 5, direction, location])
+            output = BytesIO()
+            wb.save(output)
+            self._import_workbook = output.getvalue()
+        return BytesIO(self._import_workbook)
+
+
+def run_benchmarks(sizes, repeat=BENCHMARK_REPEAT, generator_options=None, progress=None):
+    """Доводит базу до каждого размера (в позициях документов) и снимает замеры.
+
+    Возвращает словарь, пригодный для сохранения в JSON и сравнения между версиями.
+    """
+    generator = DataGenerator(**(generator_options or {}))
+    results = []
+    for size in sorted(sizes):
+        missing = size - item_count()
+        if missing > 0:
+            if progress:
+                progress(f"Генерация {missing} позиций до размера {size}")
+            generator.generate(missing)
+        if progress:
+            progress(f"Замеры при {item_count()} позициях")
+        results.extend(Benchmark(generator, repeat).run(size))
+
+    return {
+        "meta": {
+            "created_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+class ConcurrencyBenchmark:
+    """Одновременные медленные скачивания отчёта под WSGI и под ASGI.
+
+    WSGI: пул из ``workers`` потоков с синхронным представлением, как
+    синхронные воркеры gunicorn; поток занят запросом до конца отдачи.
+    ASGI: все ``clients`` запросов сразу в одном цикле событий с
+    async-версией представления, каждый в своём ThreadSensitiveContext,
+    как в ASGIHandler. Медленный клиент читает ответ со скоростью
+    ``bandwidth`` байт/с. Сеть и сервер не участвуют: представления
+    вызываются напрямую, поэтому сравнивается именно занятость воркеров.
+    Кэш отчётов отключён: каждый запрос строит отчёт заново.
+    """
+
+    def __init__(self, user, view_name, params=None, clients=20, workers=4, bandwidth=1_000_000):
+        self.user = user
+        self.view_name = view_name
+        self.params = params or {}
+        self.clients = clients
+        self.workers = workers
+        self.bandwidth = bandwidth
+        self.path = reverse(view_name)
+
+    def run(self):
+        with uncached_reports():
+            return {"wsgi": self.run_wsgi(), "asgi": self.run_asgi()}
+
+    def run_wsgi(self):
+        view = getattr(views, self.view_name)
+        tracker = _InFlight()
+
+        def request(started):
+            http_request = RequestFactory().get(self.path, self.params)
+            http_request.user = self.user
+            try:
+                with tracker:
+                    response = view(http_request)
+                    size = 0
+                    owed = 0.0
+                    for chunk in response:
+                        size += len(chunk)
+                        owed += len(chunk) / self.bandwidth
+                        if owed >= 0.01:
+                            time.sleep(owed)
+                            owed = 0.0
+                    time.sleep(owed)
+                    response.close()
+                return time.perf_counter() - started, size
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(self.workers) as pool:
+            results = list(pool.map(request, [started] * self.clients))
+        return _concurrency_stats(results, time.perf_counter() - started, tracker.peak)
+
+    def run_asgi(self):
+        return asyncio.run(self._run_asgi())
+
+    async def _run_asgi(self):
+        view = getattr(views, f"{self.view_name}_async")
+        tracker = _InFlight()
+
+        async def auser():
+            return self.user
+
+        async def request(started):
+            http_request = AsyncRequestFactory().get(self.path, self.params)
+            http_request.user = self.user
+            http_request.auser = auser
+            async with ThreadSensitiveContext():
+                try:
+                    with tracker:
+                        response = await view(http_request)
+                        size = 0
+                        owed = 0.0
+                        chunks = response if response.streaming else [response.content]
+                        async for chunk in _aiter(chunks):
+                            size += len(chunk)
+                            owed += len(chunk) / self.bandwidth
+                            if owed >= 0.01:
+                                await asyncio.sleep(owed)
+                                owed = 0.0
+                        await asyncio.sleep(owed)
+                        await sync_to_async(response.close)()
+                    return time.perf_counter() - started, size
+                finally:
+                    await sync_to_async(connections.close_all)()
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(request(started) for _ in range(self.clients)))
+        return _concurrency_stats(results, time.perf_counter() - started, tracker.peak)
+
+
+class _InFlight:
+    """Счётчик одновременно обслуживаемых запросов и его максимум."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.current -= 1
+
+
+async def _aiter(chunks):
+    if hasattr(chunks, "__aiter__"):
+        async for chunk in chunks:
+            yield chunk
+    else:
+        for chunk in chunks:
+            yield chunk
+
+
+def _concurrency_stats(results, elapsed, peak):
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "requests": len(results),
+        "elapsed": round(elapsed, 3),
+        "throughput": round(len(results) / elapsed, 2) if elapsed else None,
+        "latency_p50": round(latencies[len(latencies) // 2], 3),
+        "latency_p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+        "latency_max": round(latencies[-1], 3),
+        "peak_in_flight": peak,
+        "bytes": sum(size for _, size in results),
+    }
+
+
+def run_concurrency_benchmark(user, view_names, params=None, clients=20, workers=4, bandwidth=1_000_000,
+                              progress=None):
+    """Сравнивает WSGI и ASGI для каждого представления из ``view_names``."""
+    results = []
+    for view_name in view_names:
+        if progress:
+            progress(f"{view_name}: {clients} клиентов, {workers} воркеров WSGI")
+        benchmark = ConcurrencyBenchmark(user, view_name, params, clients, workers, bandwidth)
+        for server, stats in benchmark.run().items():
+            results.append({"view": view_name, "server": server, **stats})
+    return {
+        "meta": {
+            "created_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "clients": clients,
+            "workers": workers,
+            "bandwidth": bandwidth,
+        },
+        "results": results,
+    }
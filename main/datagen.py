@@ -0,0 +1,168 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    Unit, Supplier, Material, Direction, Location,
+    MaterialIncome, IncomeItem, MaterialTransfer, TransferItem, MaterialWriteOff, WriteOffItem
+)
+from .posting import INCOME_POSTING, TRANSFER_POSTING, WRITEOFF_POSTING, post_items
+from .reference import REFERENCE_MODELS, bump_reference_version
+from .search import reset_material_index
+
+# Позиций в одной транзакции генератора
+GENERATE_BATCH_SIZE = 10000
+# Сколько последних ключей поступлений помнит генератор для перемещений и списаний
+RECENT_KEYS = 100000
+
+DATA_PREFIX = "Тест"
+UNITS = ["шт", "кг", "м", "л", "упак", "компл"]
+WRITEOFF_REASONS = ["Брак", "Использовано в производстве", "Порча", "Инвентаризация"]
+
+
+class DataGenerator:
+    """Заполняет базу синтетическими справочниками и документами для замеров.
+
+    Справочники создаются с префиксом ``DATA_PREFIX`` и переиспользуются при
+    повторном запуске. Документы пишутся пачками через bulk_create и проводятся
+    тем же кодом, что и обычные документы, поэтому журнал движений и Stock
+    остаются согласованными. Перемещения и списания берут ключи из недавних
+    поступлений, так что остатки в основном не уходят в минус.
+    """
+
+    def __init__(self, materials=1000, locations=20, directions=5, suppliers=200, days=365, seed=None,
+                 batch_size=GENERATE_BATCH_SIZE):
+        self.random = random.Random(seed)
+        self.days = days
+        self.batch_size = batch_size
+        self.today = timezone.localdate()
+        self.user = self._ensure_user()
+        units = self._ensure(Unit, [{"name": name} for name in UNITS], "name", prefix="")
+        self.material_ids = self._ensure(Material, [
+            {"name": f"{DATA_PREFIX} материал {n:07d}", "article": f"T-{n:07d}", "unit_id": self.random.choice(units)}
+            for n in range(1, materials + 1)
+        ], "name")
+        self.location_ids = self._ensure(
+            Location, [{"name": f"{DATA_PREFIX} склад {n:04d}"} for n in range(1, locations + 1)], "name"
+        )
+        self.direction_ids = self._ensure(
+            Direction, [{"name": f"{DATA_PREFIX} направление {n:03d}"} for n in range(1, directions + 1)], "name"
+        )
+        self.supplier_ids = self._ensure(
+            Supplier, [{"name": f"{DATA_PREFIX} поставщик {n:05d}"} for n in range(1, suppliers + 1)], "name"
+        )
+        # bulk_create не вызывает сигналы, кэши справочников сбрасываются вручную
+        for name in REFERENCE_MODELS:
+            bump_reference_version(name)
+        reset_material_index()
+        self.recent_keys = []
+        self.items_created = 0
+        self.documents_created = 0
+
+    def generate(self, items, items_per_document=10):
+        """Создаёт документы, пока не наберётся ``items`` позиций (60% поступлений)."""
+        target = self.items_created + items
+        while self.items_created < target:
+            with transaction.atomic():
+                self._generate_batch(min(self.batch_size, target - self.items_created), items_per_document)
+        return self
+
+    def _generate_batch(self, items, items_per_document):
+        plan = []
+        left = items
+        while left > 0:
+            size = min(left, self.random.randint(1, 2 * items_per_document - 1))
+            roll = self.random.random()
+            kind = "income" if roll < 0.6 or not self.recent_keys else "transfer" if roll < 0.85 else "writeoff"
+            plan.append((kind, size))
+            left -= size
+
+        documents = {"income": [], "transfer": [], "writeoff": []}
+        for kind, size in plan:
+            documents[kind].append((self._document(kind), size))
+        for kind, model in (("income", MaterialIncome), ("transfer", MaterialTransfer),
+                            ("writeoff", MaterialWriteOff)):
+            model.objects.bulk_create([document for document, _ in documents[kind]])
+
+        # Поступления проводятся первыми, чтобы их ключи были доступны списаниям пачки
+        post_items(self._income_items(documents["income"]), INCOME_POSTING)
+        post_items(self._transfer_items(documents["transfer"]), TRANSFER_POSTING)
+        post_items(self._writeoff_items(documents["writeoff"]), WRITEOFF_POSTING)
+        self.items_created += items
+        self.documents_created += len(plan)
+
+    def _document(self, kind):
+        day = self.today - timedelta(days=self.random.randrange(self.days))
+        number = f"{DATA_PREFIX}-{self.random.randrange(10 ** 8):08d}"
+        if kind == "income":
+            return MaterialIncome(date=day, document_number=number, responsible=self.user,
+                                  supplier_id=self.random.choice(self.supplier_ids))
+        if kind == "transfer":
+            return MaterialTransfer(date=day, document_number=number, responsible=self.user)
+        return MaterialWriteOff(date=day, document_number=number, responsible=self.user,
+                                reason=self.random.choice(WRITEOFF_REASONS))
+
+    def _income_items(self, documents):
+        items = []
+        for document, size in documents:
+            for _ in range(size):
+                key = (
+                    self.random.choice(self.material_ids),
+                    self.random.choice(self.direction_ids),
+                    self.random.choice(self.location_ids),
+                )
+                self._remember(key)
+                items.append(IncomeItem(
+                    income=document, material_id=key[0], direction_id=key[1], location_id=key[2],
+                    quantity=self._quantity(50, 500),
+                ))
+        return items
+
+    def _transfer_items(self, documents):
+        items = []
+        for document, size in documents:
+            for _ in range(size):
+                material_id, direction_id, location_id = self.random.choice(self.recent_keys)
+                to_key = (material_id, self.random.choice(self.direction_ids), self.random.choice(self.location_ids))
+                self._remember(to_key)
+                items.append(TransferItem(
+                    transfer=document, material_id=material_id, quantity=self._quantity(1, 20),
+                    from_direction_id=direction_id, from_location_id=location_id,
+                    to_direction_id=to_key[1], to_location_id=to_key[2],
+                ))
+        return items
+
+    def _writeoff_items(self, documents):
+        items = []
+        for document, size in documents:
+            for _ in range(size):
+                material_id, direction_id, location_id = self.random.choice(self.recent_keys)
+                items.append(WriteOffItem(
+                    writeoff=document, material_id=material_id, direction_id=direction_id,
+                    location_id=location_id, quantity=self._quantity(1, 20),
+                ))
+        return items
+
+    def _remember(self, key):
+        if len(self.recent_keys) < RECENT_KEYS:
+            self.recent_keys.append(key)
+        else:
+            self.recent_keys[self.random.randrange(RECENT_KEYS)] = key
+
+    def _quantity(self, low, high):
+        return Decimal(self.random.randint(low * 1000, high * 1000)) / 1000
+
+    def _ensure_user(self):
+        user, _ = User.objects.get_or_create(username="benchmark", defaults={"first_name": "Замеры"})
+        return user
+
+    def _ensure(self, model, rows, field, prefix=DATA_PREFIX):
+        model.objects.bulk_create([model(**row) for row in rows], batch_size=5000, ignore_conflicts=True)
+        names = [row[field] for row in rows]
+        queryset = model.objects.filter(**{f"{field}__startswith": prefix}) if prefix else model.objects.all()
+        wanted = set(names)
+        return sorted(pk for pk, name in queryset.values_list("pk", field).iterator() if name in wanted)
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .exporting import MOVEMENT_HEADER, DEFICIT_HEADER, movement_rows, deficit_rows, write_xlsx, iter_csv
+from .models import ExportJob
+from .report_cache import data_version
+
+EXPORT_JOB_STALE_AFTER = timedelta(minutes=10)
+EXPORT_HEARTBEAT_INTERVAL = 30
+# Готовые файлы удаляются, если к ним не обращались дольше этого срока
+# или если их общий размер превышает предел (сначала давно не использованные)
+EXPORT_CACHE_MAX_AGE = timedelta(days=7)
+EXPORT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+EXPORT_EXTENSIONS = {
+    ExportJob.MOVEMENT_XLSX: "xlsx",
+    ExportJob.MOVEMENT_CSV: "csv",
+    ExportJob.DEFICIT_XLSX: "xlsx",
+}
+PERIOD_KINDS = {ExportJob.MOVEMENT_XLSX, ExportJob.MOVEMENT_CSV}
+
+
+def normalize_params(kind, params):
+    """Оставляет только значимые параметры в каноническом виде.
+
+    Период задаётся только целиком; неполный или некорректный означает
+    выгрузку за всё время, как и в синхронных выгрузках.
+    """
+    if kind not in PERIOD_KINDS:
+        return {}
+    try:
+        start = date.fromisoformat(params.get("start") or "")
+        end = date.fromisoformat(params.get("end") or "")
+    except ValueError:
+        return {}
+    return {"start": start.isoformat(), "end": end.isoformat()}
+
+
+def export_cache_key(kind, params):
+    """Ключ файла выгрузки: вид, параметры и версия данных из БД (см. ``data_version``).
+
+    Версия берётся из DataVersion, а не из кэша процесса, поэтому одинаковые
+    запросы к разным веб-процессам получают один ключ и один файл.
+    """
+    source = json.dumps([kind, params, data_version()], sort_keys=True)
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def request_export(user, kind, params):
+    """Задание выгрузки пользователя для запроса: готовое или уже стоящее в очереди, иначе новое.
+
+    Задания принадлежат пользователю, а файлы — общие: если такой файл уже
+    построен для другого пользователя, новое задание сразу получает его.
+    """
+    params = normalize_params(kind, params)
+    cache_key = export_cache_key(kind, params)
+    active = [ExportJob.STATUS_PENDING, ExportJob.STATUS_RUNNING, ExportJob.STATUS_DONE]
+    jobs = [
+        job for job in ExportJob.objects.filter(cache_key=cache_key, status__in=active).order_by("-created_at")
+        if job.status != ExportJob.STATUS_DONE or default_storage.exists(job.file.name)
+    ]
+    own = next((job for job in jobs if job.user_id == user.pk), None)
+    if own is not None:
+        ExportJob.objects.filter(pk=own.pk).update(last_used_at=timezone.now())
+        return own
+
+    job = ExportJob(kind=kind, params=params, cache_key=cache_key, user=user)
+    done = next((other for other in jobs if other.status == ExportJob.STATUS_DONE), None)
+    if done is not None:
+        job.file.name = done.file.name
+        job.size = done.size
+        job.status = ExportJob.STATUS_DONE
+        job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def _claimable(stale_after):
+    stale = timezone.now() - stale_after
+    return Q(status=ExportJob.STATUS_PENDING) | Q(status=ExportJob.STATUS_RUNNING, heartbeat_at__lt=stale)
+
+
+def claim_next_export(stale_after=EXPORT_JOB_STALE_AFTER):
+    """Забирает первое задание из очереди или зависшее задание упавшего обработчика.
+
+    Захват — условный UPDATE, поэтому несколько процессов не возьмут одно задание.
+    """
+    condition = _claimable(stale_after)
+    for pk in ExportJob.objects.filter(condition).order_by("created_at").values_list("pk", flat=True)[:10]:
+        claimed = ExportJob.objects.filter(condition, pk=pk).update(
+            status=ExportJob.STATUS_RUNNING, heartbeat_at=timezone.now()
+        )
+        if claimed:
+            return ExportJob.objects.get(pk=pk)
+    return None
+
+
+def run_export_job(job):
+    """Строит файл выгрузки на диске и отмечает задание готовым.
+
+    Файл пишется под временным именем и переименовывается после записи,
+    поэтому скачивание никогда не получит недописанный файл.
+    """
+    partial = None
+    try:
+        name = f"exports/{job.cache_key}.{EXPORT_EXTENSIONS[job.kind]}"
+        path = default_storage.path(name)
+        partial = f"{path}.{os.getpid()}.part"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(partial, "wb") as output:
+            _render(job.kind, job.params, output, lambda rows: _with_heartbeat(job, rows))
+        os.replace(partial, path)
+    except Exception as e:
+        if partial and os.path.exists(partial):
+            os.remove(partial)
+        ExportJob.objects.filter(pk=job.pk).update(
+            status=ExportJob.STATUS_FAILED, message=str(e), finished_at=timezone.now()
+        )
+        raise
+    job.file.name = name
+    job.size = os.path.getsize(path)
+    job.status = ExportJob.STATUS_DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=["file", "size", "status", "finished_at"])
+    # Такие же задания других пользователей, ждущие в очереди, получают этот файл
+    ExportJob.objects.filter(cache_key=job.cache_key, status=ExportJob.STATUS_PENDING).update(
+        file=name, size=job.size, status=ExportJob.STATUS_DONE, finished_at=job.finished_at
+    )
+    return job
+
+
+def _render(kind, params, output, track):
+    start = date.fromisoformat(params["start"]) if params.get("start") else None
+    end = date.fromisoformat(params["end"]) if params.get("end") else None
+    if kind == ExportJob.MOVEMENT_XLSX:
+        write_xlsx("Движение", MOVEMENT_HEADER, track(movement_rows(start, end)), output)
+    elif kind == ExportJob.MOVEMENT_CSV:
+        for chunk in iter_csv(MOVEMENT_HEADER, track(movement_rows(start, end))):
+            output.write(chunk)
+    else:
+        write_xlsx("Дефицит", DEFICIT_HEADER, track(deficit_rows()), output)
+
+
+def _with_heartbeat(job, rows):
+    # Долгая выгрузка отмечается живой, чтобы её не забрал другой процесс
+    last = time.monotonic()
+    for row in rows:
+        if time.monotonic() - last > EXPORT_HEARTBEAT_INTERVAL:
+            ExportJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now())
+            last = time.monotonic()
+        yield row
+
+
+def evict_exports(max_age=None, max_bytes=None):
+    """Удаляет старые файлы и задания выгрузок; возвращает число удалённых заданий.
+
+    Сначала удаляются завершённые задания без обращений дольше ``max_age``,
+    затем, пока общий размер файлов больше ``max_bytes``, — давно не
+    использованные. Задания в работе не трогаются.
+    """
+    if max_age is None:
+        max_age = getattr(settings, "EXPORT_CACHE_MAX_AGE", EXPORT_CACHE_MAX_AGE)
+    if max_bytes is None:
+        max_bytes = getattr(settings, "EXPORT_CACHE_MAX_BYTES", EXPORT_CACHE_MAX_BYTES)
+    finished = ExportJob.objects.filter(status__in=[ExportJob.STATUS_DONE, ExportJob.STATUS_FAILED])
+    expired = list(finished.filter(last_used_at__lt=timezone.now() - max_age))
+
+    total = finished.exclude(pk__in=[job.pk for job in expired]).aggregate(total=Sum("size"))["total"] or 0
+    if total > max_bytes:
+        for job in finished.exclude(pk__in=[job.pk for job in expired]).order_by("last_used_at").iterator():
+            if total <= max_bytes:
+                break
+            expired.append(job)
+            total -= job.size
+
+    for job in expired:
+        # Один файл может принадлежать нескольким заданиям с тем же ключом
+        if job.file.name and not ExportJob.objects.filter(file=job.file.name).exclude(
+            pk__in=[other.pk for other in expired]
+        ).exists():
+            default_storage.delete(job.file.name)
+        job.delete()
+    return len(expired)
@@ -0,0 +1,218 @@
+import csv
+import tempfile
+from datetime import datetime
+
+import openpyxl
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .metrics import export_bytes
+from .models import IncomeItem, TransferItem, WriteOffItem
+from .stock import below_minimum_stocks
+
+EXPORT_CHUNK_SIZE = 2000
+FILE_CHUNK_SIZE = 64 * 1024
+
+MOVEMENT_HEADER = ["Тип", "Дата", "Описание", "Материал", "Кол-во", "Склад/Направление"]
+
+DEFICIT_HEADER = ["Материал", "Артикул", "Остаток", "Минимум", "Ед. изм.", "Склад", "Направление"]
+
+TURNOVER_HEADER = [
+    "Материал", "Артикул", "Ед. изм.", "Склад", "Направление", "Остаток на начало", "Поступило",
+    "Перемещено сюда", "Перемещено отсюда", "Списано", "Остаток на конец",
+]
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+
+def movement_rows(start_date=None, end_date=None):
+    """Строки отчёта по движению без загрузки всего периода в память.
+
+    Для каждого типа документа выполняется один запрос со всеми нужными
+    JOIN, результаты читаются порциями через ``iterator()``.
+    """
+    for queryset, row in _movement_sources(start_date, end_date):
+        for item in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield row(item)
+
+
+async def amovement_rows(start_date=None, end_date=None):
+    """То же для асинхронных представлений: порции читаются через ``aiterator()``."""
+    for queryset, row in _movement_sources(start_date, end_date):
+        async for item in queryset.aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield row(item)
+
+
+def _movement_sources(start_date, end_date):
+    incomes = IncomeItem.objects.select_related(
+        "income__supplier", "material", "direction", "location"
+    ).order_by("income__date", "income_id", "id")
+    transfers = TransferItem.objects.select_related(
+        "transfer", "material", "from_direction", "from_location", "to_direction", "to_location"
+    ).order_by("transfer__date", "transfer_id", "id")
+    writeoffs = WriteOffItem.objects.select_related(
+        "writeoff", "material", "direction", "location"
+    ).order_by("writeoff__date", "writeoff_id", "id")
+
+    if start_date and end_date:
+        incomes = incomes.filter(income__date__range=(start_date, end_date))
+        transfers = transfers.filter(transfer__date__range=(start_date, end_date))
+        writeoffs = writeoffs.filter(writeoff__date__range=(start_date, end_date))
+
+    return [(incomes, _income_row), (transfers, _transfer_row), (writeoffs, _writeoff_row)]
+
+
+def _income_row(item):
+    return [
+        "Поступление",
+        item.income.date,
+        f"Поставщик: {item.income.supplier}",
+        item.material.name,
+        float(item.quantity),
+        f"{item.location} / {item.direction}",
+    ]
+
+
+def _transfer_row(item):
+    return [
+        "Перемещение",
+        item.transfer.date,
+        f"{item.from_location} → {item.to_location}",
+        item.material.name,
+        float(item.quantity),
+        f"{item.from_direction} → {item.to_direction}",
+    ]
+
+
+def _writeoff_row(item):
+    return [
+        "Списание",
+        item.writeoff.date,
+        item.writeoff.reason,
+        item.material.name,
+        float(item.quantity),
+        f"{item.location} / {item.direction}",
+    ]
+
+
+def deficit_stocks():
+    return below_minimum_stocks().select_related(
+        "material__unit", "location", "direction"
+    ).order_by("material__name", "location__name", "direction__name")
+
+
+def deficit_rows():
+    for stock in deficit_stocks().iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [
+            stock.material.name,
+            stock.material.article,
+            float(stock.quantity),
+            float(stock.min_quantity),
+            stock.material.unit.name,
+            stock.location.name,
+            stock.direction.name,
+        ]
+
+
+def turnover_rows(statement):
+    for row in statement:
+        yield list(row[:5]) + [float(value) for value in row[5:]]
+
+
+def write_xlsx(title, header, rows, output=None):
+    """Пишет строки в XLSX в режиме write-only и возвращает файл ``output``.
+
+    openpyxl сбрасывает строки на диск по мере записи, поэтому память
+    не растёт с количеством строк. Без ``output`` пишется временный файл.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    if output is None:
+        output = tempfile.TemporaryFile()
+    wb.save(output)
+    export_bytes.inc(output.tell(), format="xlsx")
+    output.seek(0)
+    return output
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def iter_csv(header, rows):
+    """Отдаёт CSV построчно в UTF-8 (с BOM и разделителем «;» для Excel)."""
+    writer = csv.writer(_Echo(), delimiter=";")
+    sent = 0
+    try:
+        line = ("\ufeff" + writer.writerow(header)).encode("utf-8")
+        sent += len(line)
+        yield line
+        for row in rows:
+            line = writer.writerow(row).encode("utf-8")
+            sent += len(line)
+            yield line
+    finally:
+        # Счётчик обновляется один раз, в том числе при обрыве загрузки
+        export_bytes.inc(sent, format="csv")
+
+
+async def aiter_csv(header, rows):
+    """То же по асинхронному итератору строк (для async-представлений под ASGI)."""
+    writer = csv.writer(_Echo(), delimiter=";")
+    sent = 0
+    try:
+        line = ("\ufeff" + writer.writerow(header)).encode("utf-8")
+        sent += len(line)
+        yield line
+        async for row in rows:
+            line = writer.writerow(row).encode("utf-8")
+            sent += len(line)
+            yield line
+    finally:
+        export_bytes.inc(sent, format="csv")
+
+
+async def aiter_file(file, chunk_size=FILE_CHUNK_SIZE):
+    """Отдаёт временный файл выгрузки кусками и закрывает его.
+
+    Синхронный итератор ответа под ASGI Django дочитывает в память целиком;
+    чтение локального временного файла короткое и идёт прямо в цикле событий.
+    """
+    try:
+        while chunk := file.read(chunk_size):
+            yield chunk
+    finally:
+        file.close()
+
+
+class _NdjsonEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder обрезает время до миллисекунд, а оно служит курсором выгрузки
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def iter_ndjson(rows):
+    """Отдаёт словари строками JSON (NDJSON), склеивая их в куски по EXPORT_CHUNK_SIZE."""
+    encoder = _NdjsonEncoder(ensure_ascii=False)
+    sent = 0
+    try:
+        lines = []
+        for row in rows:
+            lines.append(encoder.encode(row))
+            if len(lines) >= EXPORT_CHUNK_SIZE:
+                chunk = ("\n".join(lines) + "\n").encode("utf-8")
+                lines = []
+                sent += len(chunk)
+                yield chunk
+        if lines:
+            chunk = ("\n".join(lines) + "\n").encode("utf-8")
+            sent += len(chunk)
+            yield chunk
+    finally:
+        export_bytes.inc(sent, format="ndjson")
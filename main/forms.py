@@ -1,11 +1,14 @@
 from django import forms
 from django.core.exceptions import ValidationError
-from django.forms import inlineformset_factory
+from django.forms import BaseInlineFormSet, inlineformset_factory
 from django.utils import timezone
 from main.models import (
     Material, Direction, Location, Supplier, MaterialIncome, IncomeItem,
-    MaterialTransfer, TransferItem, MaterialWriteOff, WriteOffItem, Stock
+    MaterialTransfer, TransferItem, MaterialWriteOff, WriteOffItem
 )
+from main.reference import ReferenceChoiceField, ReferenceModelForm
+from main.stock import outgoing_quantities, shortage_message, stock_shortages, transfer_item_deltas, \
+    writeoff_item_deltas
 
 
 class CustomLoginForm(forms.Form):
@@ -16,7 +19,7 @@ class CustomLoginForm(forms.Form):
 class MaterialForm(forms.ModelForm):
     class Meta:
         model = Material
-        fields = ["name", "article", "unit"]
+        fields = ["name", "article", "unit", "min_quantity"]
 
 
 class DirectionForm(forms.ModelForm):
@@ -65,7 +68,11 @@ class MaterialIncomeForm(forms.ModelForm):
         return date
 
 
-class IncomeItemForm(forms.ModelForm):
+class IncomeItemForm(ReferenceModelForm):
+    material = ReferenceChoiceField("material")
+    direction = ReferenceChoiceField("direction")
+    location = ReferenceChoiceField("location")
+
     class Meta:
         model = IncomeItem
         fields = ["material", "quantity", "direction", "location"]
@@ -87,6 +94,37 @@ IncomeItemFormSet = inlineformset_factory(
 )
 
 
+class BaseStockCheckFormSet(BaseInlineFormSet):
+    """Проверка остатков по всему документу одним запросом.
+
+    Количества строк с одинаковым ключом (материал, направление, склад)
+    суммируются; окончательная проверка под блокировкой строк Stock
+    выполняется при проведении документа.
+    """
+    item_deltas = None  # функция изменений остатков по позиции, см. main.stock
+
+    def clean(self):
+        super().clean()
+        if any(self.errors):
+            return
+        entries = []
+        for form in self.forms:
+            if not form.has_changed() or self._should_delete_form(form):
+                continue
+            entries.extend(self.item_deltas(form.instance))
+        shortages = stock_shortages(outgoing_quantities(entries))
+        if shortages:
+            raise ValidationError([shortage_message(*shortage) for shortage in shortages])
+
+
+class TransferStockCheckFormSet(BaseStockCheckFormSet):
+    item_deltas = staticmethod(transfer_item_deltas)
+
+
+class WriteOffStockCheckFormSet(BaseStockCheckFormSet):
+    item_deltas = staticmethod(writeoff_item_deltas)
+
+
 class MaterialTransferForm(forms.ModelForm):
     class Meta:
         model = MaterialTransfer
@@ -99,7 +137,13 @@ class MaterialTransferForm(forms.ModelForm):
         return date
 
 
-class TransferItemForm(forms.ModelForm):
+class TransferItemForm(ReferenceModelForm):
+    material = ReferenceChoiceField("material")
+    from_direction = ReferenceChoiceField("direction")
+    from_location = ReferenceChoiceField("location")
+    to_direction = ReferenceChoiceField("direction")
+    to_location = ReferenceChoiceField("location")
+
     class Meta:
         model = TransferItem
         fields = ["material", "quantity", "from_direction", "from_location", "to_direction", "to_location"]
@@ -117,6 +161,7 @@ TransferItemFormSet = inlineformset_factory(
     MaterialTransfer,
     TransferItem,
     form=TransferItemForm,
+    formset=TransferStockCheckFormSet,
     extra=1,
     can_delete=True
 )
@@ -134,34 +179,21 @@ class MaterialWriteOffForm(forms.ModelForm):
         return date
 
 
-class WriteOffItemForm(forms.ModelForm):
+class WriteOffItemForm(ReferenceModelForm):
+    material = ReferenceChoiceField("material")
+    direction = ReferenceChoiceField("direction")
+    location = ReferenceChoiceField("location")
+
     class Meta:
         model = WriteOffItem
         fields = ["material", "quantity", "direction", "location"]
 
-    def clean(self):
-        cleaned_data = super().clean()
-        material = cleaned_data.get("material")
-        direction = cleaned_data.get("direction")
-        location = cleaned_data.get("location")
-        quantity = cleaned_data.get("quantity")
-
-        if material and direction and location and quantity:
-            stock = Stock.objects.filter(
-                material=material, direction=direction, location=location
-            ).first()
-
-            available = stock.quantity if stock else 0
-            if quantity > available:
-                raise ValidationError(
-                    f"Недостаточно остатков: доступно {available}, вы пытаетесь списать {quantity}"
-                )
-
 
 WriteOffItemFormSet = inlineformset_factory(
     MaterialWriteOff,
     WriteOffItem,
     form=WriteOffItemForm,
+    formset=WriteOffStockCheckFormSet,
     extra=1,
     can_delete=True
 )
\ No newline at end of file
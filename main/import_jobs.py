@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .importing import IncomeImporter, read_income_rows
+from .models import ImportJob
+
+IMPORT_JOB_STALE_AFTER = timedelta(minutes=10)
+MAX_STORED_ERRORS = 1000
+
+
+class JobIncomeImporter(IncomeImporter):
+    """Импорт, сохраняющий прогресс задания в транзакции каждой пачки.
+
+    Если обработчик упадёт, задание продолжится со строки после последней
+    сохранённой пачки. Группировка строк в документы при продолжении
+    начинается заново, уже созданные поступления не дополняются.
+    """
+
+    def __init__(self, job, **kwargs):
+        super().__init__(job.user, group=job.group, **kwargs)
+        self.job = job
+        self.last_row = job.last_row
+        self.created_docs = job.created_docs
+        self.imported_rows = job.imported_rows
+        self.errors = [tuple(error) for error in job.errors]
+        self.dropped_errors = job.error_count - len(job.errors)
+
+    def chunk_saved(self):
+        self.save_progress()
+
+    def save_progress(self, **extra):
+        ImportJob.objects.filter(pk=self.job.pk).update(
+            last_row=self.last_row,
+            created_docs=self.created_docs,
+            imported_rows=self.imported_rows,
+            errors=self.errors[:MAX_STORED_ERRORS],
+            error_count=self.dropped_errors + len(self.errors),
+            heartbeat_at=timezone.now(),
+            **extra
+        )
+
+
+def _claimable(stale_after):
+    stale = timezone.now() - stale_after
+    return Q(status=ImportJob.STATUS_PENDING) | Q(status=ImportJob.STATUS_RUNNING, heartbeat_at__lt=stale)
+
+
+def claim_next_job(stale_after=IMPORT_JOB_STALE_AFTER):
+    """Забирает первое задание из очереди или зависшее задание упавшего обработчика.
+
+    Захват — условный UPDATE, поэтому несколько обработчиков не возьмут одно задание.
+    """
+    condition = _claimable(stale_after)
+    for pk in ImportJob.objects.filter(condition).order_by("created_at").values_list("pk", flat=True)[:10]:
+        claimed = ImportJob.objects.filter(condition, pk=pk).update(
+            status=ImportJob.STATUS_RUNNING, heartbeat_at=timezone.now()
+        )
+        if claimed:
+            return ImportJob.objects.select_related("user").get(pk=pk)
+    return None
+
+
+def run_import_job(job):
+    importer = JobIncomeImporter(job)
+    try:
+        with job.file.open("rb") as f:
+            importer.run(read_income_rows(f, start_row=job.last_row + 1))
+    except Exception as e:
+        importer.save_progress(status=ImportJob.STATUS_FAILED, message=str(e), finished_at=timezone.now())
+        raise
+    importer.save_progress(status=ImportJob.STATUS_DONE, finished_at=timezone.now())
+    return importer
@@ -0,0 +1,199 @@
+from datetime import date, datetime
+
+import openpyxl
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+
+from .metrics import import_chunk_seconds, import_rows
+from .models import Material, Direction, Location, Supplier, MaterialIncome, IncomeItem
+from .posting import post_income_items
+
+IMPORT_CHUNK_SIZE = 1000
+
+
+def read_income_rows(file, start_row=2):
+    """Построчно читает лист Excel в режиме read-only.
+
+    Возвращает пары (номер строки, кортеж значений); весь файл в память не грузится.
+    """
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        for row_num, values in enumerate(ws.iter_rows(min_row=start_row, values_only=True), start=start_row):
+            if not values or all(value in (None, "") for value in values):
+                continue
+            yield row_num, values
+    finally:
+        wb.close()
+
+
+class IncomeImporter:
+    """Импорт поступлений пачками с кэшем справочников.
+
+    Справочники загружаются одним запросом на модель, строки проверяются
+    без обращения к БД, а каждая пачка сохраняется в своей транзакции через
+    bulk_create. Ошибочные строки попадают в ``errors`` и не прерывают импорт.
+
+    При ``group=True`` строки с одинаковыми (дата, поставщик, номер документа)
+    объединяются в одно поступление.
+    """
+
+    def __init__(self, user, group=False, chunk_size=IMPORT_CHUNK_SIZE):
+        self.user = user
+        self.group = group
+        self.chunk_size = chunk_size
+        self.materials = dict(Material.objects.values_list("name", "id"))
+        self.directions = dict(Direction.objects.values_list("name", "id"))
+        self.locations = dict(Location.objects.values_list("name", "id"))
+        self.suppliers = dict(Supplier.objects.values_list("name", "id"))
+        self.documents = {}
+        self.last_row = None
+        self.created_docs = 0
+        self.imported_rows = 0
+        self.errors = []
+
+    def run(self, rows):
+        chunk = []
+        for row_num, values in rows:
+            self.last_row = row_num
+            parsed = self.parse_row(row_num, values)
+            if parsed is not None:
+                chunk.append(parsed)
+            else:
+                import_rows.inc(result="error")
+            if len(chunk) >= self.chunk_size:
+                self.save_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.save_chunk(chunk)
+        return self
+
+    def parse_row(self, row_num, values):
+        values = tuple(values) + (None,) * (7 - len(values))
+        raw_date, supplier_name, material_name, raw_quantity, direction_name, location_name, doc_number = values[:7]
+
+        try:
+            doc_date = _parse_date(raw_date)
+            quantity = _parse_quantity(raw_quantity)
+        except ValueError as e:
+            self.errors.append((row_num, str(e)))
+            return None
+
+        supplier_name = _clean_name(supplier_name)
+        if not supplier_name:
+            self.errors.append((row_num, "Не указан поставщик"))
+            return None
+
+        material_id = self.materials.get(_clean_name(material_name))
+        direction_id = self.directions.get(_clean_name(direction_name))
+        location_id = self.locations.get(_clean_name(location_name))
+        if material_id is None:
+            self.errors.append((row_num, f"Материал не найден: {material_name}"))
+            return None
+        if direction_id is None:
+            self.errors.append((row_num, f"Направление не найдено: {direction_name}"))
+            return None
+        if location_id is None:
+            self.errors.append((row_num, f"Склад не найден: {location_name}"))
+            return None
+
+        doc_number = _clean_name(doc_number) or None
+        return {
+            "row": row_num,
+            "date": doc_date,
+            "supplier": supplier_name,
+            "document_number": doc_number,
+            "item": IncomeItem(
+                material_id=material_id, quantity=quantity, direction_id=direction_id, location_id=location_id
+            ),
+        }
+
+    def save_chunk(self, chunk):
+        suppliers = dict(self.suppliers)
+        counters = (self.created_docs, self.imported_rows)
+        try:
+            with import_chunk_seconds.time(), transaction.atomic():
+                documents, items = self._save_chunk(chunk)
+                self.created_docs += len(documents)
+                self.imported_rows += len(items)
+                self.chunk_saved()
+        except DatabaseError as e:
+            # Пачка откатывается целиком, остальной файл продолжает загружаться
+            self.suppliers = suppliers
+            self.created_docs, self.imported_rows = counters
+            self.errors.extend((row["row"], f"Ошибка сохранения: {e}") for row in chunk)
+            import_rows.inc(len(chunk), result="error")
+            return
+        import_rows.inc(len(items), result="imported")
+        if self.group:
+            self.documents.update(documents)
+
+    def chunk_saved(self):
+        """Вызывается внутри транзакции пачки после её сохранения."""
+
+    def _save_chunk(self, chunk):
+        self._ensure_suppliers({row["supplier"] for row in chunk})
+
+        new_documents = {}
+        row_documents = []
+        for row in chunk:
+            supplier_id = self.suppliers[row["supplier"]]
+            if self.group:
+                key = (row["date"], supplier_id, row["document_number"])
+            else:
+                key = ("row", row["row"])
+            document = self.documents.get(key) or new_documents.get(key)
+            if document is None:
+                document = MaterialIncome(
+                    date=row["date"],
+                    supplier_id=supplier_id,
+                    document_number=row["document_number"],
+                    responsible=self.user,
+                )
+                new_documents[key] = document
+            row_documents.append(document)
+
+        MaterialIncome.objects.bulk_create(new_documents.values())
+
+        items = []
+        for row, document in zip(chunk, row_documents):
+            row["item"].income = document
+            items.append(row["item"])
+        post_income_items(items)
+        return new_documents, items
+
+    def _ensure_suppliers(self, names):
+        missing = [name for name in names if name not in self.suppliers]
+        if not missing:
+            return
+        Supplier.objects.bulk_create([Supplier(name=name) for name in missing], ignore_conflicts=True)
+        self.suppliers.update(Supplier.objects.filter(name__in=missing).values_list("name", "id"))
+
+
+def _clean_name(value):
+    if value is None:
+        return ""
+    return str(value).strip()
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value.strip(), "%Y-%m-%d").date()
+        except ValueError:
+            pass
+    raise ValueError(f"Некорректная дата: {value}")
+
+
+def _parse_quantity(value):
+    try:
+        quantity = IncomeItem._meta.get_field("quantity").clean(value, None)
+    except ValidationError as e:
+        raise ValueError(f"Некорректное количество {value}: {' '.join(e.messages)}")
+    if quantity <= 0:
+        raise ValueError(f"Количество должно быть больше нуля: {value}")
+    return quantity
@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger("main.requests")
+
+# Запросы к БД дольше порога пишутся в лог вместе с именем представления
+SLOW_QUERY_THRESHOLD_MS = 300
+MAX_LOGGED_SQL = 2000
+
+
+class RequestStats:
+    """Накопленная статистика запросов по представлениям в памяти процесса."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.views = {}
+
+    def record(self, view, total, db_time, queries, slow_queries):
+        with self.lock:
+            entry = self.views.get(view)
+            if entry is None:
+                entry = self.views[view] = {
+                    "count": 0, "time": 0.0, "max_time": 0.0, "db_time": 0.0, "queries": 0,
+                    "max_queries": 0, "slow_queries": 0,
+                }
+            entry["count"] += 1
+            entry["time"] += total
+            entry["max_time"] = max(entry["max_time"], total)
+            entry["db_time"] += db_time
+            entry["queries"] += queries
+            entry["max_queries"] = max(entry["max_queries"], queries)
+            entry["slow_queries"] += slow_queries
+
+    def snapshot(self):
+        with self.lock:
+            views = {view: dict(entry) for view, entry in self.views.items()}
+        rows = []
+        for view, entry in views.items():
+            count = entry["count"]
+            rows.append({
+                "view": view,
+                "count": count,
+                "total_ms": _ms(entry["time"]),
+                "avg_ms": _ms(entry["time"] / count),
+                "max_ms": _ms(entry["max_time"]),
+                "avg_db_ms": _ms(entry["db_time"] / count),
+                "avg_render_ms": _ms((entry["time"] - entry["db_time"]) / count),
+                "avg_queries": round(entry["queries"] / count, 2),
+                "max_queries": entry["max_queries"],
+                "slow_queries": entry["slow_queries"],
+            })
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return {"pid": os.getpid(), "since": self.started_at, "views": rows}
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.started_at = time.time()
+
+
+request_stats = RequestStats()
+
+
+class QueryTimer:
+    """Обёртка execute_wrapper: считает запросы и их время в рамках одного HTTP-запроса."""
+
+    def __init__(self, request, threshold):
+        self.request = request
+        self.threshold = threshold
+        self.count = 0
+        self.time = 0.0
+        self.slow = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.time += elapsed
+            if elapsed >= self.threshold:
+                self.slow += 1
+                logger.warning(
+                    "Медленный запрос %.1f мс в %s: %s",
+                    elapsed * 1000, _view_name(self.request), sql[:MAX_LOGGED_SQL],
+                )
+
+
+class RequestStatsMiddleware:
+    """Замеряет время ответа, число и время SQL-запросов по каждому представлению.
+
+    Время вне БД (код представления и шаблоны) считается как разница общего
+    времени и времени запросов. Для потоковых ответов учитывается только
+    время до начала отдачи. Работает и под WSGI, и под ASGI (без перевода
+    async-представлений в поток). Отключается настройкой ``REQUEST_STATS_ENABLED``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_STATS_ENABLED", True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = self._timer(request)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            _wrap_connections(stack, timer)
+            response = self.get_response(request)
+        self._record(request, timer, started)
+        return response
+
+    async def __acall__(self, request):
+        # Соединения с БД принадлежат потоку: обёртки ставятся в том же потоке
+        # (sync_to_async одного запроса), где async-ORM выполняет запросы
+        timer = self._timer(request)
+        started = time.perf_counter()
+        stack = ExitStack()
+        await sync_to_async(_wrap_connections)(stack, timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self._record(request, timer, started)
+        return response
+
+    def _timer(self, request):
+        threshold = getattr(settings, "SLOW_QUERY_THRESHOLD_MS", SLOW_QUERY_THRESHOLD_MS) / 1000
+        return QueryTimer(request, threshold)
+
+    def _record(self, request, timer, started):
+        request_stats.record(
+            _view_name(request), time.perf_counter() - started, timer.time, timer.count, timer.slow
+        )
+
+
+def _wrap_connections(stack, timer):
+    for alias in settings.DATABASES:
+        stack.enter_context(connections[alias].execute_wrapper(timer))
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else "<unresolved>"
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
@@ -0,0 +1,285 @@
+import random
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from .datagen import DataGenerator
+from .models import (
+    Stock, StockMovement, MaterialIncome, IncomeItem, MaterialTransfer, TransferItem, MaterialWriteOff, WriteOffItem
+)
+from .posting import post_income, post_transfer, post_writeoff
+from .reconcile import stock_differences
+from .stock import InsufficientStock, fold_deltas, income_item_deltas, transfer_item_deltas, writeoff_item_deltas
+
+LOAD_TEST_MIX = {"income": 4, "transfer": 3, "writeoff": 3}
+MAX_RETRIES = 5
+LOCK_SAMPLE_INTERVAL = 0.05
+
+# Коды PostgreSQL: взаимоблокировка и конфликт сериализации
+DEADLOCK_SQLSTATES = {"40P01"}
+SERIALIZATION_SQLSTATES = {"40001"}
+
+
+def _error_kind(exc):
+    cause = exc.__cause__
+    sqlstate = getattr(cause, "sqlstate", None) or getattr(cause, "pgcode", None)
+    if sqlstate in DEADLOCK_SQLSTATES:
+        return "deadlock"
+    if sqlstate in SERIALIZATION_SQLSTATES:
+        return "serialization"
+    if "database is locked" in str(exc):
+        return "locked"
+    return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class PostingLoadTest:
+    """Нагрузка проведением документов на несколько «горячих» материалов.
+
+    ``workers`` потоков (у каждого своё соединение с БД) проводят поступления,
+    перемещения и списания по одним и тем же ключам через main.posting.
+    Взаимоблокировки, конфликты сериализации и «database is locked» (SQLite)
+    считаются и повторяются до ``MAX_RETRIES`` раз; отказ по нехватке остатка
+    (InsufficientStock) — ожидаемый результат, а не ошибка.
+
+    После прогона проверяются инварианты: изменение Stock по каждому ключу
+    равно сумме подтверждённых документов, Stock совпадает с документами и
+    журналом движений, остаток не уходит в минус. Проведение захватывает
+    строки в фиксированном порядке, поэтому взаимоблокировка, даже
+    исправленная повтором, тоже считается нарушением.
+    """
+
+    def __init__(self, workers=8, operations=100, hot_materials=3, locations=2, max_items=5,
+                 initial_quantity=Decimal("1000"), mix=None, seed=None):
+        self.workers = workers
+        self.operations = operations
+        self.max_items = max_items
+        self.mix = mix or LOAD_TEST_MIX
+        self.seed = seed
+        generator = DataGenerator(materials=hot_materials, locations=locations, directions=1, suppliers=1, seed=seed)
+        self.user = generator.user
+        self.supplier_id = generator.supplier_ids[0]
+        self.material_ids = generator.material_ids[:hot_materials]
+        self.location_ids = generator.location_ids[:locations]
+        self.direction_id = generator.direction_ids[0]
+        self.initial_quantity = initial_quantity
+
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.counters = Counter()
+        self.committed = defaultdict(Decimal)
+        self.errors = []
+        self.lock_samples = []
+
+    def keys(self):
+        return [(m, self.direction_id, loc) for m in self.material_ids for loc in self.location_ids]
+
+    def run(self):
+        self.ensure_initial_stock()
+        self.baseline = self.stock_by_key()
+        deadlocks_before = self.server_deadlocks()
+
+        stop = threading.Event()
+        monitor = threading.Thread(target=self.sample_lock_waits, args=(stop,))
+        monitor.start()
+        threads = [threading.Thread(target=self.worker, args=(n,)) for n in range(self.workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        monitor.join()
+
+        deadlocks_after = self.server_deadlocks()
+        return self.report(elapsed, deadlocks_before, deadlocks_after)
+
+    def ensure_initial_stock(self):
+        post_income(
+            MaterialIncome(date=timezone.localdate(), supplier_id=self.supplier_id, responsible=self.user),
+            [
+                IncomeItem(material_id=m, direction_id=d, location_id=loc, quantity=self.initial_quantity)
+                for m, d, loc in self.keys()
+            ],
+        )
+
+    def worker(self, number):
+        rnd = random.Random(None if self.seed is None else self.seed * 1000 + number)
+        kinds = [kind for kind, weight in self.mix.items() for _ in range(weight)]
+        try:
+            for _ in range(self.operations):
+                self.operation(rnd, rnd.choice(kinds))
+        finally:
+            connection.close()
+
+    def operation(self, rnd, kind):
+        document, items, post, deltas_fn = self.build(rnd, kind)
+        started = time.perf_counter()
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                post(document, items)
+            except InsufficientStock:
+                self.count(f"{kind}_rejected")
+                return
+            except DatabaseError as exc:
+                error = _error_kind(exc)
+                if error is None:
+                    self.count("failed")
+                    with self.lock:
+                        self.errors.append(f"{kind}: {exc}")
+                    return
+                self.count(error)
+                document.pk = None
+                for item in items:
+                    item.pk = None
+                time.sleep(rnd.uniform(0, 0.01 * (attempt + 1)))
+                continue
+            latency = time.perf_counter() - started
+            with self.lock:
+                self.counters[f"{kind}_committed"] += 1
+                self.latencies.append(latency)
+                for key, delta in fold_deltas(entry for item in items for entry in deltas_fn(item)).items():
+                    self.committed[key] += delta
+            return
+        self.count("gave_up")
+
+    def build(self, rnd, kind):
+        today = timezone.localdate()
+        items = []
+        for _ in range(rnd.randint(1, self.max_items)):
+            material_id = rnd.choice(self.material_ids)
+            quantity = Decimal(rnd.randint(1, 20))
+            if kind == "income":
+                items.append(IncomeItem(material_id=material_id, direction_id=self.direction_id,
+                                        location_id=rnd.choice(self.location_ids), quantity=quantity))
+            elif kind == "transfer":
+                source, target = rnd.sample(self.location_ids, 2) if len(self.location_ids) > 1 else \
+                    (self.location_ids[0], self.location_ids[0])
+                items.append(TransferItem(material_id=material_id, quantity=quantity,
+                                          from_direction_id=self.direction_id, from_location_id=source,
+                                          to_direction_id=self.direction_id, to_location_id=target))
+            else:
+                items.append(WriteOffItem(material_id=material_id, direction_id=self.direction_id,
+                                          location_id=rnd.choice(self.location_ids), quantity=quantity))
+        if kind == "income":
+            document = MaterialIncome(date=today, supplier_id=self.supplier_id, responsible=self.user)
+            return document, items, post_income, income_item_deltas
+        if kind == "transfer":
+            return MaterialTransfer(date=today, responsible=self.user), items, post_transfer, transfer_item_deltas
+        document = MaterialWriteOff(date=today, reason="Нагрузочный тест", responsible=self.user)
+        return document, items, post_writeoff, writeoff_item_deltas
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def sample_lock_waits(self, stop):
+        # Только PostgreSQL показывает ожидающие блокировки; в SQLite их видно по ошибкам «locked»
+        if connection.vendor != "postgresql":
+            return
+        try:
+            with connection.cursor() as cursor:
+                while not stop.wait(LOCK_SAMPLE_INTERVAL):
+                    cursor.execute("SELECT count(*) FROM pg_locks WHERE NOT granted")
+                    self.lock_samples.append(cursor.fetchone()[0])
+        finally:
+            connection.close()
+
+    def server_deadlocks(self):
+        if connection.vendor != "postgresql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")
+            return cursor.fetchone()[0]
+
+    def stock_by_key(self):
+        return {
+            (m, d, loc): quantity
+            for m, d, loc, quantity in Stock.objects.filter(material_id__in=self.material_ids).values_list(
+                "material_id", "direction_id", "location_id", "quantity"
+            )
+        }
+
+    def check_invariants(self):
+        stock = self.stock_by_key()
+        lost = {
+            key: {"expected": str(self.baseline.get(key, 0) + delta), "actual": str(stock.get(key, 0))}
+            for key, delta in self.committed.items()
+            if self.baseline.get(key, 0) + delta != stock.get(key, 0)
+        }
+        differences = [
+            difference for material_id in self.material_ids
+            for difference in stock_differences(material_id, material_id + 1)
+        ]
+        ledger = {
+            (row["material_id"], row["direction_id"], row["location_id"]): row["total"]
+            for row in StockMovement.objects.filter(material_id__in=self.material_ids)
+            .values("material_id", "direction_id", "location_id").annotate(total=Sum("quantity")).order_by()
+        }
+        ledger_mismatches = [key for key, quantity in stock.items() if ledger.get(key, 0) != quantity]
+        # Ключи, уже отрицательные до прогона (например, после generate_data), не считаются
+        negative = [
+            key for key in self.committed
+            if stock.get(key, 0) < 0 <= self.baseline.get(key, 0)
+        ]
+        return {
+            "no_lost_updates": not lost,
+            "stock_matches_documents": not differences,
+            "stock_matches_ledger": not ledger_mismatches,
+            "no_negative_stock": not negative,
+            "no_deadlocks": not self.counters.get("deadlock"),
+            "details": {
+                "lost_updates": {str(key): value for key, value in lost.items()},
+                "document_differences": [
+                    {"key": str(key), "stock": str(actual), "documents": str(expected)}
+                    for key, actual, expected in differences
+                ],
+                "ledger_mismatches": [str(key) for key in ledger_mismatches],
+                "negative": [str(key) for key in negative],
+            },
+        }
+
+    def report(self, elapsed, deadlocks_before, deadlocks_after):
+        committed = sum(count for name, count in self.counters.items() if name.endswith("_committed"))
+        latencies = self.latencies
+        return {
+            "database": connection.vendor,
+            "workers": self.workers,
+            "operations_per_worker": self.operations,
+            "hot_keys": len(self.keys()),
+            "elapsed": round(elapsed, 3),
+            "throughput": round(committed / elapsed, 2) if elapsed else None,
+            "latency_ms": {
+                "p50": _ms(percentile(latencies, 0.5)),
+                "p95": _ms(percentile(latencies, 0.95)),
+                "p99": _ms(percentile(latencies, 0.99)),
+                "max": _ms(max(latencies) if latencies else None),
+                "mean": _ms(statistics.mean(latencies) if latencies else None),
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "server_deadlocks": None if deadlocks_before is None else deadlocks_after - deadlocks_before,
+            "lock_waits": {
+                "samples": len(self.lock_samples),
+                "max_waiting": max(self.lock_samples, default=0),
+                "mean_waiting": round(statistics.mean(self.lock_samples), 2) if self.lock_samples else 0,
+            },
+            "errors": self.errors[:20],
+            "invariants": self.check_invariants(),
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, Sum
+
+from main.models import IncomeItem, TransferItem, WriteOffItem, StockMovement
+from main.stock import sequence_movements
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = "Заполняет журнал движений StockMovement по существующим документам"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild", action="store_true",
+            help="Очистить журнал и построить его заново по всем документам",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options["rebuild"]:
+                StockMovement.objects.all().delete()
+
+            # Документы, уже попавшие в журнал до запуска, пропускаются
+            existing = StockMovement.objects.filter(
+                id__lte=StockMovement.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+            )
+            total = 0
+            for kind, queryset, sign in self.sources():
+                queryset = queryset.exclude(
+                    document_id__in=existing.filter(kind=kind).values("document_id")
+                )
+                total += self.copy(kind, queryset, sign)
+            transaction.on_commit(sequence_movements)
+
+        self.stdout.write(self.style.SUCCESS(f"Добавлено записей в журнал: {total}"))
+
+    def sources(self):
+        # Одна агрегированная выборка на каждую сторону движения
+        yield StockMovement.INCOME, IncomeItem.objects.annotate(
+            document_id=F("income_id"), date=F("income__date"),
+        ).values("document_id", "date", "material_id", "direction_id", "location_id"), 1
+        yield StockMovement.TRANSFER, TransferItem.objects.annotate(
+            document_id=F("transfer_id"), date=F("transfer__date"),
+            direction_id=F("from_direction_id"), location_id=F("from_location_id"),
+        ).values("document_id", "date", "material_id", "direction_id", "location_id"), -1
+        yield StockMovement.TRANSFER, TransferItem.objects.annotate(
+            document_id=F("transfer_id"), date=F("transfer__date"),
+            direction_id=F("to_direction_id"), location_id=F("to_location_id"),
+        ).values("document_id", "date", "material_id", "direction_id", "location_id"), 1
+        yield StockMovement.WRITEOFF, WriteOffItem.objects.annotate(
+            document_id=F("writeoff_id"), date=F("writeoff__date"),
+        ).values("document_id", "date", "material_id", "direction_id", "location_id"), -1
+
+    def copy(self, kind, queryset, sign):
+        rows = queryset.annotate(total=Sum("quantity")).order_by()
+        batch = []
+        count = 0
+        for row in rows.iterator(chunk_size=BATCH_SIZE):
+            if not row["total"]:
+                continue
+            batch.append(StockMovement(
+                material_id=row["material_id"], direction_id=row["direction_id"], location_id=row["location_id"],
+                date=row["date"], quantity=sign * row["total"], kind=kind, document_id=row["document_id"],
+            ))
+            if len(batch) >= BATCH_SIZE:
+                StockMovement.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        StockMovement.objects.bulk_create(batch)
+        return count + len(batch)
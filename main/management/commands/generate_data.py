@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.datagen import GENERATE_BATCH_SIZE, DataGenerator
+
+
+class Command(BaseCommand):
+    help = "Заполняет базу синтетическими справочниками и документами для нагрузочных замеров"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=100000, help="Сколько позиций документов создать")
+        parser.add_argument("--items-per-document", type=int, default=10, help="Среднее число позиций в документе")
+        parser.add_argument("--materials", type=int, default=1000)
+        parser.add_argument("--locations", type=int, default=20)
+        parser.add_argument("--directions", type=int, default=5)
+        parser.add_argument("--suppliers", type=int, default=200)
+        parser.add_argument("--days", type=int, default=365, help="За сколько последних дней распределить документы")
+        parser.add_argument("--seed", type=int, help="Зерно генератора случайных чисел")
+        parser.add_argument("--batch-size", type=int, default=GENERATE_BATCH_SIZE, help="Позиций в одной транзакции")
+        parser.add_argument(
+            "--noinput", "--no-input", action="store_false", dest="interactive",
+            help="Не спрашивать подтверждения",
+        )
+
+    def handle(self, *args, **options):
+        if options["interactive"]:
+            answer = input("Данные будут добавлены в настроенную базу. Продолжить? (yes/no): ")
+            if answer != "yes":
+                raise CommandError("Отменено.")
+
+        generator = DataGenerator(
+            materials=options["materials"], locations=options["locations"], directions=options["directions"],
+            suppliers=options["suppliers"], days=options["days"], seed=options["seed"],
+            batch_size=options["batch_size"],
+        )
+        step = max(options["batch_size"], options["items"] // 20)
+        left = options["items"]
+        while left > 0:
+            generator.generate(min(step, left), options["items_per_document"])
+            left -= min(step, left)
+            self.stdout.write(f"Создано позиций: {generator.items_created}, документов: {generator.documents_created}")
+        self.stdout.write(self.style.SUCCESS("Готово"))
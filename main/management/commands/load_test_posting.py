@@ -0,0 +1,65 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.loadtest import LOAD_TEST_MIX, PostingLoadTest
+
+
+def parse_mix(value):
+    try:
+        mix = {kind: int(weight) for kind, weight in (part.split("=") for part in value.split(","))}
+    except ValueError:
+        raise CommandError("--mix: ожидается вид=вес через запятую, например income=4,transfer=3,writeoff=3")
+    unknown = set(mix) - set(LOAD_TEST_MIX)
+    if unknown:
+        raise CommandError(f"--mix: неизвестные виды документов {', '.join(sorted(unknown))}")
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест: параллельное проведение документов по «горячим» материалам "
+        "с замером пропускной способности, задержек, блокировок и проверкой остатков"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=16, help="Параллельных потоков")
+        parser.add_argument("--operations", type=int, default=100, help="Документов на поток")
+        parser.add_argument("--hot-materials", type=int, default=3)
+        parser.add_argument("--locations", type=int, default=2)
+        parser.add_argument("--max-items", type=int, default=5, help="Максимум позиций в документе")
+        parser.add_argument("--mix", default="income=4,transfer=3,writeoff=3", help="Доли видов документов")
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("--output", default="-", help="Файл результатов JSON («-» — stdout)")
+        parser.add_argument(
+            "--noinput", "--no-input", action="store_false", dest="interactive",
+            help="Не спрашивать подтверждения",
+        )
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options["mix"])
+        if options["interactive"]:
+            answer = input("Тест проводит документы в настроенной базе. Продолжить? (yes/no): ")
+            if answer != "yes":
+                raise CommandError("Отменено.")
+
+        report = PostingLoadTest(
+            workers=options["workers"], operations=options["operations"],
+            hot_materials=options["hot_materials"], locations=options["locations"],
+            max_items=options["max_items"], mix=mix, seed=options["seed"],
+        ).run()
+
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options["output"] == "-":
+            self.stdout.write(data)
+        else:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(data)
+
+        invariants = report["invariants"]
+        self.stderr.write(
+            f"{report['throughput']} док./с, p95 {report['latency_ms']['p95']} мс, счётчики {report['counters']}"
+        )
+        broken = [name for name, ok in invariants.items() if name != "details" and not ok]
+        if broken:
+            raise CommandError(f"Нарушены инварианты: {', '.join(broken)}")
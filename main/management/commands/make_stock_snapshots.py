@@ -0,0 +1,52 @@
+import calendar
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from main.models import StockMovement, StockSnapshot
+from main.snapshots import make_snapshot
+
+
+def month_end(day):
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+def month_ends(first, last):
+    day = month_end(first)
+    while day <= last:
+        yield day
+        day = month_end(day + timedelta(days=1))
+
+
+class Command(BaseCommand):
+    help = (
+        "Сохраняет снимки остатков на конец каждого завершённого месяца "
+        "(по журналу движений, см. backfill_stock_movements)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", help="Построить снимок только на указанную дату (YYYY-MM-DD)")
+        parser.add_argument("--rebuild", action="store_true", help="Пересчитать уже существующие снимки")
+
+    def handle(self, *args, **options):
+        if options["date"]:
+            try:
+                period_ends = [datetime.strptime(options["date"], "%Y-%m-%d").date()]
+            except ValueError:
+                raise CommandError("Дата должна быть в формате YYYY-MM-DD")
+        else:
+            first = StockMovement.objects.aggregate(first=Min("date"))["first"]
+            if first is None:
+                self.stdout.write("Журнал движений пуст, снимки не нужны.")
+                return
+            last_complete = timezone.localdate().replace(day=1) - timedelta(days=1)
+            period_ends = list(month_ends(first, last_complete))
+
+        existing = set(StockSnapshot.objects.values_list("period_end", flat=True))
+        for period_end in period_ends:
+            if period_end in existing and not options["rebuild"]:
+                continue
+            snapshot = make_snapshot(period_end)
+            self.stdout.write(f"Снимок на {period_end}: {snapshot.lines.count()} позиций")
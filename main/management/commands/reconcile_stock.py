@@ -0,0 +1,72 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.reconcile import RECONCILE_RANGE_SIZE, material_ranges, reconcile_range
+from main.reference import reference_objects
+
+
+def _init_worker():
+    # При запуске через spawn дочерний процесс поднимает Django заново
+    django.setup()
+
+
+def _reconcile(bounds, fix):
+    try:
+        return reconcile_range(*bounds, fix=fix)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Сверяет таблицу остатков Stock с документами поступления, перемещения и списания"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Исправить найденные расхождения")
+        parser.add_argument(
+            "--workers", type=int, default=min(os.cpu_count() or 1, 8),
+            help="Количество параллельных процессов (1 — без отдельных процессов)",
+        )
+        parser.add_argument(
+            "--range-size", type=int, default=RECONCILE_RANGE_SIZE,
+            help="Сколько id материалов обрабатывает процесс за одну задачу",
+        )
+        parser.add_argument("--limit", type=int, default=100, help="Сколько расхождений вывести")
+
+    def handle(self, *args, **options):
+        ranges = material_ranges(options["range_size"])
+        shown = total = 0
+        for differences in self.run(ranges, options["fix"], options["workers"]):
+            total += len(differences)
+            for key, actual, expected in differences:
+                if shown < options["limit"]:
+                    self.stdout.write(self.describe(key, actual, expected))
+                    shown += 1
+
+        if options["fix"]:
+            self.stdout.write(self.style.SUCCESS(f"Исправлено расхождений: {total}"))
+        elif total:
+            self.stdout.write(self.style.WARNING(f"Найдено расхождений: {total}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Расхождений нет"))
+
+    def run(self, ranges, fix, workers):
+        if workers <= 1:
+            for bounds in ranges:
+                yield reconcile_range(*bounds, fix=fix)
+            return
+
+        # Соединения родителя не должны достаться дочерним процессам
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            yield from executor.map(_reconcile, ranges, [fix] * len(ranges))
+
+    def describe(self, key, actual, expected):
+        material_id, direction_id, location_id = key
+        material = reference_objects("material").get(material_id, material_id)
+        direction = reference_objects("direction").get(direction_id, direction_id)
+        location = reference_objects("location").get(location_id, location_id)
+        return f"{material}, {location} / {direction}: в Stock {actual}, по документам {expected}"
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmarks import BENCHMARK_REPEAT, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет отчёты, выгрузки, проведение и импорт на базе нескольких размеров "
+        "и сохраняет результаты в JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", default="10000,100000,1000000",
+            help="Размеры базы в позициях документов через запятую; недостающие позиции генерируются",
+        )
+        parser.add_argument("--repeat", type=int, default=BENCHMARK_REPEAT, help="Повторов каждого сценария")
+        parser.add_argument("--materials", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default="benchmark-results.json", help="Файл результатов («-» — stdout)")
+        parser.add_argument(
+            "--noinput", "--no-input", action="store_false", dest="interactive",
+            help="Не спрашивать подтверждения",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("--sizes: ожидаются целые числа через запятую")
+        if options["interactive"]:
+            answer = input("Замеры добавляют данные в настроенную базу. Продолжить? (yes/no): ")
+            if answer != "yes":
+                raise CommandError("Отменено.")
+
+        report = run_benchmarks(
+            sizes, repeat=options["repeat"],
+            generator_options={"materials": options["materials"], "seed": options["seed"]},
+            progress=self.stderr.write,
+        )
+        for row in report["results"]:
+            self.stderr.write(
+                f"{row['size']:>10} {row['scenario']:<24} {row['median'] * 1000:>10.1f} мс {row['queries']:>5} запр."
+            )
+
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options["output"] == "-":
+            self.stdout.write(data)
+        else:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(data)
+            self.stderr.write(f"Результаты сохранены в {options['output']}")
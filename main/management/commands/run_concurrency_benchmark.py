@@ -0,0 +1,53 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmarks import CONCURRENCY_VIEWS, run_concurrency_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает обслуживание одновременных медленных скачиваний отчётов синхронными "
+        "представлениями (пул воркеров WSGI) и async-представлениями (один процесс ASGI)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--views", default="export_movement_csv,export_movement_excel",
+            help=f"Представления через запятую: {', '.join(CONCURRENCY_VIEWS)}",
+        )
+        parser.add_argument("--clients", type=int, default=50, help="Одновременных клиентов")
+        parser.add_argument("--workers", type=int, default=4, help="Воркеров WSGI")
+        parser.add_argument("--bandwidth", type=int, default=1_000_000, help="Скорость клиента, байт/с")
+        parser.add_argument("--start", help="Начало периода отчёта по движению (ГГГГ-ММ-ДД)")
+        parser.add_argument("--end", help="Конец периода")
+        parser.add_argument("--username", default="benchmark", help="От чьего имени запрашиваются отчёты")
+        parser.add_argument("--output", default="-", help="Файл результатов JSON («-» — stdout)")
+
+    def handle(self, *args, **options):
+        view_names = [name.strip() for name in options["views"].split(",") if name.strip()]
+        unknown = set(view_names) - set(CONCURRENCY_VIEWS)
+        if unknown:
+            raise CommandError(f"--views: неизвестные представления {', '.join(sorted(unknown))}")
+        user = User.objects.filter(username=options["username"]).first()
+        if user is None:
+            raise CommandError(f"Пользователь {options['username']} не найден (создаётся командой generate_data)")
+        params = {"start": options["start"], "end": options["end"]} if options["start"] and options["end"] else {}
+
+        report = run_concurrency_benchmark(
+            user, view_names, params, clients=options["clients"], workers=options["workers"],
+            bandwidth=options["bandwidth"], progress=self.stderr.write,
+        )
+        for row in report["results"]:
+            self.stderr.write(
+                f"{row['view']:<24} {row['server']:<5} {row['elapsed']:>8.2f} с  "
+                f"p95 {row['latency_p95']:>7.2f} с  одновременно {row['peak_in_flight']:>4}"
+            )
+
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options["output"] == "-":
+            self.stdout.write(data)
+        else:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(data)
@@ -0,0 +1,108 @@
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from multiprocessing import Manager
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.export_jobs import EXPORT_JOB_STALE_AFTER, claim_next_export, evict_exports, run_export_job
+
+
+def _init_worker():
+    # При запуске через spawn дочерний процесс поднимает Django заново
+    django.setup()
+
+
+def _work(once, interval, stale_after, messages):
+    """Цикл обработчика: сам забирает задания из очереди.
+
+    Сообщения о ходе работы кладутся в ``messages`` парами (поток, текст),
+    выводит их команда в основном процессе через self.stdout и self.stderr.
+    """
+    done = 0
+    while True:
+        job = claim_next_export(stale_after)
+        if job is None:
+            if once:
+                return done
+            evict_exports()
+            time.sleep(interval)
+            continue
+        try:
+            run_export_job(job)
+        except Exception as e:
+            messages.put(("stderr", f"Выгрузка #{job.pk}: ошибка {e}"))
+            continue
+        messages.put(("stdout", f"Выгрузка #{job.pk}: готово, {job.size} байт"))
+        done += 1
+
+
+def _pool_work(*args):
+    try:
+        return _work(*args)
+    finally:
+        connections.close_all()
+
+
+class _DirectMessages:
+    """Очередь сообщений для работы без пула: пишет сразу в вывод команды."""
+
+    def __init__(self, command):
+        self.command = command
+
+    def put(self, message):
+        self.command.write_message(message)
+
+
+class Command(BaseCommand):
+    help = "Строит файлы выгрузок из очереди заданий и удаляет старые файлы"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=min(os.cpu_count() or 1, 4),
+            help="Количество процессов (1 — в текущем процессе)",
+        )
+        parser.add_argument("--once", action="store_true", help="Обработать очередь и завершиться")
+        parser.add_argument("--interval", type=float, default=5, help="Пауза между опросами очереди, сек.")
+        parser.add_argument(
+            "--stale-after", type=int, default=int(EXPORT_JOB_STALE_AFTER.total_seconds()),
+            help="Через сколько секунд задание в работе считается брошенным и перезапускается",
+        )
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(seconds=options["stale_after"])
+        args = (options["once"], options["interval"], stale_after)
+        if options["workers"] <= 1:
+            done = _work(*args, _DirectMessages(self))
+        else:
+            # Соединения родителя не должны достаться дочерним процессам
+            connections.close_all()
+            with Manager() as manager, ProcessPoolExecutor(
+                max_workers=options["workers"], initializer=_init_worker
+            ) as executor:
+                messages = manager.Queue()
+                futures = [executor.submit(_pool_work, *args, messages) for _ in range(options["workers"])]
+                while not all(future.done() for future in futures):
+                    self.write_messages(messages, timeout=0.5)
+                self.write_messages(messages)
+                done = sum(future.result() or 0 for future in futures)
+        evicted = evict_exports()
+        self.stdout.write(f"Готово выгрузок: {done}, удалено старых: {evicted}")
+
+    def write_messages(self, messages, timeout=None):
+        # Ждёт первое сообщение не дольше timeout, затем забирает всё накопившееся
+        try:
+            message = messages.get(timeout=timeout) if timeout else messages.get_nowait()
+            while True:
+                self.write_message(message)
+                message = messages.get_nowait()
+        except queue.Empty:
+            pass
+
+    def write_message(self, message):
+        stream, text = message
+        getattr(self, stream).write(text)
@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from main.import_jobs import IMPORT_JOB_STALE_AFTER, claim_next_job, run_import_job
+
+
+class Command(BaseCommand):
+    help = "Обрабатывает очередь заданий импорта поступлений из Excel"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Обработать очередь и завершиться")
+        parser.add_argument("--interval", type=float, default=5, help="Пауза между опросами очереди, сек.")
+        parser.add_argument(
+            "--stale-after", type=int, default=int(IMPORT_JOB_STALE_AFTER.total_seconds()),
+            help="Через сколько секунд без прогресса задание считается брошенным и перезапускается",
+        )
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(seconds=options["stale_after"])
+        while True:
+            job = claim_next_job(stale_after)
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["interval"])
+                continue
+
+            self.stdout.write(f"Импорт #{job.pk}: начат со строки {job.last_row + 1}")
+            try:
+                importer = run_import_job(job)
+            except Exception as e:
+                self.stderr.write(f"Импорт #{job.pk}: ошибка {e}")
+                continue
+            self.stdout.write(
+                f"Импорт #{job.pk}: {importer.imported_rows} строк, "
+                f"{importer.created_docs} поступлений, {importer.dropped_errors + len(importer.errors)} ошибок"
+            )
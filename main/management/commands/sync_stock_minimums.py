@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.stock import sync_stock_minimums
+
+
+class Command(BaseCommand):
+    help = "Переносит минимальные остатки материалов и складов в строки Stock"
+
+    def handle(self, *args, **options):
+        updated = sync_stock_minimums()
+        self.stdout.write(self.style.SUCCESS(f"Обновлено строк остатков: {updated}"))
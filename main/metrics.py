@@ -0,0 +1,152 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+
+
+class Metric:
+    """Метрика в памяти процесса с выводом в текстовом формате Prometheus."""
+
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        yield f"{self.name}{self._labels(key)} {_format(value)}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, amount, **labels):
+        key = self._key(labels)
+        with self.lock:
+            value = self.values.get(key)
+            if value is None:
+                value = self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+            index = bisect_left(self.buckets, amount)
+            if index < len(self.buckets):
+                value["buckets"][index] += 1
+            value["sum"] += amount
+            value["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        value = self.values.get(self._key(labels))
+        return value["count"] if value else 0
+
+    def _render_value(self, key, value):
+        cumulative = 0
+        for bound, count in zip(self.buckets, value["buckets"]):
+            cumulative += count
+            yield f"{self.name}_bucket{self._labels(key, [('le', _format(bound))])} {cumulative}"
+        yield f"{self.name}_bucket{self._labels(key, [('le', '+Inf')])} {value['count']}"
+        yield f"{self.name}_sum{self._labels(key)} {_format(value['sum'])}"
+        yield f"{self.name}_count{self._labels(key)} {value['count']}"
+
+
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    for metric in _registry:
+        metric.reset()
+
+
+def _format(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+documents_posted = Counter(
+    "materialflow_documents_posted_total", "Проведённые документы по виду", ["kind"]
+)
+document_items = Histogram(
+    "materialflow_document_items", "Позиций в проведённом документе", ["kind"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 500, 1000),
+)
+stock_update_seconds = Histogram(
+    "materialflow_stock_update_seconds", "Время записи движений и обновления остатков по пачке документов"
+)
+stock_update_keys = Histogram(
+    "materialflow_stock_update_keys", "Ключей остатков в одном обновлении",
+    buckets=(1, 2, 5, 10, 50, 100, 500, 1000, 5000),
+)
+import_rows = Counter(
+    "materialflow_import_rows_total", "Строки импорта поступлений по результату", ["result"]
+)
+import_chunk_seconds = Histogram(
+    "materialflow_import_chunk_seconds", "Время сохранения пачки строк импорта"
+)
+report_cache_requests = Counter(
+    "materialflow_report_cache_requests_total", "Обращения к кэшу отчётов", ["report", "result"]
+)
+export_bytes = Counter(
+    "materialflow_export_bytes_total", "Объём отданных выгрузок, байт", ["format"]
+)
@@ -0,0 +1,319 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Direction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Направление')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Location',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Название')),
+                ('address', models.TextField(blank=True, verbose_name='Адрес')),
+                ('type', models.CharField(choices=[('WAREHOUSE', 'Склад'), ('PRODUCTION', 'Производство'), ('OFFICE', 'Офис'), ('OTHER', 'Другое')], default='WAREHOUSE', max_length=20, verbose_name='Тип')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активно')),
+            ],
+            options={
+                'verbose_name': 'Место хранения',
+                'verbose_name_plural': 'Места хранения',
+            },
+        ),
+        migrations.CreateModel(
+            name='Material',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Наименование материала')),
+                ('article', models.CharField(max_length=100, unique=True, verbose_name='Артикул')),
+                ('min_quantity', models.DecimalField(decimal_places=3, default=10, max_digits=12, verbose_name='Минимальный остаток')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_end', models.DateField(unique=True, verbose_name='Остатки на конец дня')),
+                ('last_movement_id', models.PositiveBigIntegerField(default=0, verbose_name='Последняя учтённая запись журнала')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Снимок остатков',
+                'verbose_name_plural': 'Снимки остатков',
+            },
+        ),
+        migrations.CreateModel(
+            name='Supplier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Название компании')),
+                ('phone', models.CharField(blank=True, max_length=20, null=True, verbose_name='Телефон')),
+                ('email', models.EmailField(blank=True, max_length=254, null=True, verbose_name='Email')),
+                ('contact_last_name', models.CharField(blank=True, max_length=100, verbose_name='Фамилия')),
+                ('contact_first_name', models.CharField(blank=True, max_length=100, verbose_name='Имя')),
+                ('contact_middle_name', models.CharField(blank=True, max_length=100, verbose_name='Отчество')),
+                ('inn', models.CharField(blank=True, max_length=12, null=True, verbose_name='ИНН')),
+                ('kpp', models.CharField(blank=True, max_length=9, null=True, verbose_name='КПП')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Unit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Единица измерения')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ApiToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True, verbose_name='Ключ')),
+                ('name', models.CharField(blank=True, max_length=100, verbose_name='Интеграция')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='api_tokens', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Токен API',
+                'verbose_name_plural': 'Токены API',
+            },
+        ),
+        migrations.CreateModel(
+            name='MaterialIncome',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата поступления')),
+                ('document_number', models.CharField(blank=True, max_length=100, null=True, verbose_name='Номер документа')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('responsible', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL, verbose_name='Ответственный')),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.supplier', verbose_name='Поставщик')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IncomeItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('direction', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.direction')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.location')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.material')),
+                ('income', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='main.materialincome')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MaterialTransfer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата перемещения')),
+                ('document_number', models.CharField(blank=True, max_length=100, null=True, verbose_name='Номер документа')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('responsible', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL, verbose_name='Ответственный')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MaterialWriteOff',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата списания')),
+                ('reason', models.CharField(max_length=255, verbose_name='Причина')),
+                ('document_number', models.CharField(blank=True, max_length=100, null=True, verbose_name='Номер документа')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('responsible', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL, verbose_name='Ответственный')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Stock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=3, default=0, max_digits=12)),
+                ('min_quantity', models.DecimalField(decimal_places=3, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('direction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.direction')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.location')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.material')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата документа')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=12, verbose_name='Изменение остатка')),
+                ('kind', models.CharField(choices=[('INCOME', 'Поступление'), ('TRANSFER', 'Перемещение'), ('WRITEOFF', 'Списание')], max_length=10, verbose_name='Тип документа')),
+                ('document_id', models.PositiveBigIntegerField(verbose_name='ID документа')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('direction', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.direction', verbose_name='Направление')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.location', verbose_name='Место хранения')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.material', verbose_name='Материал')),
+            ],
+            options={
+                'verbose_name': 'Движение по складу',
+                'verbose_name_plural': 'Журнал движений',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshotLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('direction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.direction')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.location')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.material')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='main.stocksnapshot')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TransferItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('from_direction', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='transfer_from', to='main.direction')),
+                ('from_location', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='transfer_from', to='main.location')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.material')),
+                ('to_direction', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='transfer_to', to='main.direction')),
+                ('to_location', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='transfer_to', to='main.location')),
+                ('transfer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='main.materialtransfer')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='material',
+            name='unit',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.unit', verbose_name='Ед. изм.'),
+        ),
+        migrations.CreateModel(
+            name='WriteOffItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('direction', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.direction')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.location')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.material')),
+                ('writeoff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='main.materialwriteoff')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ApiIdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100)),
+                ('kind', models.CharField(choices=[('INCOME', 'Поступление'), ('TRANSFER', 'Перемещение'), ('WRITEOFF', 'Списание')], max_length=10)),
+                ('document_id', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'key')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('movement_xlsx', 'Движение, Excel'), ('movement_csv', 'Движение, CSV'), ('deficit_xlsx', 'Дефицит, Excel')], max_length=20, verbose_name='Выгрузка')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Параметры')),
+                ('cache_key', models.CharField(db_index=True, max_length=64)),
+                ('status', models.CharField(choices=[('PENDING', 'В очереди'), ('RUNNING', 'Выполняется'), ('DONE', 'Готов'), ('FAILED', 'Ошибка')], default='PENDING', max_length=10, verbose_name='Статус')),
+                ('file', models.FileField(blank=True, upload_to='exports/', verbose_name='Файл')),
+                ('size', models.PositiveBigIntegerField(default=0, verbose_name='Размер, байт')),
+                ('message', models.TextField(blank=True, verbose_name='Сообщение')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, verbose_name='Последнее обращение')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL, verbose_name='Запросил')),
+            ],
+            options={
+                'verbose_name': 'Задание выгрузки',
+                'verbose_name_plural': 'Задания выгрузки',
+                'indexes': [models.Index(fields=['status', 'heartbeat_at'], name='main_export_status_9e4243_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports/', verbose_name='Файл')),
+                ('group', models.BooleanField(default=False, verbose_name='Группировать строки в документы')),
+                ('status', models.CharField(choices=[('PENDING', 'В очереди'), ('RUNNING', 'Выполняется'), ('DONE', 'Завершён'), ('FAILED', 'Ошибка')], default='PENDING', max_length=10, verbose_name='Статус')),
+                ('last_row', models.PositiveIntegerField(default=1, verbose_name='Последняя обработанная строка')),
+                ('imported_rows', models.PositiveIntegerField(default=0, verbose_name='Импортировано строк')),
+                ('created_docs', models.PositiveIntegerField(default=0, verbose_name='Создано поступлений')),
+                ('error_count', models.PositiveIntegerField(default=0, verbose_name='Ошибок')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Ошибки')),
+                ('message', models.TextField(blank=True, verbose_name='Сообщение')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Задание импорта',
+                'verbose_name_plural': 'Задания импорта',
+                'indexes': [models.Index(fields=['status', 'heartbeat_at'], name='main_import_status_773918_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MaterialLocationMinimum',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_quantity', models.DecimalField(decimal_places=3, max_digits=12, verbose_name='Минимальный остаток')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.location', verbose_name='Место хранения')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_minimums', to='main.material')),
+            ],
+            options={
+                'verbose_name': 'Минимальный остаток на месте хранения',
+                'verbose_name_plural': 'Минимальные остатки на местах хранения',
+                'unique_together': {('material', 'location')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='materialtransfer',
+            index=models.Index(fields=['date', 'id'], name='main_materi_date_fac65c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='materialwriteoff',
+            index=models.Index(fields=['date', 'id'], name='main_materi_date_48032a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['updated_at', 'id'], name='main_stock_updated_at'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(condition=models.Q(('quantity__lt', models.F('min_quantity'))), fields=['material', 'location'], name='main_stock_below_minimum'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stock',
+            unique_together={('material', 'direction', 'location')},
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['material', 'location', 'date'], name='main_stockm_materia_3fab10_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['date'], name='main_stockm_date_c9f6f0_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stocksnapshotline',
+            unique_together={('snapshot', 'material', 'direction', 'location')},
+        ),
+        migrations.AddIndex(
+            model_name='materialincome',
+            index=models.Index(fields=['date', 'id'], name='main_materi_date_3632ad_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# Триграммные GIN-индексы для search.search_materials. В Meta.indexes их не
+# описать: SQLite не знает ни USING gin, ни классов операторов, а поиск там
+# идёт по индексу в памяти. TrigramExtension не используется, потому что
+# django.contrib.postgres.operations требует psycopg и на SQLite
+INDEXES = {
+    "main_material_name_trgm": "name",
+    "main_material_article_trgm": "article",
+}
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, column in INDEXES.items():
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON main_material USING gin (UPPER({column}) gin_trgm_ops)"
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def fill_stock_min_quantity(apps, schema_editor):
+    """Пороги для строк Stock, созданных до появления порогов (там значение по умолчанию).
+
+    Правило то же, что у stock.sync_stock_minimums: порог материала на
+    складе, иначе общий порог материала. Меняются только отличающиеся строки.
+    """
+    Stock = apps.get_model("main", "Stock")
+    Material = apps.get_model("main", "Material")
+    MaterialLocationMinimum = apps.get_model("main", "MaterialLocationMinimum")
+    using = schema_editor.connection.alias
+
+    expected = Coalesce(
+        Subquery(
+            MaterialLocationMinimum.objects.using(using)
+            .filter(material=OuterRef("material_id"), location=OuterRef("location_id"))
+            .values("min_quantity")[:1]
+        ),
+        Subquery(Material.objects.using(using).filter(pk=OuterRef("material_id")).values("min_quantity")[:1]),
+    )
+    Stock.objects.using(using).exclude(min_quantity=expected).update(min_quantity=expected, updated_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0002_material_search_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_stock_min_quantity, migrations.RunPython.noop),
+    ]
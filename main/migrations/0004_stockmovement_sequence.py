@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:00
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_existing_movements(apps, schema_editor):
+    # Уже зафиксированные записи нумеруются по id, счётчик продолжает с последнего
+    StockMovement = apps.get_model("main", "StockMovement")
+    DataVersion = apps.get_model("main", "DataVersion")
+    using = schema_editor.connection.alias
+    StockMovement.objects.using(using).update(sequence=F("id"))
+    last = StockMovement.objects.using(using).aggregate(last=Max("id"))["last"] or 0
+    DataVersion.objects.using(using).create(name="movements", value=last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_fill_stock_min_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.PositiveBigIntegerField(default=0)),
+                ('changed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='sequence',
+            field=models.PositiveBigIntegerField(blank=True, null=True, unique=True, verbose_name='Номер фиксации'),
+        ),
+        migrations.RunPython(number_existing_movements, migrations.RunPython.noop),
+    ]
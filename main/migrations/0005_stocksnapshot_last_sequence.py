@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Граница снимка — номер фиксации журнала; у записей до 0004 он равен id,
+    # поэтому сохранённые значения остаются верными
+
+    dependencies = [
+        ('main', '0004_stockmovement_sequence'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='stocksnapshot',
+            old_name='last_movement_id',
+            new_name='last_sequence',
+        ),
+        migrations.AlterField(
+            model_name='stocksnapshot',
+            name='last_sequence',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Последний учтённый номер фиксации журнала'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import secrets
+
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -32,6 +34,9 @@ class Material(models.Model):
     name = models.CharField(max_length=255, unique=True, verbose_name="Наименование материала")
     article = models.CharField(max_length=100, unique=True, verbose_name="Артикул")
     unit = models.ForeignKey(Unit, on_delete=models.PROTECT, verbose_name="Ед. изм.")
+    min_quantity = models.DecimalField(
+        max_digits=12, decimal_places=3, default=10, verbose_name="Минимальный остаток"
+    )
 
     def __str__(self):
         return f"{self.name} ({self.article})"
@@ -65,6 +70,19 @@ class Location(models.Model):
         return f"{self.name} ({self.get_type_display()})"
 
 
+class MaterialLocationMinimum(models.Model):
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name="location_minimums")
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, verbose_name="Место хранения")
+    min_quantity = models.DecimalField(max_digits=12, decimal_places=3, verbose_name="Минимальный остаток")
+
+    class Meta:
+        verbose_name = "Минимальный остаток на месте хранения"
+        verbose_name_plural = "Минимальные остатки на местах хранения"
+        unique_together = ("material", "location")
+
+    def __str__(self):
+        return f"{self.material} в {self.location}: не меньше {self.min_quantity}"
+
 
 class MaterialIncome(models.Model):
     date = models.DateField(verbose_name="Дата поступления")
@@ -73,6 +91,9 @@ class MaterialIncome(models.Model):
     responsible = models.ForeignKey(User, on_delete=models.PROTECT, verbose_name="Ответственный")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["date", "id"])]
+
     def __str__(self):
         return f"Поступление от {self.date} ({self.supplier})"
 
@@ -95,6 +116,9 @@ class MaterialTransfer(models.Model):
     responsible = models.ForeignKey(User, on_delete=models.PROTECT, verbose_name="Ответственный")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["date", "id"])]
+
     def __str__(self):
         return f"Перемещение от {self.date}"
 
@@ -120,6 +144,9 @@ class MaterialWriteOff(models.Model):
     responsible = models.ForeignKey(User, on_delete=models.PROTECT, verbose_name="Ответственный")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["date", "id"])]
+
     def __str__(self):
         return f"Списание от {self.date} — {self.reason}"
 
@@ -140,9 +167,206 @@ class Stock(models.Model):
     direction = models.ForeignKey(Direction, on_delete=models.CASCADE)
     location = models.ForeignKey(Location, on_delete=models.CASCADE)
     quantity = models.DecimalField(max_digits=12, decimal_places=3, default=0)
+    # Копия порога материала (или порога для склада), поддерживается main.stock
+    min_quantity = models.DecimalField(max_digits=12, decimal_places=3, default=0)
+    # Время последнего изменения строки, курсор выгрузки изменений (main.api)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ("material", "direction", "location")
+        indexes = [
+            models.Index(fields=["updated_at", "id"], name="main_stock_updated_at"),
+            models.Index(
+                fields=["material", "location"],
+                condition=models.Q(quantity__lt=models.F("min_quantity")),
+                name="main_stock_below_minimum",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.material} — {self.quantity} в {self.location}"
+
+class StockMovement(models.Model):
+    INCOME = 'INCOME'
+    TRANSFER = 'TRANSFER'
+    WRITEOFF = 'WRITEOFF'
+    KINDS = [
+        (INCOME, 'Поступление'),
+        (TRANSFER, 'Перемещение'),
+        (WRITEOFF, 'Списание'),
+    ]
+
+    material = models.ForeignKey(Material, on_delete=models.PROTECT, verbose_name="Материал")
+    direction = models.ForeignKey(Direction, on_delete=models.PROTECT, verbose_name="Направление")
+    location = models.ForeignKey(Location, on_delete=models.PROTECT, verbose_name="Место хранения")
+    date = models.DateField(verbose_name="Дата документа")
+    quantity = models.DecimalField(max_digits=12, decimal_places=3, verbose_name="Изменение остатка")
+    kind = models.CharField(max_length=10, choices=KINDS, verbose_name="Тип документа")
+    document_id = models.PositiveBigIntegerField(verbose_name="ID документа")
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Номер в порядке фиксации: выдаётся после COMMIT (main.stock.sequence_movements),
+    # курсор выгрузки журнала (main.api); до нумерации — NULL
+    sequence = models.PositiveBigIntegerField(null=True, blank=True, unique=True, verbose_name="Номер фиксации")
+
+    class Meta:
+        verbose_name = "Движение по складу"
+        verbose_name_plural = "Журнал движений"
+        indexes = [
+            models.Index(fields=["material", "location", "date"]),
+            models.Index(fields=["date"]),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.document_id} от {self.date}: {self.quantity}"
+
+
+class DataVersion(models.Model):
+    """Счётчик, общий для всех процессов (последний номер фиксации журнала, версия отчётов)."""
+
+    MOVEMENTS = "movements"
+    REPORTS = "reports"
+
+    name = models.CharField(max_length=50, unique=True)
+    value = models.PositiveBigIntegerField(default=0)
+    changed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class StockSnapshot(models.Model):
+    period_end = models.DateField(unique=True, verbose_name="Остатки на конец дня")
+    last_sequence = models.PositiveBigIntegerField(default=0, verbose_name="Последний учтённый номер фиксации журнала")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Снимок остатков"
+        verbose_name_plural = "Снимки остатков"
+
+    def __str__(self):
+        return f"Остатки на {self.period_end}"
+
+
+class StockSnapshotLine(models.Model):
+    snapshot = models.ForeignKey(StockSnapshot, on_delete=models.CASCADE, related_name="lines")
+    material = models.ForeignKey(Material, on_delete=models.CASCADE)
+    direction = models.ForeignKey(Direction, on_delete=models.CASCADE)
+    location = models.ForeignKey(Location, on_delete=models.CASCADE)
+    quantity = models.DecimalField(max_digits=12, decimal_places=3)
+
+    class Meta:
+        unique_together = ("snapshot", "material", "direction", "location")
+
+
+class ImportJob(models.Model):
+    STATUS_PENDING = 'PENDING'
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_DONE = 'DONE'
+    STATUS_FAILED = 'FAILED'
+    STATUSES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Завершён'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    file = models.FileField(upload_to="imports/", verbose_name="Файл")
+    user = models.ForeignKey(User, on_delete=models.PROTECT, verbose_name="Пользователь")
+    group = models.BooleanField(default=False, verbose_name="Группировать строки в документы")
+    status = models.CharField(max_length=10, choices=STATUSES, default=STATUS_PENDING, verbose_name="Статус")
+    last_row = models.PositiveIntegerField(default=1, verbose_name="Последняя обработанная строка")
+    imported_rows = models.PositiveIntegerField(default=0, verbose_name="Импортировано строк")
+    created_docs = models.PositiveIntegerField(default=0, verbose_name="Создано поступлений")
+    error_count = models.PositiveIntegerField(default=0, verbose_name="Ошибок")
+    errors = models.JSONField(default=list, blank=True, verbose_name="Ошибки")
+    message = models.TextField(blank=True, verbose_name="Сообщение")
+    created_at = models.DateTimeField(auto_now_add=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Задание импорта"
+        verbose_name_plural = "Задания импорта"
+        indexes = [models.Index(fields=["status", "heartbeat_at"])]
+
+    def __str__(self):
+        return f"Импорт #{self.pk} ({self.get_status_display()})"
+
+
+class ExportJob(models.Model):
+    STATUS_PENDING = 'PENDING'
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_DONE = 'DONE'
+    STATUS_FAILED = 'FAILED'
+    STATUSES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готов'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    MOVEMENT_XLSX = 'movement_xlsx'
+    MOVEMENT_CSV = 'movement_csv'
+    DEFICIT_XLSX = 'deficit_xlsx'
+    KINDS = [
+        (MOVEMENT_XLSX, 'Движение, Excel'),
+        (MOVEMENT_CSV, 'Движение, CSV'),
+        (DEFICIT_XLSX, 'Дефицит, Excel'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KINDS, verbose_name="Выгрузка")
+    params = models.JSONField(default=dict, blank=True, verbose_name="Параметры")
+    # Вид, параметры и версия данных: одинаковые запросы получают один файл
+    cache_key = models.CharField(max_length=64, db_index=True)
+    user = models.ForeignKey(User, on_delete=models.PROTECT, verbose_name="Запросил")
+    status = models.CharField(max_length=10, choices=STATUSES, default=STATUS_PENDING, verbose_name="Статус")
+    file = models.FileField(upload_to="exports/", blank=True, verbose_name="Файл")
+    size = models.PositiveBigIntegerField(default=0, verbose_name="Размер, байт")
+    message = models.TextField(blank=True, verbose_name="Сообщение")
+    created_at = models.DateTimeField(auto_now_add=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, verbose_name="Последнее обращение")
+
+    class Meta:
+        verbose_name = "Задание выгрузки"
+        verbose_name_plural = "Задания выгрузки"
+        indexes = [models.Index(fields=["status", "heartbeat_at"])]
+
+    def __str__(self):
+        return f"Выгрузка #{self.pk} ({self.get_status_display()})"
+
+
+class ApiToken(models.Model):
+    key = models.CharField(max_length=40, unique=True, verbose_name="Ключ")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="api_tokens", verbose_name="Пользователь")
+    name = models.CharField(max_length=100, blank=True, verbose_name="Интеграция")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Токен API"
+        verbose_name_plural = "Токены API"
+
+    def save(self, *args, **kwargs):
+        if not self.key:
+            self.key = secrets.token_hex(20)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.name or self.user} ({self.key[:6]}…)"
+
+
+class ApiIdempotencyKey(models.Model):
+    """Документ, уже проведённый через API под ключом идемпотентности клиента."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=100)
+    kind = models.CharField(max_length=10, choices=StockMovement.KINDS)
+    document_id = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("user", "key")
 
     def __str__(self):
-        return f"{self.material} — {self.quantity} в {self.location}"
\ No newline at end of file
+        return f"{self.key} → {self.get_kind_display()} #{self.document_id}"
@@ -0,0 +1,103 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class KeysetPage:
+    """Страница списка с курсором на следующую страницу."""
+
+    def __init__(self, items, next_query, first_query, is_first):
+        self.items = items
+        self.next_query = next_query
+        self.first_query = first_query
+        self.is_first = is_first
+
+    @property
+    def has_next(self):
+        return self.next_query is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def page_size(request):
+    try:
+        size = int(request.GET.get("per_page", PAGE_SIZE))
+    except ValueError:
+        size = PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_paginate(request, queryset, ordering):
+    """Постраничный вывод по ключу (keyset) вместо OFFSET.
+
+    ``ordering`` — уникальный набор полей сортировки, например ("-date", "-id").
+    Следующая страница выбирается условием «после последней строки», поэтому
+    любая страница стоит как первая при наличии индекса по этим полям.
+    """
+    size = page_size(request)
+    cursor = _decode_cursor(request.GET.get("cursor"), len(ordering))
+    queryset = queryset.order_by(*ordering)
+    if cursor is not None:
+        try:
+            queryset = queryset.filter(_after(ordering, cursor))
+        except (ValidationError, ValueError):
+            cursor = None
+
+    items = list(queryset[:size + 1])
+    next_query = None
+    if len(items) > size:
+        items = items[:size]
+        next_query = _query_with_cursor(request, _encode_cursor([_value(items[-1], f) for f in ordering]))
+    return KeysetPage(items, next_query, _query_with_cursor(request, None), cursor is None)
+
+
+def _after(ordering, values):
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        step = Q(**{f"{name}__{lookup}": values[i]})
+        for prev_field, prev_value in zip(ordering[:i], values[:i]):
+            step &= Q(**{prev_field.lstrip("-"): prev_value})
+        condition |= step
+    return condition
+
+
+def _value(obj, field):
+    for attr in field.lstrip("-").split("__"):
+        obj = getattr(obj, attr)
+    return str(obj)
+
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode_cursor(cursor, length):
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def _query_with_cursor(request, cursor):
+    params = request.GET.copy()
+    params.pop("cursor", None)
+    if cursor:
+        params["cursor"] = cursor
+    return params.urlencode()
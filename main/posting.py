@@ -0,0 +1,91 @@
+from django.db import transaction
+
+from .metrics import document_items, documents_posted
+from .models import IncomeItem, TransferItem, WriteOffItem, StockMovement
+from .stock import (
+    InsufficientStock, apply_documents_deltas, fold_deltas, lock_stock, outgoing_quantities, stock_shortages,
+    income_item_deltas, transfer_item_deltas, writeoff_item_deltas
+)
+
+
+INCOME_POSTING = (IncomeItem, "income", StockMovement.INCOME, income_item_deltas)
+TRANSFER_POSTING = (TransferItem, "transfer", StockMovement.TRANSFER, transfer_item_deltas)
+WRITEOFF_POSTING = (WriteOffItem, "writeoff", StockMovement.WRITEOFF, writeoff_item_deltas)
+
+
+def post_income(income, items):
+    return _post_document(income, items, INCOME_POSTING)
+
+
+def post_transfer(transfer, items):
+    return _post_document(transfer, items, TRANSFER_POSTING, check_stock=True)
+
+
+def post_writeoff(writeoff, items):
+    return _post_document(writeoff, items, WRITEOFF_POSTING, check_stock=True)
+
+
+def _post_document(document, items, posting, check_stock=False):
+    """Проводит документ целиком в одной транзакции.
+
+    Позиции вставляются через bulk_create (post_save не срабатывает, поэтому
+    сигналы не меняют остатки повторно), а изменения остатков сворачиваются
+    по ключу (материал, направление, место) и применяются одним запросом.
+
+    При ``check_stock`` строки Stock всех ключей документа (списываемых и
+    приходуемых) блокируются в порядке проведения, а остатки списываемых
+    проверяются до записи; при нехватке выбрасывается InsufficientStock.
+    """
+    items = list(items)
+    item_model, fk_name, kind, deltas_fn = posting
+    with transaction.atomic():
+        if check_stock:
+            deltas = fold_deltas(entry for item in items for entry in deltas_fn(item))
+            shortages = stock_shortages(outgoing_quantities(deltas.items()), lock_stock(deltas))
+            if shortages:
+                raise InsufficientStock(shortages)
+        document.save()
+        for item in items:
+            setattr(item, fk_name, document)
+        _post_items(items, posting, locked=check_stock)
+    return document
+
+
+def post_income_items(items):
+    """Вставляет позиции уже сохранённых поступлений и обновляет остатки.
+
+    Вызывается внутри транзакции; у каждой позиции должен быть задан ``income``.
+    """
+    post_items(items, INCOME_POSTING)
+
+
+def post_items(items, posting, locked=False):
+    """То же для любого вида документа (``INCOME_POSTING``, ``TRANSFER_POSTING``...).
+
+    ``locked`` — строки Stock всех ключей уже заблокированы (см. ``stock.lock_stock``).
+    """
+    _post_items(list(items), posting, locked)
+
+
+def _post_items(items, posting, locked=False):
+    item_model, fk_name, kind, deltas_fn = posting
+    item_model.objects.bulk_create(items)
+
+    documents = {}
+    entries = {}
+    for item in items:
+        document = getattr(item, fk_name)
+        documents[document.pk] = document
+        entries.setdefault(document.pk, []).extend(deltas_fn(item))
+    apply_documents_deltas(
+        ((kind, pk, documents[pk].date, document_entries) for pk, document_entries in entries.items()),
+        locked=locked,
+    )
+
+    documents_posted.inc(len(documents), kind=kind)
+    counts = {}
+    for item in items:
+        pk = getattr(item, fk_name).pk
+        counts[pk] = counts.get(pk, 0) + 1
+    for count in counts.values():
+        document_items.observe(count, kind=kind)
@@ -0,0 +1,110 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max, Min, Sum
+
+from .models import IncomeItem, Material, Stock, TransferItem, WriteOffItem
+from .stock import apply_stock_deltas, create_stock_rows, lock_stock
+
+# Сколько id материалов проверяет один рабочий процесс за раз
+RECONCILE_RANGE_SIZE = 1000
+
+# Источник, поля ключа и знак: по одной агрегирующей выборке на сторону движения
+BALANCE_SOURCES = [
+    (IncomeItem, ("material_id", "direction_id", "location_id"), 1),
+    (TransferItem, ("material_id", "from_direction_id", "from_location_id"), -1),
+    (TransferItem, ("material_id", "to_direction_id", "to_location_id"), 1),
+    (WriteOffItem, ("material_id", "direction_id", "location_id"), -1),
+]
+
+
+def material_ranges(range_size=RECONCILE_RANGE_SIZE):
+    """Полуинтервалы [начало, конец) id материалов для раздачи рабочим процессам."""
+    bounds = Material.objects.aggregate(first=Min("id"), last=Max("id"))
+    if bounds["first"] is None:
+        return []
+    return [
+        (start, min(start + range_size, bounds["last"] + 1))
+        for start in range(bounds["first"], bounds["last"] + 1, range_size)
+    ]
+
+
+def expected_balances(start, end, material_ids=None):
+    """Остатки по документам для материалов с id в [start, end).
+
+    Суммы считает СУБД (GROUP BY по ключу), в Python приходит по строке на ключ.
+    """
+    balances = defaultdict(Decimal)
+    for model, fields, sign in BALANCE_SOURCES:
+        items = model.objects.filter(material_id__gte=start, material_id__lt=end)
+        if material_ids is not None:
+            items = items.filter(material_id__in=material_ids)
+        totals = items.values_list(*fields).annotate(total=Sum("quantity")).order_by()
+        for material_id, direction_id, location_id, total in totals.iterator():
+            balances[(material_id, direction_id, location_id)] += sign * total
+    return balances
+
+
+def stock_differences(start, end, material_ids=None):
+    """Расхождения Stock с документами: список (ключ, в Stock, по документам).
+
+    Stock и суммы по документам читаются разными запросами. Проведение,
+    зафиксированное между ними, даёт мнимое расхождение, поэтому без
+    блокировки (см. ``fix_differences``) результат годится только для отчёта.
+    """
+    stocks = Stock.objects.filter(material_id__gte=start, material_id__lt=end)
+    if material_ids is not None:
+        stocks = stocks.filter(material_id__in=material_ids)
+    actual = {
+        (material_id, direction_id, location_id): quantity
+        for material_id, direction_id, location_id, quantity in stocks.values_list(
+            "material_id", "direction_id", "location_id", "quantity"
+        ).iterator()
+    }
+    expected = expected_balances(start, end, material_ids)
+    return [
+        (key, actual.get(key, Decimal(0)), expected.get(key, Decimal(0)))
+        for key in sorted(actual.keys() | expected.keys())
+        if actual.get(key, Decimal(0)) != expected.get(key, Decimal(0))
+    ]
+
+
+def fix_differences(start, end, differences):
+    """Перепроверяет найденные расхождения под блокировкой и исправляет подтверждённые.
+
+    Блокируются строки Stock ключей из ``differences`` в том же порядке, что
+    и при проведении (``lock_stock``): проведение, затрагивающее ключ, пишет
+    его строку Stock до COMMIT, поэтому незавершённые проведения успевают
+    зафиксироваться, а новые ждут конца исправления. Ключам без строки Stock
+    она сначала создаётся с нулём отдельной короткой вставкой, иначе
+    блокировать было бы нечего. Повторное чтение под блокировкой
+    согласовано; исправление пишется как разница и не затирает чужие
+    изменения. Возвращает подтверждённые расхождения.
+    """
+    keys = sorted({key for key, _, _ in differences})
+    if not keys:
+        return []
+    create_stock_rows(keys)
+
+    with transaction.atomic():
+        lock_stock(keys)
+        locked = set(keys)
+        confirmed = [
+            difference for difference in stock_differences(start, end, sorted({key[0] for key in keys}))
+            if difference[0] in locked
+        ]
+        apply_stock_deltas({key: expected - actual for key, actual, expected in confirmed}, locked=True)
+    return confirmed
+
+
+def reconcile_range(start, end, fix=False):
+    """Сверяет (и при ``fix=True`` исправляет) остатки материалов с id в [start, end).
+
+    Сверка идёт без блокировок; при исправлении блокируются только
+    строки Stock с найденными расхождениями, и только на время перепроверки.
+    """
+    differences = stock_differences(start, end)
+    if fix:
+        return fix_differences(start, end, differences)
+    return differences
@@ -0,0 +1,127 @@
+import threading
+import time
+
+from django import forms
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import Material, Direction, Location
+
+REFERENCE_MODELS = {
+    "material": Material,
+    "direction": Direction,
+    "location": Location,
+}
+
+# Сколько секунд процесс доверяет своей копии справочника без проверки версии
+REFERENCE_CHECK_INTERVAL = 1
+# Предельный возраст копии: страховка, если кэш версий не общий для процессов
+REFERENCE_MAX_AGE = 300
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def _version_key(name):
+    return f"reference:{name}:version"
+
+
+def bump_reference_version(name):
+    """Сбрасывает копии справочника сразу и ещё раз после фиксации транзакции.
+
+    Повторный сброс нужен, чтобы копия, которую параллельный запрос успел
+    перечитать до COMMIT под новой версией, не жила до REFERENCE_MAX_AGE.
+    """
+    _bump(name)
+    transaction.on_commit(lambda: _bump(name))
+
+
+def _bump(name):
+    try:
+        cache.incr(_version_key(name))
+    except ValueError:
+        cache.set(_version_key(name), 1, None)
+    with _lock:
+        _loaded.pop(name, None)
+
+
+def reference_objects(name):
+    """Справочник {pk: объект}, загруженный одним запросом и общий для всех форм.
+
+    Копия живёт в памяти процесса и перечитывается, когда сигналы save/delete
+    увеличат версию справочника в кэше Django.
+    """
+    return _entry(name)["objects"]
+
+
+def reference_choices(name):
+    return _entry(name)["choices"]
+
+
+def _entry(name):
+    now = time.monotonic()
+    entry = _loaded.get(name)
+    if entry is not None and now - entry["checked"] < REFERENCE_CHECK_INTERVAL:
+        return entry
+
+    version = cache.get(_version_key(name), 0)
+    with _lock:
+        entry = _loaded.get(name)
+        if entry is None or entry["version"] != version or now - entry["loaded"] > REFERENCE_MAX_AGE:
+            objects = {obj.pk: obj for obj in REFERENCE_MODELS[name].objects.order_by("name")}
+            choices = [(pk, str(obj)) for pk, obj in objects.items()]
+            entry = {"version": version, "objects": objects, "choices": choices, "loaded": now}
+            _loaded[name] = entry
+        entry["checked"] = now
+    return entry
+
+
+class ReferenceChoiceIterator(forms.models.ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield "", self.field.empty_label
+        yield from reference_choices(self.field.reference)
+
+    def __len__(self):
+        return len(reference_choices(self.field.reference)) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(reference_choices(self.field.reference))
+
+
+class ReferenceChoiceField(forms.ModelChoiceField):
+    """Выбор из справочника без запросов на каждую строку формсета."""
+
+    iterator = ReferenceChoiceIterator
+
+    def __init__(self, reference, **kwargs):
+        self.reference = reference
+        super().__init__(REFERENCE_MODELS[reference].objects.none(), **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, REFERENCE_MODELS[self.reference]):
+            value = value.pk
+        try:
+            return reference_objects(self.reference)[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(
+                self.error_messages["invalid_choice"], code="invalid_choice", params={"value": value}
+            )
+
+    def validate(self, value):
+        forms.Field.validate(self, value)
+
+
+class ReferenceModelForm(forms.ModelForm):
+    """ModelForm, который не перепроверяет справочные FK запросом к БД.
+
+    Значения ReferenceChoiceField уже проверены по справочнику в памяти.
+    """
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        exclude.update(name for name, field in self.fields.items() if isinstance(field, ReferenceChoiceField))
+        return exclude
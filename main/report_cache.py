@@ -0,0 +1,175 @@
+import hashlib
+import secrets
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from .metrics import report_cache_requests
+from .models import DataVersion
+
+# Отдельный кэш с вытеснением давно не использованных отчётов (см. CACHES)
+REPORT_CACHE_ALIAS = "reports"
+REPORT_CACHE_TIMEOUT = 300
+
+
+class _ReportsChange:
+    """Изменения данных в незафиксированной транзакции.
+
+    После COMMIT увеличивает общую для процессов версию отчётов в БД; до
+    него ``token`` и ``changes`` входят в версию данных только этого
+    соединения, чтобы изменивший данные код сразу видел свежие отчёты.
+    """
+
+    def __init__(self):
+        self.token = secrets.token_hex(8)
+        self.changes = 0
+
+    def __call__(self):
+        _bump_reports_version()
+
+
+def invalidate_reports():
+    """Сбрасывает кэш отчётов: версия в БД увеличивается после фиксации транзакции.
+
+    На транзакцию — одно увеличение, сколько бы записей она ни изменила;
+    при откате транзакции (или точки сохранения) Django отбрасывает и его.
+    """
+    change = _pending_change()
+    if change is None:
+        change = _ReportsChange()
+        # Вне транзакции выполняется сразу
+        transaction.on_commit(change)
+    change.changes += 1
+
+
+def _pending_change():
+    for _, callback, _ in transaction.get_connection().run_on_commit:
+        if isinstance(callback, _ReportsChange):
+            return callback
+    return None
+
+
+def _bump_reports_version():
+    now = timezone.now()
+    versions = DataVersion.objects.filter(name=DataVersion.REPORTS)
+    if not versions.update(value=F("value") + 1, changed_at=now):
+        DataVersion.objects.get_or_create(name=DataVersion.REPORTS)
+        versions.update(value=F("value") + 1, changed_at=now)
+
+
+def data_version(request=None):
+    """Версия данных отчётов и выгрузок по состоянию БД, одинаковая во всех процессах.
+
+    Складывается из версии отчётов (правки документов, остатков и
+    справочников) и последнего номера фиксации журнала движений (см.
+    ``main.stock.sequence_movements``) — оба счётчика хранятся в DataVersion.
+    Незафиксированные изменения текущей транзакции добавляют свою метку.
+    """
+    versions = _data_versions(request)[0]
+    version = f"{versions.get(DataVersion.REPORTS, 0)}:{versions.get(DataVersion.MOVEMENTS, 0)}"
+    change = _pending_change()
+    if change is not None:
+        version += f":{change.token}.{change.changes}"
+    return version
+
+
+def _data_versions(request=None):
+    # Один запрос на HTTP-запрос: общий для ключа кэша, ETag и Last-Modified
+    state = getattr(request, "_data_versions", None)
+    if state is None:
+        versions, changed_at = {}, []
+        for name, value, changed in DataVersion.objects.filter(
+            name__in=[DataVersion.REPORTS, DataVersion.MOVEMENTS]
+        ).values_list("name", "value", "changed_at"):
+            versions[name] = value
+            changed_at.append(changed)
+        state = (versions, max(changed_at, default=None))
+        if request is not None:
+            request._data_versions = state
+    return state
+
+
+def cached_report(name, request, compute):
+    """Результат ``compute()`` для отчёта ``name`` с параметрами GET-запроса.
+
+    Ключ — параметры запроса и версия данных (см. ``data_version``), та же,
+    что входит в ETag, поэтому закэшированный отчёт не расходится с ETag.
+    Повторный просмотр отчёта без изменений данных не строит отчёт заново.
+    """
+    key = _report_key(name, request)
+    reports = caches[REPORT_CACHE_ALIAS]
+    result = reports.get(key)
+    if result is not None:
+        report_cache_requests.inc(report=name, result="hit")
+        return result
+    report_cache_requests.inc(report=name, result="miss")
+    result = compute()
+    reports.set(key, result, REPORT_CACHE_TIMEOUT)
+    return result
+
+
+async def acached_report(name, request, compute):
+    """То же для async-представлений; ``compute`` — корутинная функция."""
+    key = await sync_to_async(_report_key)(name, request)
+    reports = caches[REPORT_CACHE_ALIAS]
+    result = await reports.aget(key)
+    if result is not None:
+        report_cache_requests.inc(report=name, result="hit")
+        return result
+    report_cache_requests.inc(report=name, result="miss")
+    result = await compute()
+    await reports.aset(key, result, REPORT_CACHE_TIMEOUT)
+    return result
+
+
+def _report_key(name, request):
+    params = repr(sorted(request.GET.lists())).encode()
+    return f"report:{name}:{data_version(request)}:{hashlib.sha1(params).hexdigest()}"
+
+
+def report_validators(request):
+    """ETag и Last-Modified отчёта без построения самого отчёта.
+
+    Используются версия данных (один запрос к DataVersion — ловит изменения
+    из любых процессов), параметры запроса и пользователь. Считаются один
+    раз на запрос.
+    """
+    validators = getattr(request, "_report_validators", None)
+    if validators is None:
+        source = repr((data_version(request), request.user.pk, request.path, sorted(request.GET.lists())))
+        validators = request._report_validators = (
+            hashlib.sha1(source.encode()).hexdigest(), _data_versions(request)[1],
+        )
+    return validators
+
+
+def conditional_report(view):
+    """Отвечает 304 Not Modified, если отчёт или выгрузка не изменились.
+
+    Ответ помечается ``Cache-Control: private, no-cache``: браузер хранит
+    копию, но каждый раз перепроверяет её по ETag.
+    """
+    conditional = cache_control(private=True, no_cache=True)(condition(
+        etag_func=lambda request, *args, **kwargs: report_validators(request)[0],
+        last_modified_func=lambda request, *args, **kwargs: report_validators(request)[1],
+    )(view))
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            # condition() вызывает функции проверки синхронно: запрос к БД
+            # выполняется заранее в потоке, дальше берётся сохранённое значение
+            await sync_to_async(report_validators)(request)
+            return await conditional(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return conditional(request, *args, **kwargs)
+    return wrapper
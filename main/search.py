@@ -0,0 +1,130 @@
+import re
+import threading
+from decimal import Decimal
+
+from django.contrib.postgres.lookups import TrigramSimilar
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connections
+from django.db.models import Case, DecimalField, Q, Value, When
+from django.db.models.functions import Cast, Greatest, Upper
+
+from .models import Material
+
+# Порог похожести, как у pg_trgm.similarity_threshold по умолчанию
+SIMILARITY_THRESHOLD = 0.3
+# Сколько лучших совпадений отдаёт индекс в памяти (SQLite)
+MAX_FALLBACK_RESULTS = 1000
+# Знаков похожести в ``rank``: десятичное значение точно переживает курсор
+# постраничного вывода, float4 из similarity() — нет
+RANK_DECIMAL_PLACES = 6
+
+
+def search_materials(queryset, query):
+    """Нечёткий поиск материалов по наименованию и артикулу.
+
+    Возвращает queryset с аннотацией ``rank`` (похожесть от 0 до 1, Decimal). На
+    PostgreSQL используются триграммные GIN-индексы из миграции
+    0002_material_search_indexes (подстрока через ILIKE и похожесть через
+    оператор %), на других СУБД — индекс в памяти.
+    """
+    query = query.strip()
+    if connections[queryset.db].vendor == "postgresql":
+        return _search_postgresql(queryset, query)
+    return _search_fallback(queryset, query)
+
+
+def _search_postgresql(queryset, query):
+    upper = query.upper()
+    return queryset.filter(
+        Q(name__icontains=query)
+        | Q(article__icontains=query)
+        | TrigramSimilar(Upper("name"), upper)
+        | TrigramSimilar(Upper("article"), upper)
+    ).annotate(
+        rank=Cast(
+            Greatest(TrigramSimilarity(Upper("name"), upper), TrigramSimilarity(Upper("article"), upper)),
+            _rank_field(),
+        )
+    )
+
+
+def _search_fallback(queryset, query):
+    ranked = material_index().search(query)[:MAX_FALLBACK_RESULTS]
+    if not ranked:
+        return queryset.none().annotate(rank=Value(Decimal(0), output_field=_rank_field()))
+    return queryset.filter(pk__in=[pk for pk, _ in ranked]).annotate(
+        rank=Case(
+            *[When(pk=pk, then=Value(Decimal(f"{score:.{RANK_DECIMAL_PLACES}f}"))) for pk, score in ranked],
+            default=Value(Decimal(0)),
+            output_field=_rank_field(),
+        )
+    )
+
+
+def _rank_field():
+    return DecimalField(max_digits=RANK_DECIMAL_PLACES + 1, decimal_places=RANK_DECIMAL_PLACES)
+
+
+def trigrams(text):
+    """Триграммы строки по правилам pg_trgm: слова в нижнем регистре с отступами."""
+    result = set()
+    for word in re.findall(r"\w+", text.lower()):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(left, right):
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+class MaterialIndex:
+    """Триграммный индекс материалов в памяти для СУБД без pg_trgm."""
+
+    def __init__(self, rows):
+        self.entries = {}
+        self.postings = {}
+        for pk, name, article in rows:
+            name_grams, article_grams = trigrams(name), trigrams(article)
+            self.entries[pk] = (name.lower(), article.lower(), name_grams, article_grams)
+            for gram in name_grams | article_grams:
+                self.postings.setdefault(gram, set()).add(pk)
+
+    def search(self, query):
+        needle = query.lower()
+        grams = trigrams(query)
+        if len(needle) < 3:
+            candidates = self.entries.keys()
+        else:
+            candidates = set()
+            for gram in grams:
+                candidates |= self.postings.get(gram, set())
+
+        ranked = []
+        for pk in candidates:
+            name, article, name_grams, article_grams = self.entries[pk]
+            score = max(similarity(grams, name_grams), similarity(grams, article_grams))
+            if score >= SIMILARITY_THRESHOLD or needle in name or needle in article:
+                ranked.append((pk, round(score, RANK_DECIMAL_PLACES)))
+        ranked.sort(key=lambda item: (-item[1], item[0]))
+        return ranked
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def material_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = MaterialIndex(Material.objects.values_list("id", "name", "article").iterator())
+        return _index
+
+
+def reset_material_index(**kwargs):
+    global _index
+    with _index_lock:
+        _index = None
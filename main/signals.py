@@ -1,48 +1,94 @@
+from django.contrib.auth.models import User
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import IncomeItem, TransferItem, WriteOffItem, Stock
+from .models import IncomeItem, TransferItem, WriteOffItem, StockMovement, Material, Direction, Location, \
+    MaterialLocationMinimum, MaterialIncome, MaterialTransfer, MaterialWriteOff, Stock, Supplier, Unit
+from .reference import REFERENCE_MODELS, bump_reference_version
+from .report_cache import invalidate_reports
+from .search import reset_material_index
+from .stock import apply_document_deltas, income_item_deltas, sync_stock_minimums, transfer_item_deltas, \
+    writeoff_item_deltas
 
 
 @receiver(post_save, sender=IncomeItem)
 def update_stock_on_income(sender, instance, created, **kwargs):
     if created:
-        _update_stock(instance.material, instance.direction, instance.location, instance.quantity)
+        _update_stock(StockMovement.INCOME, instance.income, income_item_deltas(instance))
 
 
 @receiver(post_delete, sender=IncomeItem)
 def rollback_stock_on_income_delete(sender, instance, **kwargs):
-    _update_stock(instance.material, instance.direction, instance.location, -instance.quantity)
+    _update_stock(StockMovement.INCOME, instance.income, income_item_deltas(instance, sign=-1))
 
 
 @receiver(post_save, sender=WriteOffItem)
 def update_stock_on_writeoff(sender, instance, created, **kwargs):
     if created:
-        _update_stock(instance.material, instance.direction, instance.location, -instance.quantity)
+        _update_stock(StockMovement.WRITEOFF, instance.writeoff, writeoff_item_deltas(instance))
 
 
 @receiver(post_delete, sender=WriteOffItem)
 def rollback_stock_on_writeoff_delete(sender, instance, **kwargs):
-    _update_stock(instance.material, instance.direction, instance.location, instance.quantity)
+    _update_stock(StockMovement.WRITEOFF, instance.writeoff, writeoff_item_deltas(instance, sign=-1))
 
 
 @receiver(post_save, sender=TransferItem)
 def update_stock_on_transfer(sender, instance, created, **kwargs):
     if created:
-        _update_stock(instance.material, instance.from_direction, instance.from_location, -instance.quantity)
-        _update_stock(instance.material, instance.to_direction, instance.to_location, instance.quantity)
+        _update_stock(StockMovement.TRANSFER, instance.transfer, transfer_item_deltas(instance))
 
 @receiver(post_delete, sender=TransferItem)
 def rollback_stock_on_transfer_delete(sender, instance, **kwargs):
-    _update_stock(instance.material, instance.from_direction, instance.from_location, instance.quantity)
-    _update_stock(instance.material, instance.to_direction, instance.to_location, -instance.quantity)
-
-
-def _update_stock(material, direction, location, delta_qty):
-    stock, created = Stock.objects.get_or_create(
-        material=material,
-        direction=direction,
-        location=location,
-        defaults={"quantity": 0}
-    )
-    stock.quantity += delta_qty
-    stock.save()
\ No newline at end of file
+    _update_stock(StockMovement.TRANSFER, instance.transfer, transfer_item_deltas(instance, sign=-1))
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_delete, sender=Material)
+def reset_material_search_index(sender, **kwargs):
+    reset_material_index()
+
+
+@receiver(post_save, sender=Material)
+def sync_material_minimum(sender, instance, created, **kwargs):
+    if not created:
+        sync_stock_minimums([instance.pk])
+
+
+@receiver(post_save, sender=MaterialLocationMinimum)
+@receiver(post_delete, sender=MaterialLocationMinimum)
+def sync_location_minimum(sender, instance, **kwargs):
+    sync_stock_minimums([instance.material_id])
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_delete, sender=Material)
+@receiver(post_save, sender=Direction)
+@receiver(post_delete, sender=Direction)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def bump_reference_data_version(sender, **kwargs):
+    for name, model in REFERENCE_MODELS.items():
+        if model is sender:
+            bump_reference_version(name)
+
+
+REPORTED_MODELS = [
+    MaterialIncome, MaterialTransfer, MaterialWriteOff, Stock, Material, Direction, Location, Supplier, Unit, User,
+]
+
+
+def invalidate_reports_on_change(sender, update_fields=None, **kwargs):
+    # Вход пользователя обновляет только last_login, отчёты от него не зависят
+    if sender is User and update_fields is not None and set(update_fields) == {"last_login"}:
+        return
+    invalidate_reports()
+
+
+for model in REPORTED_MODELS:
+    post_save.connect(invalidate_reports_on_change, sender=model, dispatch_uid=f"reports:save:{model.__name__}")
+    post_delete.connect(invalidate_reports_on_change, sender=model, dispatch_uid=f"reports:delete:{model.__name__}")
+
+
+def _update_stock(kind, document, entries):
+    # Все ключи позиции (у перемещения их два) применяются одним запросом
+    apply_document_deltas(kind, document.pk, document.date, entries)
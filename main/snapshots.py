@@ -0,0 +1,69 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from .models import StockMovement, StockSnapshot, StockSnapshotLine
+from .stock import sequence_movements
+
+
+def stock_as_of(day, material_ids=None, last_sequence=None):
+    """Остатки на конец дня ``day``: {(material_id, direction_id, location_id): количество}.
+
+    Берётся ближайший снимок на дату не позже ``day`` и к нему добавляются
+    движения журнала после даты снимка, а также записи, зафиксированные уже
+    после его построения (номер фиксации больше сохранённого в снимке или
+    ещё не выдан). Объём работы зависит от активности после снимка, а не от
+    всей истории.
+    """
+    balances = defaultdict(Decimal)
+    movements = StockMovement.objects.filter(date__lte=day)
+    if last_sequence is not None:
+        movements = movements.filter(sequence__lte=last_sequence)
+
+    snapshot = StockSnapshot.objects.filter(period_end__lte=day).order_by("-period_end").first()
+    if snapshot is not None:
+        lines = snapshot.lines.all()
+        if material_ids is not None:
+            lines = lines.filter(material_id__in=material_ids)
+        for material_id, direction_id, location_id, quantity in lines.values_list(
+            "material_id", "direction_id", "location_id", "quantity"
+        ).iterator():
+            balances[(material_id, direction_id, location_id)] += quantity
+        movements = movements.filter(
+            Q(date__gt=snapshot.period_end) | Q(sequence__gt=snapshot.last_sequence) | Q(sequence__isnull=True)
+        )
+
+    if material_ids is not None:
+        movements = movements.filter(material_id__in=material_ids)
+    totals = movements.values("material_id", "direction_id", "location_id").annotate(total=Sum("quantity")).order_by()
+    for row in totals.iterator():
+        balances[(row["material_id"], row["direction_id"], row["location_id"])] += row["total"]
+
+    return {key: quantity for key, quantity in balances.items() if quantity}
+
+
+def make_snapshot(period_end):
+    """Сохраняет (или пересчитывает) снимок остатков на конец дня ``period_end``.
+
+    Граница снимка — последний номер фиксации журнала, а не наибольший id:
+    запись с меньшим id из ещё не зафиксированной транзакции получит номер
+    позже и будет добавлена к снимку в ``stock_as_of``.
+    """
+    last_sequence = sequence_movements()
+    with transaction.atomic():
+        StockSnapshot.objects.filter(period_end=period_end).delete()
+        balances = stock_as_of(period_end, last_sequence=last_sequence)
+        snapshot = StockSnapshot.objects.create(period_end=period_end, last_sequence=last_sequence)
+        StockSnapshotLine.objects.bulk_create(
+            [
+                StockSnapshotLine(
+                    snapshot=snapshot, material_id=material_id, direction_id=direction_id,
+                    location_id=location_id, quantity=quantity,
+                )
+                for (material_id, direction_id, location_id), quantity in sorted(balances.items())
+            ],
+            batch_size=5000,
+        )
+    return snapshot
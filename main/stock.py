@@ -0,0 +1,365 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import F, Max, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .metrics import stock_update_keys, stock_update_seconds
+from .models import DataVersion, Material, MaterialLocationMinimum, Stock, StockMovement
+from .reference import reference_objects
+from .report_cache import invalidate_reports
+
+# Ключей в одном INSERT ... ON CONFLICT (по 8 параметров на ключ)
+UPSERT_BATCH_SIZE = 1000
+# Строки моложе этого возраста не выгружаются потоковым API (api.stream_stock):
+# транзакция, начатая раньше, может зафиксировать строку с меньшим курсором уже после выгрузки
+API_SYNC_SETTLE_SECONDS = 5
+
+
+class InsufficientStock(ValidationError):
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__([shortage_message(*shortage) for shortage in shortages])
+
+
+def shortage_message(key, available, requested):
+    material_id, direction_id, location_id = key
+    material = reference_objects("material").get(material_id, material_id)
+    direction = reference_objects("direction").get(direction_id, direction_id)
+    location = reference_objects("location").get(location_id, location_id)
+    return (
+        f"Недостаточно остатков: {material}, {location} / {direction}: "
+        f"доступно {available}, требуется {requested}"
+    )
+
+
+def outgoing_quantities(entries):
+    """Сколько документ забирает с каждого ключа (с учётом встречных движений)."""
+    return {key: -delta for key, delta in fold_deltas(entries).items() if delta < 0}
+
+
+def stock_shortages(requested, available=None):
+    """Сверяет запрошенные количества с остатками.
+
+    ``available`` — остатки, уже прочитанные под блокировкой (см.
+    ``lock_stock``); без них остатки читаются одним запросом без блокировки.
+    """
+    if not requested:
+        return []
+    if available is None:
+        available = stock_balances(requested)
+    return [
+        (key, available.get(key, Decimal(0)), quantity)
+        for key, quantity in sorted(requested.items())
+        if quantity > available.get(key, Decimal(0))
+    ]
+
+
+def lock_stock(keys):
+    """Блокирует строки Stock всех ключей до конца транзакции и возвращает их остатки.
+
+    Строки захватываются (SELECT ... FOR UPDATE) в порядке сортировки
+    ключей — том же, что у ``apply_stock_deltas``. Документ блокирует
+    сразу все свои ключи, и списываемые, и приходуемые: иначе встречные
+    перемещения держали бы по строке и ждали друг друга.
+    """
+    return stock_balances(keys, lock=True)
+
+
+def create_stock_rows(keys):
+    """Создаёт строки Stock с нулевым остатком для ключей, у которых строки ещё нет.
+
+    Нужна перед ``lock_stock``, когда блокировать надо и отсутствующие
+    ключи; вставка идёт одним запросом в порядке ключей, существующие и
+    параллельно вставленные строки не трогаются.
+    """
+    existing = stock_balances(keys)
+    Stock.objects.bulk_create([
+        Stock(material_id=material_id, direction_id=direction_id, location_id=location_id, quantity=Decimal(0),
+              min_quantity=_min_quantity(material_id, location_id))
+        for material_id, direction_id, location_id in sorted(keys)
+        if (material_id, direction_id, location_id) not in existing
+    ], ignore_conflicts=True)
+
+
+def stock_balances(keys, lock=False):
+    """Текущие остатки {ключ: количество} по набору ключей одним запросом на пачку."""
+    keys = sorted(keys)
+    balances = {}
+    for start in range(0, len(keys), UPSERT_BATCH_SIZE):
+        balances.update(_stock_balances(keys[start:start + UPSERT_BATCH_SIZE], lock))
+    return balances
+
+
+def _stock_balances(keys, lock):
+    condition = Q()
+    for material_id, direction_id, location_id in keys:
+        condition |= Q(material_id=material_id, direction_id=direction_id, location_id=location_id)
+    stocks = Stock.objects.filter(condition)
+    if lock:
+        stocks = stocks.select_for_update().order_by("material_id", "direction_id", "location_id")
+    return {
+        (material_id, direction_id, location_id): quantity
+        for material_id, direction_id, location_id, quantity in stocks.values_list(
+            "material_id", "direction_id", "location_id", "quantity"
+        )
+    }
+
+
+def fold_deltas(entries):
+    """Сворачивает пары (ключ, изменение) в словарь {ключ: суммарное изменение}.
+
+    Ключ — кортеж (material_id, direction_id, location_id).
+    """
+    deltas = defaultdict(Decimal)
+    for key, delta in entries:
+        deltas[key] += Decimal(delta)
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def apply_document_deltas(kind, document_id, date, entries):
+    apply_documents_deltas([(kind, document_id, date, entries)])
+
+
+def apply_documents_deltas(documents, locked=False):
+    """Проводит изменения остатков по документам.
+
+    ``documents`` — последовательность (тип, id документа, дата, изменения).
+    Изменения каждого документа сворачиваются по ключу и пишутся в журнал
+    StockMovement (по строке со знаком на ключ), а Stock обновляется одним
+    запросом на всю пачку. При удалении документа сюда же приходят обратные
+    изменения, поэтому журнал только дописывается. ``locked`` — строки
+    всех ключей уже заблокированы вызывающим (см. ``lock_stock``).
+    """
+    movements = []
+    totals = defaultdict(Decimal)
+    for kind, document_id, date, entries in documents:
+        for key, delta in sorted(fold_deltas(entries).items()):
+            material_id, direction_id, location_id = key
+            movements.append(StockMovement(
+                material_id=material_id, direction_id=direction_id, location_id=location_id,
+                date=date, quantity=delta, kind=kind, document_id=document_id,
+            ))
+            totals[key] += delta
+    if not movements:
+        return
+    stock_update_keys.observe(len(totals))
+    with stock_update_seconds.time(), transaction.atomic(savepoint=False):
+        StockMovement.objects.bulk_create(movements)
+        apply_stock_deltas(totals, locked=locked)
+        transaction.on_commit(sequence_movements)
+
+
+def sequence_movements():
+    """Нумерует зафиксированные записи журнала в порядке фиксации.
+
+    id и created_at запись получает при INSERT, а видна она становится
+    только при COMMIT: пачка импорта или API может зафиксировать записи
+    с меньшими id уже после того, как читатель прошёл дальше. Номер
+    ``sequence`` выдаётся после COMMIT короткой транзакцией под блокировкой
+    счётчика DataVersion, поэтому номера растут в порядке фиксации и запись
+    с номером видна не раньше всех записей с меньшими номерами.
+
+    Вызывается после фиксации каждого проведения, а также перед выгрузкой
+    журнала и построением снимка — на случай, если процесс завершился между
+    COMMIT и нумерацией. Возвращает последний выданный номер.
+    """
+    with transaction.atomic():
+        last_sequence = _lock_counter(DataVersion.MOVEMENTS)
+        pending = StockMovement.objects.filter(sequence__isnull=True)
+        bounds = pending.aggregate(first=Min("id"), last=Max("id"))
+        if bounds["first"] is None:
+            return last_sequence
+        # Номер — id со сдвигом: одна пачка нумеруется одним UPDATE, а записи, зафиксированные
+        # после чтения границ, попадают либо в диапазон этой пачки, либо в следующую
+        offset = last_sequence + 1 - bounds["first"]
+        pending.filter(id__gte=bounds["first"], id__lte=bounds["last"]).update(sequence=F("id") + offset)
+        last_sequence = bounds["last"] + offset
+        DataVersion.objects.filter(name=DataVersion.MOVEMENTS).update(value=last_sequence, changed_at=timezone.now())
+    return last_sequence
+
+
+def _lock_counter(name):
+    # Пустой UPDATE до любых чтений: на PostgreSQL блокирует строку счётчика,
+    # на SQLite сразу берёт блокировку записи, и параллельные вызовы идут по очереди
+    if not DataVersion.objects.filter(name=name).update(value=F("value")):
+        DataVersion.objects.get_or_create(name=name)
+        DataVersion.objects.filter(name=name).update(value=F("value"))
+    return DataVersion.objects.values_list("value", flat=True).get(name=name)
+
+
+def apply_stock_deltas(deltas, locked=False):
+    """Атомарно применяет изменения остатков одним запросом.
+
+    Ключи обрабатываются в отсортированном порядке, поэтому параллельные
+    документы (в том числе перемещения с двумя ключами) захватывают
+    строки Stock в одном и том же порядке и не взаимоблокируются. Если
+    ключей несколько и строки ещё не заблокированы (``locked``), они
+    сначала захватываются ``lock_stock``: upsert вставляет новые ключи
+    вперемешку с обновлением существующих, и вставленный ключ иначе
+    держался бы до захвата строк, которые идут после него.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    keys = sorted(deltas)
+    if not locked and len(keys) > 1 and connection.features.has_select_for_update:
+        lock_stock(keys)
+    updated_at = timezone.now()
+    invalidate_reports()
+    if connection.vendor in ("postgresql", "sqlite"):
+        # Пачки идут в том же порядке ключей, лимит параметров запроса не превышается
+        for start in range(0, len(keys), UPSERT_BATCH_SIZE):
+            _upsert_deltas(keys[start:start + UPSERT_BATCH_SIZE], deltas, updated_at)
+    else:
+        _locked_update_deltas(keys, deltas, updated_at)
+    _restamp_after_commit({key[0] for key in keys}, updated_at)
+
+
+def sync_settle_seconds():
+    return getattr(settings, "API_SYNC_SETTLE_SECONDS", API_SYNC_SETTLE_SECONDS)
+
+
+def _restamp_after_commit(material_ids, updated_at):
+    """Обновляет updated_at строк Stock после фиксации долгой транзакции.
+
+    updated_at — время запроса, а видна строка становится только после
+    COMMIT. Если транзакция (пачка импорта, генерации данных) шла дольше
+    окна API_SYNC_SETTLE_SECONDS, клиент потокового API мог уже сдвинуть
+    курсор (updated_at, id) за эту отметку и никогда не получил бы строки.
+    Поэтому после такой фиксации строки получают свежую отметку коротким
+    отдельным UPDATE; обычные проведения лишних запросов не делают.
+    """
+    def restamp():
+        now = timezone.now()
+        if now - updated_at < timedelta(seconds=sync_settle_seconds()) / 2:
+            return
+        stocks = Stock.objects.filter(updated_at__gte=updated_at)
+        if material_ids is None:
+            stocks.update(updated_at=now)
+            return
+        ids = sorted(material_ids)
+        for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+            stocks.filter(material_id__in=ids[start:start + UPSERT_BATCH_SIZE]).update(updated_at=now)
+
+    transaction.on_commit(restamp)
+
+
+def _upsert_deltas(keys, deltas, updated_at):
+    quote = connection.ops.quote_name
+    table = quote(Stock._meta.db_table)
+    field = Stock._meta.get_field("quantity")
+    # Порог новой строки остатков берётся тем же запросом: сначала порог
+    # материала на складе, затем общий порог материала
+    min_quantity = (
+        f"COALESCE((SELECT min_quantity FROM {quote(MaterialLocationMinimum._meta.db_table)} "
+        f"WHERE material_id = %s AND location_id = %s), "
+        f"(SELECT min_quantity FROM {quote(Material._meta.db_table)} WHERE id = %s), 0)"
+    )
+    updated_at = connection.ops.adapt_datetimefield_value(updated_at)
+    rows = []
+    params = []
+    for material_id, direction_id, location_id in keys:
+        rows.append(f"(%s, %s, %s, %s, {min_quantity}, %s)")
+        params.extend([
+            material_id,
+            direction_id,
+            location_id,
+            connection.ops.adapt_decimalfield_value(
+                deltas[(material_id, direction_id, location_id)], field.max_digits, field.decimal_places
+            ),
+            material_id,
+            location_id,
+            material_id,
+            updated_at,
+        ])
+    sql = (
+        f"INSERT INTO {table} (material_id, direction_id, location_id, quantity, min_quantity, updated_at) "
+        f"VALUES {', '.join(rows)} "
+        f"ON CONFLICT (material_id, direction_id, location_id) "
+        f"DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity, updated_at = EXCLUDED.updated_at"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _locked_update_deltas(keys, deltas, updated_at):
+    # Для СУБД без ON CONFLICT: блокируем существующие строки в фиксированном порядке
+    with transaction.atomic():
+        existing = set(
+            Stock.objects.select_for_update()
+            .filter(material_id__in={k[0] for k in keys})
+            .order_by("material_id", "direction_id", "location_id")
+            .values_list("material_id", "direction_id", "location_id")
+        )
+        for key in keys:
+            material_id, direction_id, location_id = key
+            if key in existing:
+                Stock.objects.filter(
+                    material_id=material_id, direction_id=direction_id, location_id=location_id
+                ).update(quantity=F("quantity") + deltas[key], updated_at=updated_at)
+            else:
+                Stock.objects.create(
+                    material_id=material_id, direction_id=direction_id, location_id=location_id,
+                    quantity=deltas[key], min_quantity=_min_quantity(material_id, location_id),
+                )
+
+
+def _min_quantity_expression(material, location):
+    return Coalesce(
+        Subquery(
+            MaterialLocationMinimum.objects.filter(material=material, location=location).values("min_quantity")[:1]
+        ),
+        Subquery(Material.objects.filter(pk=material).values("min_quantity")[:1]),
+    )
+
+
+def _min_quantity(material_id, location_id):
+    threshold = MaterialLocationMinimum.objects.filter(
+        material_id=material_id, location_id=location_id
+    ).values_list("min_quantity", flat=True).first()
+    if threshold is None:
+        threshold = Material.objects.filter(pk=material_id).values_list("min_quantity", flat=True).first()
+    return threshold or Decimal(0)
+
+
+def sync_stock_minimums(material_ids=None):
+    """Переносит пороги материалов в строки Stock.
+
+    Вызывается сигналами при изменении порога материала или склада; после
+    массовых правок через ``update()`` — командой ``sync_stock_minimums``.
+    Строки, созданные до появления порогов, заполняет миграция 0003.
+    """
+    stocks = Stock.objects.all()
+    if material_ids is not None:
+        stocks = stocks.filter(material_id__in=material_ids)
+    updated_at = timezone.now()
+    invalidate_reports()
+    _restamp_after_commit(material_ids, updated_at)
+    return stocks.update(
+        min_quantity=_min_quantity_expression(OuterRef("material_id"), OuterRef("location_id")),
+        updated_at=updated_at,
+    )
+
+
+def below_minimum_stocks():
+    """Строки остатков ниже порога; условие совпадает с частичным индексом."""
+    return Stock.objects.filter(quantity__lt=F("min_quantity"))
+
+
+def income_item_deltas(item, sign=1):
+    yield (item.material_id, item.direction_id, item.location_id), sign * item.quantity
+
+
+def writeoff_item_deltas(item, sign=1):
+    yield (item.material_id, item.direction_id, item.location_id), -sign * item.quantity
+
+
+def transfer_item_deltas(item, sign=1):
+    yield (item.material_id, item.from_direction_id, item.from_location_id), -sign * item.quantity
+    yield (item.material_id, item.to_direction_id, item.to_location_id), sign * item.quantity
@@ -1,3 +1,1669 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+from importlib import import_module
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from types import SimpleNamespace
 
-# Create your tests here.
+import openpyxl
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+
+from .models import (
+    Unit, Supplier, Material, Direction, Location,
+    MaterialIncome, IncomeItem, MaterialTransfer, TransferItem, MaterialWriteOff, WriteOffItem, Stock, ImportJob,
+    StockMovement, StockSnapshot, MaterialLocationMinimum, ApiToken, ApiIdempotencyKey, ExportJob, DataVersion
+)
+from . import urls, views
+from .benchmarks import ConcurrencyBenchmark, run_benchmarks
+from .datagen import DataGenerator
+from .export_jobs import claim_next_export, evict_exports, run_export_job
+from .import_jobs import claim_next_job, run_import_job
+from .exporting import movement_rows
+from .forms import IncomeItemFormSet, TransferItemFormSet, WriteOffItemFormSet
+from .importing import IncomeImporter, read_income_rows
+from .instrumentation import request_stats
+from .metrics import document_items, documents_posted, export_bytes, import_rows, reset_metrics, stock_update_seconds
+from .loadtest import PostingLoadTest
+from .posting import post_income, post_transfer, post_writeoff
+from .reconcile import fix_differences, stock_differences
+from .reference import reference_objects
+from .report_cache import REPORT_CACHE_ALIAS, data_version
+from .search import search_materials
+from .snapshots import make_snapshot, stock_as_of
+from .stock import InsufficientStock, sequence_movements
+from .turnover import turnover_statement
+
+
+def make_reference_data():
+    unit = Unit.objects.create(name="шт")
+    return {
+        "user": User.objects.create_user("operator", password="pass"),
+        "supplier": Supplier.objects.create(name="Поставщик"),
+        "material": Material.objects.create(name="Болт", article="B-1", unit=unit),
+        "direction": Direction.objects.create(name="Основное"),
+        "location": Location.objects.create(name="Склад 1"),
+        "location2": Location.objects.create(name="Склад 2"),
+    }
+
+
+class StockUpdateTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        self.income = MaterialIncome.objects.create(
+            date=date.today(), supplier=self.ref["supplier"], responsible=self.ref["user"]
+        )
+
+    def stock_quantity(self, location):
+        return Stock.objects.get(
+            material=self.ref["material"], direction=self.ref["direction"], location=location
+        ).quantity
+
+    def test_income_item_costs_three_queries(self):
+        item = IncomeItem(
+            income=self.income, material=self.ref["material"], quantity=Decimal("5"),
+            direction=self.ref["direction"], location=self.ref["location"],
+        )
+        # INSERT позиции, INSERT в журнал движений и один upsert остатка
+        with self.assertNumQueries(3):
+            item.save()
+        self.assertEqual(self.stock_quantity(self.ref["location"]), Decimal("5"))
+
+        IncomeItem.objects.create(
+            income=self.income, material=self.ref["material"], quantity=Decimal("2.5"),
+            direction=self.ref["direction"], location=self.ref["location"],
+        )
+        self.assertEqual(self.stock_quantity(self.ref["location"]), Decimal("7.5"))
+
+        item.delete()
+        self.assertEqual(self.stock_quantity(self.ref["location"]), Decimal("2.5"))
+
+    def test_transfer_moves_stock_in_one_statement(self):
+        IncomeItem.objects.create(
+            income=self.income, material=self.ref["material"], quantity=Decimal("10"),
+            direction=self.ref["direction"], location=self.ref["location"],
+        )
+        transfer = MaterialTransfer.objects.create(date=date.today(), responsible=self.ref["user"])
+        item = TransferItem(
+            transfer=transfer, material=self.ref["material"], quantity=Decimal("4"),
+            from_direction=self.ref["direction"], from_location=self.ref["location"],
+            to_direction=self.ref["direction"], to_location=self.ref["location2"],
+        )
+        with self.assertNumQueries(3):
+            item.save()
+        self.assertEqual(self.stock_quantity(self.ref["location"]), Decimal("6"))
+        self.assertEqual(self.stock_quantity(self.ref["location2"]), Decimal("4"))
+
+
+class PostingTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+
+    def stock_quantity(self, location):
+        return Stock.objects.get(
+            material=self.ref["material"], direction=self.ref["direction"], location=location
+        ).quantity
+
+    def income_items(self, count, quantity="1"):
+        return [
+            IncomeItem(
+                material=self.ref["material"], quantity=Decimal(quantity), direction=self.ref["direction"],
+                location=self.ref["location"] if i % 2 else self.ref["location2"],
+            )
+            for i in range(count)
+        ]
+
+    def test_post_income_query_count_does_not_depend_on_items(self):
+        income = MaterialIncome(date=date.today(), supplier=self.ref["supplier"], responsible=self.ref["user"])
+        # SAVEPOINT, документ, bulk INSERT позиций и журнала, один upsert остатков, RELEASE
+        with self.assertNumQueries(6):
+            post_income(income, self.income_items(60))
+        self.assertEqual(income.items.count(), 60)
+        self.assertEqual(self.stock_quantity(self.ref["location"]), Decimal("30"))
+        self.assertEqual(self.stock_quantity(self.ref["location2"]), Decimal("30"))
+
+    def test_post_transfer_and_writeoff(self):
+        post_income(
+            MaterialIncome(date=date.today(), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            self.income_items(2, quantity="10"),
+        )
+        post_transfer(MaterialTransfer(date=date.today(), responsible=self.ref["user"]), [
+            TransferItem(
+                material=self.ref["material"], quantity=Decimal("3"),
+                from_direction=self.ref["direction"], from_location=self.ref["location"],
+                to_direction=self.ref["direction"], to_location=self.ref["location2"],
+            ),
+        ])
+        writeoff = post_writeoff(MaterialWriteOff(date=date.today(), reason="Брак", responsible=self.ref["user"]), [
+            WriteOffItem(
+                material=self.ref["material"], quantity=Decimal("1"),
+                direction=self.ref["direction"], location=self.ref["location2"],
+            ),
+        ])
+        self.assertEqual(self.stock_quantity(self.ref["location"]), Decimal("7"))
+        self.assertEqual(self.stock_quantity(self.ref["location2"]), Decimal("12"))
+
+        # Удаление документа по-прежнему откатывает остатки через сигналы
+        writeoff.delete()
+        self.assertEqual(self.stock_quantity(self.ref["location2"]), Decimal("13"))
+
+
+class StockMovementTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        self.income = post_income(
+            MaterialIncome(date=date(2024, 1, 1), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal(q), direction=self.ref["direction"],
+                        location=self.ref["location"]) for q in ("3", "7")],
+        )
+        self.transfer = post_transfer(MaterialTransfer(date=date(2024, 1, 5), responsible=self.ref["user"]), [
+            TransferItem(material=self.ref["material"], quantity=Decimal("4"),
+                         from_direction=self.ref["direction"], from_location=self.ref["location"],
+                         to_direction=self.ref["direction"], to_location=self.ref["location2"]),
+        ])
+
+    def ledger(self):
+        return sorted(
+            StockMovement.objects.values_list("kind", "document_id", "location_id", "date", "quantity")
+        )
+
+    def test_ledger_has_one_signed_row_per_key_and_document(self):
+        self.assertEqual(self.ledger(), sorted([
+            ("INCOME", self.income.pk, self.ref["location"].pk, date(2024, 1, 1), Decimal("10")),
+            ("TRANSFER", self.transfer.pk, self.ref["location"].pk, date(2024, 1, 5), Decimal("-4")),
+            ("TRANSFER", self.transfer.pk, self.ref["location2"].pk, date(2024, 1, 5), Decimal("4")),
+        ]))
+
+        # Удаление дописывает обратные движения, сумма журнала равна остаткам
+        self.transfer.delete()
+        self.assertEqual(StockMovement.objects.count(), 5)
+        self.assertEqual(
+            StockMovement.objects.filter(location=self.ref["location"]).aggregate(total=Sum("quantity"))["total"],
+            Stock.objects.get(location=self.ref["location"]).quantity,
+        )
+
+    def test_backfill_rebuilds_ledger_from_documents(self):
+        expected = self.ledger()
+        StockMovement.objects.filter(kind=StockMovement.TRANSFER).delete()
+
+        call_command("backfill_stock_movements", stdout=StringIO())
+        self.assertEqual(self.ledger(), expected)
+
+        call_command("backfill_stock_movements", "--rebuild", stdout=StringIO())
+        self.assertEqual(self.ledger(), expected)
+
+    def test_admin_shows_ledger_read_only(self):
+        self.client.force_login(User.objects.create_superuser("admin", password="pass"))
+        movement = StockMovement.objects.order_by("id").first()
+        self.assertEqual(self.client.get(reverse("admin:main_stockmovement_add")).status_code, 403)
+        delete = reverse("admin:main_stockmovement_delete", args=[movement.pk])
+        self.assertEqual(self.client.post(delete, {"post": "yes"}).status_code, 403)
+        change = reverse("admin:main_stockmovement_change", args=[movement.pk])
+        self.assertEqual(self.client.get(change).status_code, 200)
+        self.assertEqual(self.client.post(change, {"quantity": "1"}).status_code, 403)
+        self.assertEqual(StockMovement.objects.get(pk=movement.pk).quantity, movement.quantity)
+
+        changelist = reverse("admin:main_stockmovement_changelist")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(changelist).status_code, 200)
+        self.transfer.delete()
+        with self.assertNumQueries(len(queries)):
+            self.assertEqual(self.client.get(changelist).status_code, 200)
+
+
+def make_workbook(rows):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["Дата", "Поставщик", "Материал", "Кол-во", "Направление", "Склад", "Номер"])
+    for row in rows:
+        ws.append(row)
+    buffer = BytesIO()
+    wb.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+class IncomeImportTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+
+    def rows(self):
+        return [
+            [date(2024, 1, 10), "Поставщик", "Болт", 5, "Основное", "Склад 1", "N-1"],
+            ["2024-01-10", "Поставщик", "Болт", 2.5, "Основное", "Склад 1", "N-1"],
+            [date(2024, 1, 11), "Новый поставщик", "Болт", 1, "Основное", "Склад 2", None],
+            [date(2024, 1, 11), "Поставщик", "Гайка", 1, "Основное", "Склад 1", None],
+            [date(2024, 1, 11), "Поставщик", "Болт", -1, "Основное", "Склад 1", None],
+            ["вчера", "Поставщик", "Болт", 1, "Основное", "Склад 1", None],
+        ]
+
+    def test_import_reports_row_errors_and_keeps_valid_rows(self):
+        importer = IncomeImporter(self.ref["user"], chunk_size=2).run(read_income_rows(make_workbook(self.rows())))
+
+        self.assertEqual([row for row, _ in importer.errors], [5, 6, 7])
+        self.assertEqual(importer.imported_rows, 3)
+        self.assertEqual(importer.created_docs, 3)
+        self.assertEqual(MaterialIncome.objects.count(), 3)
+        self.assertTrue(Supplier.objects.filter(name="Новый поставщик").exists())
+        stock = Stock.objects.get(location=self.ref["location"])
+        self.assertEqual(stock.quantity, Decimal("7.5"))
+
+    def test_import_groups_rows_into_documents(self):
+        importer = IncomeImporter(self.ref["user"], group=True, chunk_size=1)
+        importer.run(read_income_rows(make_workbook(self.rows())))
+
+        self.assertEqual(importer.created_docs, 2)
+        income = MaterialIncome.objects.get(document_number="N-1")
+        self.assertEqual(income.items.count(), 2)
+
+
+class ImportJobTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.ref = make_reference_data()
+
+    def upload(self):
+        rows = [[date(2024, 1, 10), "Поставщик", "Болт", i + 1, "Основное", "Склад 1", None] for i in range(5)]
+        rows.append([date(2024, 1, 10), "Поставщик", "Гайка", 1, "Основное", "Склад 1", None])
+        return SimpleUploadedFile("income.xlsx", make_workbook(rows).read())
+
+    def test_upload_enqueues_job_and_status_reports_progress(self):
+        self.client.force_login(self.ref["user"])
+        response = self.client.post(reverse("import_income_excel"), {"file": self.upload()})
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, reverse("import_job_detail", args=[job.pk]))
+        self.assertEqual(MaterialIncome.objects.count(), 0)
+        self.assertContains(self.client.get(response.url), "В очереди")
+
+        run_import_job(claim_next_job())
+
+        status = self.client.get(reverse("import_job_status", args=[job.pk])).json()
+        self.assertEqual(status["status"], ImportJob.STATUS_DONE)
+        self.assertEqual(status["imported_rows"], 5)
+        self.assertEqual(status["error_count"], 1)
+        self.assertEqual(status["errors"][0][0], 7)
+        self.assertIsNone(claim_next_job())
+
+        self.client.force_login(User.objects.create_user("other", password="pass"))
+        for name in ("import_job_detail", "import_job_status"):
+            self.assertEqual(self.client.get(reverse(name, args=[job.pk])).status_code, 404)
+
+    def test_stale_job_resumes_after_last_committed_row(self):
+        job = ImportJob.objects.create(
+            file=self.upload(), user=self.ref["user"], status=ImportJob.STATUS_RUNNING,
+            last_row=4, imported_rows=3, heartbeat_at=timezone.now() - timedelta(hours=1),
+        )
+        claimed = claim_next_job()
+        self.assertEqual(claimed.pk, job.pk)
+        run_import_job(claimed)
+
+        job.refresh_from_db()
+        self.assertEqual(job.imported_rows, 5)
+        self.assertEqual(job.last_row, 7)
+        # Строки 2-4 считаются уже загруженными, импортируются только 4 и 5 единиц
+        self.assertEqual(Stock.objects.get().quantity, Decimal("9"))
+
+
+class ExportJobTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.ref = make_reference_data()
+        self.receive()
+        self.client.force_login(self.ref["user"])
+
+    def receive(self):
+        post_income(
+            MaterialIncome(date=date(2024, 1, 10), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal("5"),
+                        direction=self.ref["direction"], location=self.ref["location"])],
+        )
+
+    def request_csv(self, **period):
+        response = self.client.post(reverse("export_job_create"), {"kind": ExportJob.MOVEMENT_CSV, **period})
+        return ExportJob.objects.get(pk=response.url.strip("/").split("/")[-1])
+
+    def test_job_is_rendered_to_disk_and_reused(self):
+        job = self.request_csv(start="2024-01-01", end="2024-01-31")
+        self.assertEqual(job.status, ExportJob.STATUS_PENDING)
+        self.assertEqual(job.params, {"start": "2024-01-01", "end": "2024-01-31"})
+        # Пока задание в очереди, такой же запрос к нему и присоединяется
+        self.assertEqual(self.request_csv(start="2024-01-01", end="2024-01-31", extra="x").pk, job.pk)
+
+        run_export_job(claim_next_export())
+        status = self.client.get(reverse("export_job_status", args=[job.pk])).json()
+        self.assertEqual(status["status"], ExportJob.STATUS_DONE)
+        response = self.client.get(status["download_url"])
+        lines = b"".join(response.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith("Поступление;2024-01-10;"))
+
+        self.assertEqual(self.request_csv(start="2024-01-01", end="2024-01-31").pk, job.pk)
+        self.assertNotEqual(self.request_csv().pk, job.pk)
+        self.receive()
+        self.assertNotEqual(self.request_csv(start="2024-01-01", end="2024-01-31").pk, job.pk)
+
+    def test_same_export_in_another_process_reuses_the_file(self):
+        job = self.request_csv()
+        run_export_job(claim_next_export())
+        # Другой веб-процесс: свои LocMem-кэши, общая только БД
+        cache.clear()
+        caches[REPORT_CACHE_ALIAS].clear()
+        self.assertEqual(self.request_csv().pk, job.pk)
+
+        version, _ = DataVersion.objects.get_or_create(name=DataVersion.REPORTS)
+        DataVersion.objects.filter(pk=version.pk).update(value=F("value") + 1)
+        self.assertNotEqual(self.request_csv().cache_key, job.cache_key)
+
+    def test_jobs_are_private_and_files_are_shared(self):
+        other = User.objects.create_user("other", password="pass")
+        self.request_csv()
+        job = run_export_job(claim_next_export())
+        self.client.force_login(other)
+        for name in ("export_job_detail", "export_job_status", "export_job_download"):
+            self.assertEqual(self.client.get(reverse(name, args=[job.pk])).status_code, 404)
+
+        # Тот же файл достаётся новому заданию другого пользователя без повторного построения
+        own = self.request_csv()
+        self.assertNotEqual(own.pk, job.pk)
+        self.assertEqual((own.user, own.status, own.file.name), (other, ExportJob.STATUS_DONE, job.file.name))
+        self.assertIsNone(claim_next_export())
+
+    def test_pending_jobs_of_other_users_get_the_rendered_file(self):
+        other = User.objects.create_user("other", password="pass")
+        job = self.request_csv()
+        self.client.force_login(other)
+        waiting = self.request_csv()
+        run_export_job(claim_next_export())
+        waiting.refresh_from_db()
+        self.assertEqual((waiting.status, waiting.file.name), (ExportJob.STATUS_DONE, f"exports/{job.cache_key}.csv"))
+
+    def test_download_of_evicted_file_requeues_export(self):
+        job = self.request_csv()
+        run_export_job(claim_next_export())
+        job.refresh_from_db()
+        os.remove(os.path.join(self.media_root, job.file.name))
+        response = self.client.get(reverse("export_job_download", args=[job.pk]))
+        self.assertEqual(response.status_code, 302)
+        requeued = ExportJob.objects.get(pk=response.url.strip("/").split("/")[-1])
+        self.assertNotEqual(requeued.pk, job.pk)
+        self.assertEqual(requeued.status, ExportJob.STATUS_PENDING)
+
+    def test_command_reports_progress_through_stdout(self):
+        job = self.request_csv()
+        out = StringIO()
+        call_command("run_export_jobs", "--workers", "1", "--once", stdout=out)
+        self.assertIn(f"Выгрузка #{job.pk}: готово", out.getvalue())
+        self.assertIn("Готово выгрузок: 1", out.getvalue())
+
+    def test_failed_job_keeps_message(self):
+        job = ExportJob.objects.create(kind="unknown", cache_key="x", user=self.ref["user"])
+        with self.assertRaises(KeyError):
+            run_export_job(claim_next_export())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.STATUS_FAILED)
+
+    def test_eviction_by_age_and_size(self):
+        old = self.request_csv()
+        run_export_job(claim_next_export())
+        ExportJob.objects.filter(pk=old.pk).update(last_used_at=timezone.now() - timedelta(days=30))
+        recent = self.request_csv(start="2024-01-01", end="2024-01-31")
+        run_export_job(claim_next_export())
+        old.refresh_from_db()
+        recent.refresh_from_db()
+
+        self.assertEqual(evict_exports(max_bytes=10 ** 9), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, old.file.name)))
+        self.assertTrue(ExportJob.objects.filter(pk=recent.pk).exists())
+
+        self.assertEqual(evict_exports(max_bytes=recent.size - 1), 1)
+        self.assertFalse(ExportJob.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, recent.file.name)))
+
+
+class TurnoverStatementTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        self.other = Material.objects.create(name="Гайка", article="G-1", unit=self.ref["material"].unit)
+        ref = self.ref
+        post_income(MaterialIncome(date=date(2024, 1, 10), supplier=ref["supplier"], responsible=ref["user"]), [
+            IncomeItem(material=ref["material"], quantity=Decimal("10"), direction=ref["direction"],
+                       location=ref["location"]),
+            IncomeItem(material=self.other, quantity=Decimal("4"), direction=ref["direction"],
+                       location=ref["location"]),
+        ])
+        post_income(MaterialIncome(date=date(2024, 2, 3), supplier=ref["supplier"], responsible=ref["user"]), [
+            IncomeItem(material=ref["material"], quantity=Decimal("2.5"), direction=ref["direction"],
+                       location=ref["location"]),
+        ])
+        post_transfer(MaterialTransfer(date=date(2024, 2, 5), responsible=ref["user"]), [
+            TransferItem(material=ref["material"], quantity=Decimal("3"),
+                         from_direction=ref["direction"], from_location=ref["location"],
+                         to_direction=ref["direction"], to_location=ref["location2"]),
+        ])
+        post_writeoff(MaterialWriteOff(date=date(2024, 2, 7), reason="Брак", responsible=ref["user"]), [
+            WriteOffItem(material=ref["material"], quantity=Decimal("1"), direction=ref["direction"],
+                         location=ref["location2"]),
+        ])
+        # Движение после периода в ведомость не входит
+        post_writeoff(MaterialWriteOff(date=date(2024, 3, 1), reason="Брак", responsible=ref["user"]), [
+            WriteOffItem(material=ref["material"], quantity=Decimal("1"), direction=ref["direction"],
+                         location=ref["location"]),
+        ])
+
+    def test_opening_turnover_and_closing_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = turnover_statement(date(2024, 2, 1), date(2024, 2, 29))
+        self.assertEqual(
+            [(row.material, row.location, row.opening, row.income, row.transfer_in, row.transfer_out,
+              row.writeoff, row.closing) for row in rows],
+            [
+                ("Болт", "Склад 1", Decimal("10"), Decimal("2.5"), 0, Decimal("3"), 0, Decimal("9.5")),
+                ("Болт", "Склад 2", 0, 0, Decimal("3"), 0, Decimal("1"), Decimal("2")),
+                # Без движения за период, но с остатком на начало
+                ("Гайка", "Склад 1", Decimal("4"), 0, 0, 0, 0, Decimal("4")),
+            ],
+        )
+        # Остаток на конец совпадает с остатком на дату из журнала движений
+        closing = {
+            (self.ref["material"].pk, self.ref["direction"].pk, self.ref["location"].pk): Decimal("9.5"),
+            (self.ref["material"].pk, self.ref["direction"].pk, self.ref["location2"].pk): Decimal("2"),
+            (self.other.pk, self.ref["direction"].pk, self.ref["location"].pk): Decimal("4"),
+        }
+        self.assertEqual(stock_as_of(date(2024, 2, 29)), closing)
+
+    def test_location_filter_and_empty_keys(self):
+        rows = turnover_statement(date(2024, 3, 1), date(2024, 3, 31), self.ref["location2"].pk)
+        self.assertEqual([(row.opening, row.closing) for row in rows], [(Decimal("2"), Decimal("2"))])
+        self.assertEqual(turnover_statement(date(2023, 1, 1), date(2023, 12, 31)), [])
+
+    def test_report_and_excel_export(self):
+        self.client.force_login(self.ref["user"])
+        params = {"start": "2024-02-01", "end": "2024-02-29", "location": self.ref["location"].pk}
+        response = self.client.get(reverse("report_turnover"), params)
+        self.assertContains(response, "<td>9,500</td>")
+        self.assertNotContains(response, "Склад 2</td>")
+
+        response = self.client.get(reverse("export_turnover_excel"), params)
+        ws = openpyxl.load_workbook(BytesIO(b"".join(response.streaming_content))).active
+        rows = list(ws.values)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][:6], ("Болт", "B-1", "шт", "Склад 1", "Основное", 10))
+        self.assertEqual(rows[1][-1], 9.5)
+
+    def test_bad_location_parameter_shows_all_locations(self):
+        self.client.force_login(self.ref["user"])
+        for location in ("²", "abc", "-1", str(2 ** 63)):
+            with self.subTest(location=location):
+                response = self.client.get(reverse("report_turnover"), {"location": location})
+                self.assertEqual(response.status_code, 200)
+                self.assertIsNone(response.context["location_id"])
+
+
+class MovementExportTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        for day in range(1, 4):
+            post_income(
+                MaterialIncome(date=date(2024, 1, day), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+                [IncomeItem(material=self.ref["material"], quantity=Decimal("5"),
+                            direction=self.ref["direction"], location=self.ref["location"]) for _ in range(3)],
+            )
+        post_transfer(MaterialTransfer(date=date(2024, 1, 2), responsible=self.ref["user"]), [
+            TransferItem(material=self.ref["material"], quantity=Decimal("1"),
+                         from_direction=self.ref["direction"], from_location=self.ref["location"],
+                         to_direction=self.ref["direction"], to_location=self.ref["location2"]),
+        ])
+        self.client.force_login(self.ref["user"])
+
+    def test_rows_use_one_query_per_document_type(self):
+        with self.assertNumQueries(3):
+            rows = list(movement_rows(date(2024, 1, 1), date(2024, 1, 2)))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[0][2], "Поставщик: Поставщик")
+        self.assertEqual(rows[-1][2], "Склад 1 (Склад) → Склад 2 (Склад)")
+
+    def test_xlsx_export(self):
+        response = self.client.get(reverse("export_movement_excel"), {"start": "2024-01-01", "end": "2024-01-31"})
+        self.assertEqual(response.status_code, 200)
+        wb = openpyxl.load_workbook(BytesIO(b"".join(response.streaming_content)), read_only=True)
+        self.assertEqual(len(list(wb.active.iter_rows())), 11)
+
+    def test_csv_export_streams(self):
+        response = self.client.get(reverse("export_movement_csv"))
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(len(lines), 11)
+        self.assertTrue(lines[1].startswith("Поступление;2024-01-01;"))
+
+
+class AsyncReportUrls:
+    # Маршруты как под ASGI: отчёты и выгрузки обслуживают async-версии представлений
+    urlpatterns = [
+        path(str(p.pattern), getattr(views, f"{p.name}_async"), name=p.name)
+        if hasattr(views, f"{p.name}_async") else p
+        for p in urls.urlpatterns
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncReportUrls)
+class AsyncReportViewTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        for day in range(1, 4):
+            post_income(
+                MaterialIncome(date=date(2024, 1, day), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+                [IncomeItem(material=self.ref["material"], quantity=Decimal("5"),
+                            direction=self.ref["direction"], location=self.ref["location"]) for _ in range(3)],
+            )
+        request_stats.reset()
+
+    async def content(self, response):
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    async def test_csv_export_is_streamed_asynchronously(self):
+        await self.async_client.aforce_login(self.ref["user"])
+        response = await self.async_client.get(reverse("export_movement_csv"))
+        self.assertTrue(response.is_async)
+        lines = (await self.content(response)).decode("utf-8-sig").splitlines()
+        self.assertEqual(len(lines), 10)
+        self.assertTrue(lines[1].startswith("Поступление;2024-01-01;"))
+
+    async def test_xlsx_export(self):
+        await self.async_client.aforce_login(self.ref["user"])
+        response = await self.async_client.get(reverse("export_movement_excel"))
+        content = await self.content(response)
+        self.assertEqual(int(response["Content-Length"]), len(content))
+        wb = openpyxl.load_workbook(BytesIO(content), read_only=True)
+        self.assertEqual(len(list(wb.active.iter_rows())), 10)
+
+    async def test_reports_render_and_answer_304(self):
+        await self.async_client.aforce_login(self.ref["user"])
+        for name in ("report_stock", "report_movement", "report_deficit"):
+            response = await self.async_client.get(reverse(name))
+            self.assertEqual(response.status_code, 200, name)
+            response = await self.async_client.get(reverse(name), headers={"if-none-match": response["ETag"]})
+            self.assertEqual(response.status_code, 304, name)
+        row = {row["view"]: row for row in request_stats.snapshot()["views"]}["report_movement"]
+        self.assertEqual(row["count"], 2)
+        self.assertGreater(row["max_queries"], 0)
+
+    async def test_requires_login(self):
+        response = await self.async_client.get(reverse("export_movement_csv"))
+        self.assertEqual(response.status_code, 302)
+
+
+class DeficitReportTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        self.receive(self.ref["location"], "15")
+        self.receive(self.ref["location2"], "5")
+        self.client.force_login(self.ref["user"])
+
+    def receive(self, location, quantity):
+        post_income(
+            MaterialIncome(date=date(2024, 1, 1), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal(quantity),
+                        direction=self.ref["direction"], location=location)],
+        )
+
+    def deficit(self):
+        return {
+            stock.location.name: stock.min_quantity
+            for stock in self.client.get(reverse("report_deficit")).context["deficit"]
+        }
+
+    def test_migration_fills_thresholds_of_existing_rows(self):
+        # Строки, созданные до появления порогов, получили значение поля по умолчанию
+        Stock.objects.update(min_quantity=0)
+        self.assertEqual(self.deficit(), {})
+        migration = import_module("main.migrations.0003_fill_stock_min_quantity")
+        migration.fill_stock_min_quantity(apps, SimpleNamespace(connection=connection))
+        # После migrate процессы перезапускаются с пустым кэшем отчётов
+        caches[REPORT_CACHE_ALIAS].clear()
+        self.assertEqual(self.deficit(), {"Склад 2": Decimal("10")})
+
+    def test_material_minimum_is_default_threshold(self):
+        self.assertEqual(self.deficit(), {"Склад 2": Decimal("10")})
+
+    def test_thresholds_follow_material_and_location_changes(self):
+        MaterialLocationMinimum.objects.create(
+            material=self.ref["material"], location=self.ref["location"], min_quantity=Decimal("20")
+        )
+        self.assertEqual(self.deficit(), {"Склад 1": Decimal("20"), "Склад 2": Decimal("10")})
+
+        self.ref["material"].min_quantity = Decimal("3")
+        self.ref["material"].save()
+        self.assertEqual(self.deficit(), {"Склад 1": Decimal("20")})
+
+        MaterialLocationMinimum.objects.all().delete()
+        self.assertEqual(self.deficit(), {})
+
+    def test_new_stock_row_takes_location_minimum(self):
+        other = Location.objects.create(name="Склад 3")
+        MaterialLocationMinimum.objects.create(material=self.ref["material"], location=other, min_quantity=Decimal("50"))
+        self.receive(other, "40")
+        self.assertEqual(Stock.objects.get(location=other).min_quantity, Decimal("50"))
+        self.assertIn("Склад 3", self.deficit())
+
+    def test_xlsx_export(self):
+        response = self.client.get(reverse("export_deficit_excel"))
+        wb = openpyxl.load_workbook(BytesIO(b"".join(response.streaming_content)), read_only=True)
+        rows = list(wb.active.iter_rows(values_only=True))
+        self.assertEqual(rows[1], ("Болт", "B-1", 5, 10, "шт", "Склад 2", "Основное"))
+
+
+class ReconcileStockTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        post_income(
+            MaterialIncome(date=date(2024, 1, 1), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal("10"),
+                        direction=self.ref["direction"], location=self.ref["location"])],
+        )
+        post_transfer(MaterialTransfer(date=date(2024, 1, 2), responsible=self.ref["user"]), [
+            TransferItem(material=self.ref["material"], quantity=Decimal("4"),
+                         from_direction=self.ref["direction"], from_location=self.ref["location"],
+                         to_direction=self.ref["direction"], to_location=self.ref["location2"]),
+        ])
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command("reconcile_stock", "--workers", "1", "--range-size", "1", *args, stdout=out)
+        return out.getvalue()
+
+    def test_consistent_stock_has_no_differences(self):
+        self.assertIn("Расхождений нет", self.reconcile())
+
+    def test_reports_and_fixes_drift(self):
+        other = Location.objects.create(name="Склад 3")
+        Stock.objects.filter(location=self.ref["location"]).update(quantity=Decimal("7"))
+        Stock.objects.filter(location=self.ref["location2"]).delete()
+        Stock.objects.create(material=self.ref["material"], direction=self.ref["direction"], location=other,
+                             quantity=Decimal("2"))
+
+        output = self.reconcile()
+        self.assertIn("Найдено расхождений: 3", output)
+        self.assertIn("Склад 1 (Склад) / Основное: в Stock 7.000, по документам 6", output)
+        self.assertEqual(Stock.objects.get(location=self.ref["location"]).quantity, Decimal("7"))
+
+        self.assertIn("Исправлено расхождений: 3", self.reconcile("--fix"))
+        self.assertEqual(
+            dict(Stock.objects.values_list("location__name", "quantity")),
+            {"Склад 1": Decimal("6"), "Склад 2": Decimal("4"), "Склад 3": Decimal("0")},
+        )
+        self.assertIn("Расхождений нет", self.reconcile())
+
+    def test_fix_applies_only_differences_confirmed_under_lock(self):
+        key = (self.ref["material"].pk, self.ref["direction"].pk, self.ref["location2"].pk)
+        # Stock прочитан до проведения, суммы по документам — после: расхождение мнимое
+        stale = [(key, Decimal("0"), Decimal("4"))]
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            self.assertEqual(fix_differences(0, 10 ** 9, stale), [])
+        self.assertEqual(Stock.objects.get(location=self.ref["location2"]).quantity, Decimal("4"))
+        # Блокируются строки Stock в порядке проведения, а не строка материала
+        self.assertFalse([sql for sql in statements if f'"{Material._meta.db_table}"' in sql])
+        self.assertTrue(any(sql.startswith("SELECT") and "ORDER BY" in sql and f'"{Stock._meta.db_table}"' in sql
+                            for sql in statements))
+
+
+class DataGeneratorTests(TestCase):
+    def test_generated_documents_keep_stock_consistent(self):
+        generator = DataGenerator(materials=20, locations=3, directions=2, suppliers=5, seed=1, batch_size=100)
+        generator.generate(350, items_per_document=5)
+        self.assertEqual(
+            IncomeItem.objects.count() + TransferItem.objects.count() + WriteOffItem.objects.count(), 350
+        )
+        self.assertTrue(MaterialTransfer.objects.exists())
+        self.assertTrue(MaterialWriteOff.objects.exists())
+        self.assertEqual(stock_differences(0, 10 ** 9), [])
+
+        DataGenerator(materials=25, locations=3, directions=2, suppliers=5, seed=2)
+        self.assertEqual(Material.objects.count(), 25)
+
+    def test_benchmark_report(self):
+        report = run_benchmarks(
+            [100], repeat=1, generator_options={"materials": 10, "locations": 2, "suppliers": 2, "seed": 1}
+        )
+        self.assertEqual(report["meta"]["database"], connection.vendor)
+        scenarios = {row["scenario"]: row for row in report["results"]}
+        self.assertIn("export_movement_csv", scenarios)
+        # Без кэша отчёт строится при каждом замере, из кэша — без запросов к отчётным таблицам
+        self.assertGreater(scenarios["report_stock"]["queries"], scenarios["report_stock_cached"]["queries"])
+        self.assertGreater(scenarios["post_income"]["queries"], 0)
+        self.assertFalse(MaterialIncome.objects.filter(document_number=None).exists())
+
+
+class StockAsOfTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        self.key = (self.ref["material"].pk, self.ref["direction"].pk, self.ref["location"].pk)
+        for day, quantity in [(date(2024, 1, 10), "10"), (date(2024, 2, 10), "5"), (date(2024, 3, 10), "1")]:
+            self.receive(day, quantity)
+
+    def receive(self, day, quantity):
+        return post_income(
+            MaterialIncome(date=day, supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal(quantity),
+                        direction=self.ref["direction"], location=self.ref["location"])],
+        )
+
+    def test_balance_from_snapshot_matches_full_replay(self):
+        expected = {day: stock_as_of(day) for day in (date(2024, 1, 31), date(2024, 2, 15), date(2024, 3, 31))}
+        make_snapshot(date(2024, 1, 31))
+        make_snapshot(date(2024, 2, 29))
+
+        for day, balances in expected.items():
+            self.assertEqual(stock_as_of(day), balances)
+        self.assertEqual(stock_as_of(date(2024, 2, 15)), {self.key: Decimal("15")})
+        self.assertEqual(stock_as_of(date(2023, 12, 31)), {})
+
+    def test_backdated_document_after_snapshot_is_counted(self):
+        make_snapshot(date(2024, 2, 29))
+        income = self.receive(date(2024, 1, 5), "2")
+        self.assertEqual(stock_as_of(date(2024, 2, 29)), {self.key: Decimal("17")})
+
+        income.delete()
+        self.assertEqual(stock_as_of(date(2024, 2, 29)), {self.key: Decimal("15")})
+
+    def test_movement_committed_after_snapshot_with_lower_id_is_counted(self):
+        self.receive(date(2024, 1, 5), "2")
+        self.receive(date(2024, 1, 6), "3")
+        late = StockMovement.objects.get(date=date(2024, 1, 5))
+        # Транзакция с меньшим id ещё не зафиксирована, когда строится снимок
+        late.delete()
+        make_snapshot(date(2024, 2, 29))
+        self.assertEqual(stock_as_of(date(2024, 2, 29)), {self.key: Decimal("18")})
+
+        late.sequence = None
+        late.save(force_insert=True)
+        self.assertEqual(stock_as_of(date(2024, 2, 29)), {self.key: Decimal("20")})
+        sequence_movements()
+        self.assertEqual(stock_as_of(date(2024, 2, 29)), {self.key: Decimal("20")})
+
+    def test_snapshot_command_and_report(self):
+        call_command("make_stock_snapshots", stdout=StringIO())
+        self.assertTrue(StockSnapshot.objects.filter(period_end=date(2024, 2, 29)).exists())
+
+        self.client.force_login(self.ref["user"])
+        response = self.client.get(reverse("report_stock"), {"date": "2024-02-15", "q": "Бол"})
+        self.assertEqual([row.quantity for row in response.context["stocks"]], [Decimal("15")])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        MaterialIncome.objects.bulk_create([
+            MaterialIncome(date=date(2024, 1, 1 + i % 3), supplier=self.ref["supplier"], responsible=self.ref["user"])
+            for i in range(7)
+        ])
+        self.client.force_login(self.ref["user"])
+
+    def test_pages_follow_date_id_order_without_gaps(self):
+        expected = list(MaterialIncome.objects.order_by("-date", "-id").values_list("pk", flat=True))
+        seen = []
+        url = reverse("income_list") + "?per_page=3"
+        while url:
+            response = self.client.get(url)
+            page = response.context["page"]
+            seen.extend(income.pk for income in page)
+            url = reverse("income_list") + "?" + page.next_query if page.has_next else None
+        self.assertEqual(seen, expected)
+
+    def test_deep_page_costs_the_same_as_first(self):
+        first = self.client.get(reverse("income_list"), {"per_page": 2})
+        with self.assertNumQueries(3):
+            self.client.get(reverse("income_list") + "?" + first.context["page"].next_query)
+        with self.assertNumQueries(3):
+            self.client.get(reverse("income_list"), {"per_page": 2})
+
+    def test_page_size_is_capped_and_bad_cursor_is_ignored(self):
+        response = self.client.get(reverse("supplier_list"), {"per_page": 100000, "cursor": "не курсор"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["page"].is_first)
+        response = self.client.get(reverse("income_list"), {"cursor": "WyJ4IiwgIjEiXQ=="})
+        self.assertEqual(len(response.context["page"]), 7)
+
+
+class QueryCountTests(TestCase):
+    """Число SQL-запросов страниц не должно зависеть от объёма данных (N+1)."""
+
+    sizes = (1, 5, 20)
+
+    def setUp(self):
+        self.ref = make_reference_data()
+        self.client.force_login(self.ref["user"])
+
+    def add_documents(self, count):
+        ref = self.ref
+        for _ in range(count):
+            income = post_income(
+                MaterialIncome(date=date(2024, 1, 10), supplier=ref["supplier"], responsible=ref["user"]),
+                [IncomeItem(material=ref["material"], quantity=Decimal("10"), direction=ref["direction"],
+                            location=ref["location"]) for _ in range(count)],
+            )
+            transfer = post_transfer(MaterialTransfer(date=date(2024, 1, 11), responsible=ref["user"]), [
+                TransferItem(material=ref["material"], quantity=Decimal("1"),
+                             from_direction=ref["direction"], from_location=ref["location"],
+                             to_direction=ref["direction"], to_location=ref["location2"]) for _ in range(count)
+            ])
+            writeoff = post_writeoff(
+                MaterialWriteOff(date=date(2024, 1, 12), reason="Брак", responsible=ref["user"]),
+                [WriteOffItem(material=ref["material"], quantity=Decimal("1"), direction=ref["direction"],
+                              location=ref["location"]) for _ in range(count)],
+            )
+        return income, transfer, writeoff
+
+    def assertQueriesPerSize(self, expected, make_url):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                url = make_url(*self.add_documents(size))
+                with self.assertNumQueries(expected):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_report_movement(self):
+        # сессия, пользователь, валидатор ETag и три списка документов
+        self.assertQueriesPerSize(6, lambda *docs: reverse("report_movement"))
+
+    def test_document_lists(self):
+        for name in ("income_list", "transfer_list", "writeoff_list"):
+            with self.subTest(view=name):
+                self.assertQueriesPerSize(3, lambda *docs: reverse(name))
+
+    def test_detail_views(self):
+        self.assertQueriesPerSize(4, lambda income, transfer, writeoff: reverse("income_detail", args=[income.pk]))
+        self.assertQueriesPerSize(4, lambda income, transfer, writeoff: reverse("transfer_detail", args=[transfer.pk]))
+        self.assertQueriesPerSize(4, lambda income, transfer, writeoff: reverse("writeoff_detail", args=[writeoff.pk]))
+
+    def test_stock_report(self):
+        self.assertQueriesPerSize(4, lambda *docs: reverse("report_stock"))
+
+
+class RequestStatsTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        self.client.force_login(self.ref["user"])
+        request_stats.reset()
+
+    def test_records_queries_per_view(self):
+        self.client.get(reverse("report_stock"))
+        self.client.get(reverse("report_stock"))
+        row = {row["view"]: row for row in request_stats.snapshot()["views"]}["report_stock"]
+        self.assertEqual(row["count"], 2)
+        self.assertGreaterEqual(row["max_queries"], 3)
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_logs_slow_queries_with_view_name(self):
+        with self.assertLogs("main.requests", "WARNING") as logs:
+            self.client.get(reverse("income_list"))
+        self.assertIn("в income_list:", logs.output[0])
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse("request_stats")).status_code, 302)
+        User.objects.filter(pk=self.ref["user"].pk).update(is_staff=True)
+        self.client.get(reverse("home"))
+        response = self.client.get(reverse("request_stats"))
+        self.assertIn("home", [row["view"] for row in response.json()["views"]])
+
+
+class ReportCacheTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        self.client.force_login(self.ref["user"])
+        self.receive("5")
+
+    def receive(self, quantity):
+        post_income(
+            MaterialIncome(date=date(2024, 1, 1), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal(quantity),
+                        direction=self.ref["direction"], location=self.ref["location"])],
+        )
+
+    def test_repeated_report_is_served_from_cache(self):
+        for name in ("report_stock", "report_movement", "report_deficit"):
+            self.client.get(reverse(name))
+            # Остаются запросы сессии, пользователя и валидатора ETag
+            with self.assertNumQueries(3):
+                self.client.get(reverse(name))
+
+    def test_rename_in_another_process_invalidates_cached_body(self):
+        self.assertContains(self.client.get(reverse("report_deficit")), "Болт")
+        # Другой процесс переименовал материал: сигналы этого процесса не сработали,
+        # после его COMMIT выросла только версия отчётов в БД
+        Material.objects.filter(pk=self.ref["material"].pk).update(name="Шпилька М8")
+        version, _ = DataVersion.objects.get_or_create(name=DataVersion.REPORTS)
+        DataVersion.objects.filter(pk=version.pk).update(value=F("value") + 1)
+        self.assertContains(self.client.get(reverse("report_deficit")), "Шпилька М8")
+
+    def test_parameters_are_part_of_the_key(self):
+        self.client.get(reverse("report_stock"))
+        response = self.client.get(reverse("report_stock"), {"q": "Гайка"})
+        self.assertEqual(len(response.context["stocks"]), 0)
+
+    def test_changes_invalidate_reports(self):
+        self.assertEqual(self.client.get(reverse("report_stock")).context["stocks"].items[0].quantity, Decimal("5"))
+        self.receive("2")
+        self.assertEqual(self.client.get(reverse("report_stock")).context["stocks"].items[0].quantity, Decimal("7"))
+
+        self.ref["material"].name = "Болт М8"
+        self.ref["material"].save()
+        self.assertContains(self.client.get(reverse("report_deficit")), "Болт М8")
+
+
+class ReportVersionCommitTests(TransactionTestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+
+    def version(self):
+        return DataVersion.objects.filter(name=DataVersion.REPORTS).values_list("value", flat=True).first() or 0
+
+    def receive(self, quantity):
+        post_income(
+            MaterialIncome(date=date(2024, 1, 1), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal(quantity),
+                        direction=self.ref["direction"], location=self.ref["location"])],
+        )
+
+    def test_version_is_bumped_once_after_commit(self):
+        before = self.version()
+        with transaction.atomic():
+            self.receive("1")
+            self.receive("2")
+            self.assertEqual(self.version(), before)
+            pending = data_version()
+        self.assertEqual(self.version(), before + 1)
+        self.assertNotEqual(data_version(), pending)
+
+    def test_rolled_back_changes_keep_version(self):
+        before = self.version()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.receive("1")
+                raise RuntimeError("откат")
+        self.assertEqual(self.version(), before)
+
+
+class ConditionalReportTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        self.client.force_login(self.ref["user"])
+        post_income(
+            MaterialIncome(date=date(2024, 1, 1), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal("5"),
+                        direction=self.ref["direction"], location=self.ref["location"])],
+        )
+
+    def test_unchanged_export_answers_not_modified(self):
+        for name in ("export_movement_excel", "export_movement_csv", "export_deficit_excel", "report_stock"):
+            with self.subTest(view=name):
+                response = self.client.get(reverse(name))
+                self.assertEqual(response["Cache-Control"], "private, no-cache")
+                self.assertTrue(response.has_header("Last-Modified"))
+                with self.assertNumQueries(3):
+                    cached = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=response["ETag"])
+                self.assertEqual(cached.status_code, 304)
+
+    def test_validators_are_the_same_in_every_process(self):
+        etag = self.client.get(reverse("report_stock"))["ETag"]
+        # Другой процесс: свои LocMem-кэши, общая только БД
+        cache.clear()
+        caches[REPORT_CACHE_ALIAS].clear()
+        self.assertEqual(self.client.get(reverse("report_stock"), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_validator_changes_with_data_and_parameters(self):
+        etag = self.client.get(reverse("export_movement_csv"))["ETag"]
+        response = self.client.get(reverse("export_movement_csv"), {"start": "2024-01-01", "end": "2024-01-31"},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        post_income(
+            MaterialIncome(date=date(2024, 1, 2), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal("1"),
+                        direction=self.ref["direction"], location=self.ref["location"])],
+        )
+        response = self.client.get(reverse("export_movement_csv"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        reset_metrics()
+
+    def test_posting_and_export_counters(self):
+        post_income(
+            MaterialIncome(date=date(2024, 1, 1), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal("1"),
+                        direction=self.ref["direction"], location=self.ref["location"]) for _ in range(3)],
+        )
+        self.assertEqual(documents_posted.value(kind=StockMovement.INCOME), 1)
+        self.assertEqual(document_items.count(kind=StockMovement.INCOME), 1)
+        self.assertEqual(stock_update_seconds.count(), 1)
+
+        self.client.force_login(self.ref["user"])
+        content = b"".join(self.client.get(reverse("export_movement_csv")).streaming_content)
+        self.assertEqual(export_bytes.value(format="csv"), len(content))
+
+    def test_import_rows_by_result(self):
+        rows = [
+            (date(2024, 1, 1), "Поставщик", "Болт", 5, "Основное", "Склад 1"),
+            (date(2024, 1, 1), "Поставщик", "Гайка", 5, "Основное", "Склад 1"),
+        ]
+        IncomeImporter(self.ref["user"]).run(read_income_rows(make_workbook(rows)))
+        self.assertEqual(import_rows.value(result="imported"), 1)
+        self.assertEqual(import_rows.value(result="error"), 1)
+
+    @override_settings(METRICS_TOKEN="scrape-secret")
+    def test_prometheus_endpoint(self):
+        documents_posted.inc(kind="INCOME")
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer scrape-secret")
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        text = response.content.decode()
+        self.assertIn('materialflow_documents_posted_total{kind="INCOME"} 1', text)
+        self.assertIn("# TYPE materialflow_stock_update_seconds histogram", text)
+
+        # Запросы через локальный обратный прокси приходят с 127.0.0.1: адрес доступа не даёт
+        self.assertEqual(self.client.get(reverse("metrics"), REMOTE_ADDR="127.0.0.1").status_code, 403)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, 403)
+        self.client.force_login(self.ref["user"])
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        User.objects.filter(pk=self.ref["user"].pk).update(is_staff=True)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_prometheus_endpoint_without_token_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer ").status_code, 403)
+
+
+class DocumentApiTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        self.token = ApiToken.objects.create(user=self.ref["user"], name="ERP")
+
+    def post(self, documents, token=None):
+        return self.client.post(
+            reverse("api_documents"), {"documents": documents}, content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {token or self.token.key}",
+        )
+
+    def item(self, quantity, location="location"):
+        return {"material": self.ref["material"].pk, "direction": self.ref["direction"].pk,
+                "location": self.ref[location].pk, "quantity": quantity}
+
+    def income(self, key, quantity="10"):
+        return {"type": "income", "idempotency_key": key, "date": "2024-01-10",
+                "supplier": self.ref["supplier"].pk, "items": [self.item(quantity)]}
+
+    def writeoff(self, key, quantity):
+        return {"type": "writeoff", "idempotency_key": key, "date": "2024-01-11", "reason": "Брак",
+                "items": [self.item(quantity)]}
+
+    def stock_quantity(self):
+        return Stock.objects.get(location=self.ref["location"]).quantity
+
+    def test_batch_is_posted_and_retry_is_idempotent(self):
+        documents = [
+            self.income("in-1"),
+            {"type": "transfer", "idempotency_key": "tr-1", "date": "2024-01-11", "items": [{
+                "material": self.ref["material"].pk, "quantity": "4",
+                "from_direction": self.ref["direction"].pk, "from_location": self.ref["location"].pk,
+                "to_direction": self.ref["direction"].pk, "to_location": self.ref["location2"].pk,
+            }]},
+            self.writeoff("wo-1", "1"),
+        ]
+        response = self.post(documents)
+        self.assertEqual(response.status_code, 201)
+        results = response.json()["results"]
+        self.assertEqual([r["status"] for r in results], ["created"] * 3)
+        self.assertEqual(self.stock_quantity(), Decimal("5"))
+        self.assertEqual(MaterialWriteOff.objects.get().pk, results[2]["id"])
+
+        # Повтор после обрыва связи не проводит документы второй раз
+        response = self.post(documents)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], [dict(r, status="duplicate") for r in results])
+        self.assertEqual(self.stock_quantity(), Decimal("5"))
+        self.assertEqual(StockMovement.objects.count(), 4)
+
+    def test_invalid_document_rejects_whole_batch(self):
+        response = self.post([
+            self.income("in-1"),
+            {"type": "income", "idempotency_key": "in-2", "date": "2024-13-01", "supplier": 0,
+             "items": [dict(self.item("-1"), material=0)]},
+            self.income("in-1"),
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()["errors"]
+        self.assertEqual([e["index"] for e in errors], [1, 2])
+        self.assertEqual(len(errors[0]["errors"]), 3)
+        self.assertFalse(MaterialIncome.objects.exists())
+
+    def test_malformed_fields_are_rejected_with_400(self):
+        cases = [
+            dict(self.income("in-1"), items=5),
+            dict(self.income("in-1"), supplier=[1]),
+            dict(self.income("in-1"), idempotency_key=["k"]),
+            dict(self.income("in-1"), document_number=7),
+            dict(self.income("in-1"), type=["income"]),
+            dict(self.writeoff("wo-1", "1"), reason=["Брак"]),
+            dict(self.income("in-1"), items=[dict(self.item("1"), quantity=[1])]),
+            dict(self.income("in-1"), items=[dict(self.item("1"), quantity=True)]),
+        ]
+        for document in cases:
+            with self.subTest(document=document):
+                response = self.post([document])
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual([e["index"] for e in response.json()["errors"]], [0])
+        self.assertFalse(MaterialIncome.objects.exists())
+
+    def test_form_rules_are_enforced(self):
+        tomorrow = (timezone.now().date() + timedelta(days=1)).isoformat()
+        same_location = {
+            "type": "transfer", "idempotency_key": "tr-1", "date": "2024-01-11", "items": [{
+                "material": self.ref["material"].pk, "quantity": "1",
+                "from_direction": self.ref["direction"].pk, "from_location": self.ref["location"].pk,
+                "to_direction": self.ref["direction"].pk, "to_location": self.ref["location"].pk,
+            }],
+        }
+        cases = [
+            dict(self.income("in-1"), date=tomorrow),
+            same_location,
+            dict(self.income("in-1"), items=[dict(self.item("1"), material=True)]),
+            dict(self.income("in-1"), document_number="N" * 101),
+            dict(self.writeoff("wo-1", "1"), reason="П" * 256),
+        ]
+        for document in cases:
+            with self.subTest(document=document):
+                self.assertEqual(self.post([document]).status_code, 400)
+        self.assertFalse(MaterialIncome.objects.exists())
+        self.assertFalse(MaterialTransfer.objects.exists())
+
+    def test_shortage_is_checked_against_earlier_documents_in_batch(self):
+        response = self.post([self.income("in-1", "5"), self.writeoff("wo-1", "3"), self.writeoff("wo-2", "3")])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([e["index"] for e in response.json()["errors"]], [2])
+        self.assertFalse(MaterialIncome.objects.exists())
+        self.assertFalse(ApiIdempotencyKey.objects.exists())
+
+        response = self.post([self.income("in-1", "5"), self.writeoff("wo-1", "3")])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock_quantity(), Decimal("2"))
+
+    def test_requires_token(self):
+        self.client.force_login(self.ref["user"])
+        response = self.client.post(reverse("api_documents"), {"documents": [self.income("in-1")]},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.post([self.income("in-1")], token="wrong").status_code, 401)
+
+    def test_key_posted_by_parallel_request_is_a_conflict(self):
+        inserted = []
+
+        def parallel_request(execute, sql, params, many, context):
+            # Другой запрос успевает записать тот же ключ между проверкой и вставкой
+            if not inserted and sql.startswith("INSERT") and f'"{ApiIdempotencyKey._meta.db_table}"' in sql:
+                inserted.append(True)
+                ApiIdempotencyKey.objects.create(
+                    user=self.ref["user"], key="in-1", kind=StockMovement.INCOME, document_id=1
+                )
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(parallel_request):
+            response = self.post([self.income("in-1")])
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(MaterialIncome.objects.exists())
+
+
+class DocumentApiCommitTests(TransactionTestCase):
+    def test_stale_reference_is_a_bad_request_not_a_conflict(self):
+        ref = make_reference_data()
+        token = ApiToken.objects.create(user=ref["user"])
+        gone = Location.objects.create(name="Снесённый склад")
+        reference_objects("location")
+        # Склад удалён в другом процессе: копия справочника в этом процессе ещё содержит его
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{Location._meta.db_table}" WHERE id = %s', [gone.pk])
+        document = {"type": "income", "idempotency_key": "in-1", "date": "2024-01-10", "supplier": ref["supplier"].pk,
+                    "items": [{"material": ref["material"].pk, "direction": ref["direction"].pk,
+                               "location": gone.pk, "quantity": "1"}]}
+
+        response = self.client.post(reverse("api_documents"), {"documents": [document]},
+                                    content_type="application/json", HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MaterialIncome.objects.exists())
+        self.assertNotIn(gone.pk, reference_objects("location"))
+
+
+@override_settings(API_SYNC_SETTLE_SECONDS=0)
+class StreamApiTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        self.token = ApiToken.objects.create(user=self.ref["user"])
+
+    def income(self, location, quantity="5"):
+        post_income(
+            MaterialIncome(date=date(2024, 1, 1), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal(quantity),
+                        direction=self.ref["direction"], location=self.ref[location])],
+        )
+
+    def rows(self, name, **params):
+        response = self.client.get(reverse(name), params, HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        return [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+
+    def test_stock_incremental_sync(self):
+        self.income("location")
+        self.income("location2")
+        rows = self.rows("api_stock_stream")
+        self.assertEqual([row["location_id"] for row in rows], [self.ref["location"].pk, self.ref["location2"].pk])
+        self.assertEqual(rows[0]["quantity"], "5.000")
+
+        cursor = {"updated_since": rows[-1]["updated_at"], "after_id": rows[-1]["id"]}
+        self.assertEqual(self.rows("api_stock_stream", **cursor), [])
+        self.income("location", "2")
+        changed = self.rows("api_stock_stream", **cursor)
+        self.assertEqual([(row["id"], row["quantity"]) for row in changed], [(rows[0]["id"], "7.000")])
+
+    def test_rows_of_long_transaction_are_restamped_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.income("location")
+            stock = Stock.objects.get()
+            # Пока транзакция шла, клиент уже сдвинул курсор за отметку строки
+            cursor = {"updated_since": stock.updated_at.isoformat(), "after_id": stock.pk}
+        stock.refresh_from_db()
+        self.assertEqual([row["id"] for row in self.rows("api_stock_stream", **cursor)], [stock.pk])
+
+        with override_settings(API_SYNC_SETTLE_SECONDS=60), self.captureOnCommitCallbacks(execute=True):
+            self.income("location", "2")
+            stamped = Stock.objects.get().updated_at
+        self.assertEqual(Stock.objects.get().updated_at, stamped)
+
+    def test_movements_after_sequence(self):
+        self.income("location")
+        first = self.rows("api_movement_stream")
+        self.assertEqual([row["kind"] for row in first], [StockMovement.INCOME])
+        MaterialIncome.objects.get().delete()
+        rows = self.rows("api_movement_stream", after_sequence=first[-1]["sequence"])
+        self.assertEqual([row["quantity"] for row in rows], ["-5.000"])
+        self.assertEqual(len(self.rows("api_movement_stream", limit=1)), 1)
+
+    def test_late_committed_low_id_is_streamed_after_cursor(self):
+        self.income("location")
+        self.income("location2")
+        late, early = StockMovement.objects.order_by("id")
+        # Запись с меньшим id ещё не зафиксирована: читатель её не видит
+        late.delete()
+        rows = self.rows("api_movement_stream")
+        self.assertEqual([row["id"] for row in rows], [early.pk])
+
+        late.sequence = None
+        late.save(force_insert=True)
+        rows = self.rows("api_movement_stream", after_sequence=rows[-1]["sequence"])
+        self.assertEqual([row["id"] for row in rows], [late.pk])
+        self.assertGreater(rows[0]["sequence"], StockMovement.objects.get(pk=early.pk).sequence)
+
+    def test_movements_are_numbered_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.income("location")
+            self.assertIsNone(StockMovement.objects.get().sequence)
+        self.assertIsNotNone(StockMovement.objects.get().sequence)
+        self.assertEqual(sequence_movements(), StockMovement.objects.get().sequence)
+
+    def test_access_and_cursor_validation(self):
+        self.assertEqual(self.client.get(reverse("api_stock_stream")).status_code, 401)
+        self.client.force_login(self.ref["user"])
+        self.assertEqual(self.client.get(reverse("api_stock_stream")).status_code, 200)
+        self.assertEqual(self.client.get(reverse("api_stock_stream"), {"updated_since": "вчера"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("api_stock_stream"), {"after_id": "3"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("api_movement_stream"), {"after_sequence": "-1"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("api_movement_stream"), {"after_id": "3"}).status_code, 400)
+
+
+class MaterialSearchTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        unit = Unit.objects.get()
+        Material.objects.create(name="Болт оцинкованный М8", article="BLT-008", unit=unit)
+        Material.objects.create(name="Гайка М8", article="NUT-008", unit=unit)
+        Material.objects.create(name="Шайба", article="WSH-010", unit=unit)
+
+    def names(self, query):
+        return list(search_materials(Material.objects.all(), query).order_by("-rank", "id").values_list("name", flat=True))
+
+    def test_matches_name_and_article_ranked_by_similarity(self):
+        self.assertEqual(self.names("Болт"), ["Болт", "Болт оцинкованный М8"])
+        self.assertEqual(self.names("nut-008")[0], "Гайка М8")
+        self.assertEqual(set(self.names("008")), {"Болт оцинкованный М8", "Гайка М8"})
+        self.assertIn("Болт", self.names("Болд"))
+        self.assertEqual(self.names("Шуруп"), [])
+
+    def test_pages_keep_rows_with_tied_rank(self):
+        unit = Unit.objects.get()
+        Material.objects.bulk_create([Material(name=f"Винт {n}", article=f"V-{n}", unit=unit) for n in range(5)])
+        expected = list(
+            search_materials(Material.objects.all(), "Винт").order_by("-rank", "id").values_list("pk", flat=True)
+        )
+        self.assertEqual(len(expected), 5)
+        self.client.force_login(self.ref["user"])
+        seen = []
+        query = "q=Винт&per_page=2"
+        while query:
+            page = self.client.get(reverse("material_list") + "?" + query).context["page"]
+            seen.extend(material.pk for material in page)
+            query = page.next_query if page.has_next else None
+        self.assertEqual(seen, expected)
+
+    def test_index_is_refreshed_on_material_changes(self):
+        self.assertEqual(self.names("Саморез"), [])
+        Material.objects.create(name="Саморез", article="SCR-1", unit=Unit.objects.get())
+        self.assertEqual(self.names("Саморез"), ["Саморез"])
+
+    def test_material_list_and_stock_report_use_search(self):
+        self.client.force_login(self.ref["user"])
+        response = self.client.get(reverse("material_list"), {"q": "blt-008"})
+        self.assertEqual([m.name for m in response.context["materials"]][0], "Болт оцинкованный М8")
+        response = self.client.get(reverse("report_stock"), {"q": "B-1"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_schema_and_search_indexes_come_from_migrations(self):
+        # Тестовая БД создаётся миграциями; модели не должны расходиться с ними
+        call_command("makemigrations", "main", "--check", "--dry-run", stdout=StringIO())
+
+
+class ReferenceChoicesTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+
+    def formset_data(self, rows, prefix="items"):
+        data = {f"{prefix}-TOTAL_FORMS": str(rows), f"{prefix}-INITIAL_FORMS": "0"}
+        for i in range(rows):
+            data.update({
+                f"{prefix}-{i}-material": str(self.ref["material"].pk),
+                f"{prefix}-{i}-quantity": "1",
+                f"{prefix}-{i}-direction": str(self.ref["direction"].pk),
+                f"{prefix}-{i}-location": str(self.ref["location"].pk),
+            })
+        return data
+
+    def test_large_formset_renders_and_validates_without_per_row_queries(self):
+        IncomeItemFormSet(prefix="items").as_p()  # прогрев справочников
+        with self.assertNumQueries(0):
+            html = IncomeItemFormSet(prefix="items", data=self.formset_data(50)).as_p()
+        self.assertIn("Болт (B-1)", html)
+
+        formset = IncomeItemFormSet(prefix="items", data=self.formset_data(50))
+        with self.assertNumQueries(0):
+            self.assertTrue(formset.is_valid())
+        self.assertEqual(formset.forms[0].cleaned_data["material"], self.ref["material"])
+
+    def test_choices_follow_reference_changes(self):
+        IncomeItemFormSet(prefix="items").as_p()
+        material = Material.objects.create(name="Гайка", article="N-1", unit=Unit.objects.get())
+        self.assertIn("Гайка (N-1)", IncomeItemFormSet(prefix="items").as_p())
+
+        data = self.formset_data(1)
+        data["items-0-material"] = str(material.pk)
+        material.delete()
+        formset = IncomeItemFormSet(prefix="items", data=data)
+        self.assertFalse(formset.is_valid())
+        self.assertIn("material", formset.forms[0].errors)
+
+    def test_copy_reloaded_before_commit_is_dropped_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            material = Material.objects.create(name="Гайка", article="N-1", unit=Unit.objects.get())
+            # Параллельный запрос перечитал справочник до COMMIT и не увидел материал
+            reference_objects("material").pop(material.pk)
+        self.assertIn(material.pk, reference_objects("material"))
+
+
+class StockAvailabilityTests(TestCase):
+    def setUp(self):
+        self.ref = make_reference_data()
+        post_income(
+            MaterialIncome(date=date(2024, 1, 1), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal("10"),
+                        direction=self.ref["direction"], location=self.ref["location"])],
+        )
+        WriteOffItemFormSet(prefix="items").as_p()  # прогрев справочников
+
+    def writeoff_data(self, quantities):
+        data = {"items-TOTAL_FORMS": str(len(quantities)), "items-INITIAL_FORMS": "0"}
+        for i, quantity in enumerate(quantities):
+            data.update({
+                f"items-{i}-material": str(self.ref["material"].pk),
+                f"items-{i}-quantity": quantity,
+                f"items-{i}-direction": str(self.ref["direction"].pk),
+                f"items-{i}-location": str(self.ref["location"].pk),
+            })
+        return data
+
+    def test_writeoff_rows_on_same_key_are_summed_in_one_query(self):
+        formset = WriteOffItemFormSet(prefix="items", data=self.writeoff_data(["0.25"] * 40))
+        with self.assertNumQueries(1):
+            self.assertTrue(formset.is_valid())
+
+        formset = WriteOffItemFormSet(prefix="items", data=self.writeoff_data(["6", "5"]))
+        with self.assertNumQueries(1):
+            self.assertFalse(formset.is_valid())
+        self.assertIn("доступно 10.000, требуется 11", formset.non_form_errors()[0])
+
+    def test_transfer_checks_source_balance(self):
+        data = {
+            "items-TOTAL_FORMS": "1", "items-INITIAL_FORMS": "0",
+            "items-0-material": str(self.ref["material"].pk), "items-0-quantity": "12",
+            "items-0-from_direction": str(self.ref["direction"].pk),
+            "items-0-from_location": str(self.ref["location"].pk),
+            "items-0-to_direction": str(self.ref["direction"].pk),
+            "items-0-to_location": str(self.ref["location2"].pk),
+        }
+        self.assertFalse(TransferItemFormSet(prefix="items", data=data).is_valid())
+        data["items-0-quantity"] = "10"
+        self.assertTrue(TransferItemFormSet(prefix="items", data=data).is_valid())
+
+    def test_posting_locks_all_document_keys_in_sorted_order_before_writing(self):
+        post_income(
+            MaterialIncome(date=date(2024, 1, 1), supplier=self.ref["supplier"], responsible=self.ref["user"]),
+            [IncomeItem(material=self.ref["material"], quantity=Decimal("5"),
+                        direction=self.ref["direction"], location=self.ref["location2"])],
+        )
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        # Расход со Склада 2, приход на Склад 1: приходуемый ключ сортируется раньше списываемого
+        with connection.execute_wrapper(record):
+            post_transfer(MaterialTransfer(date=date(2024, 1, 2), responsible=self.ref["user"]), [
+                TransferItem(material=self.ref["material"], quantity=Decimal("3"),
+                             from_direction=self.ref["direction"], from_location=self.ref["location2"],
+                             to_direction=self.ref["direction"], to_location=self.ref["location"]),
+            ])
+        stock_statements = [sql for sql, params in statements if f'"{Stock._meta.db_table}"' in sql]
+        lock_sql = stock_statements[0]
+        self.assertTrue(lock_sql.startswith("SELECT"), lock_sql)
+        self.assertIn("ORDER BY", lock_sql)
+        lock_params = list(next(params for sql, params in statements if sql == lock_sql))
+        direction, material = self.ref["direction"].pk, self.ref["material"].pk
+        self.assertEqual(
+            [tuple(lock_params[i:i + 3]) for i in range(0, len(lock_params), 3)],
+            [(direction, self.ref["location"].pk, material), (direction, self.ref["location2"].pk, material)],
+        )
+        first_write = next(i for i, (sql, params) in enumerate(statements) if not sql.startswith(("SELECT", "SAVEPOINT")))
+        self.assertLess(statements.index(next(item for item in statements if item[0] == lock_sql)), first_write)
+
+    def test_posting_rechecks_stock_and_writes_nothing_on_shortage(self):
+        items = [WriteOffItem(material=self.ref["material"], quantity=Decimal("11"),
+                              direction=self.ref["direction"], location=self.ref["location"])]
+        with self.assertRaises(InsufficientStock):
+            post_writeoff(MaterialWriteOff(date=date(2024, 1, 2), reason="Брак", responsible=self.ref["user"]), items)
+        self.assertFalse(MaterialWriteOff.objects.exists())
+        self.assertEqual(Stock.objects.get(location=self.ref["location"]).quantity, Decimal("10"))
+
+
+class ConcurrentWriteOffTests(TransactionTestCase):
+    writers = 6
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_concurrent_writeoffs_never_push_stock_negative(self):
+        ref = make_reference_data()
+        post_income(
+            MaterialIncome(date=date(2024, 1, 1), supplier=ref["supplier"], responsible=ref["user"]),
+            [IncomeItem(material=ref["material"], quantity=Decimal("3"),
+                        direction=ref["direction"], location=ref["location"])],
+        )
+        results = []
+
+        def writer():
+            try:
+                post_writeoff(MaterialWriteOff(date=date(2024, 1, 2), reason="Брак", responsible=ref["user"]), [
+                    WriteOffItem(material=ref["material"], quantity=Decimal("1"),
+                                 direction=ref["direction"], location=ref["location"]),
+                ])
+                results.append(True)
+            except InsufficientStock:
+                results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 3)
+        self.assertEqual(Stock.objects.get(location=ref["location"]).quantity, Decimal("0"))
+
+
+class ConcurrentTransferTests(TransactionTestCase):
+    writers = 6
+    transfers_per_writer = 5
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_opposite_transfers_do_not_deadlock(self):
+        ref = make_reference_data()
+        post_income(
+            MaterialIncome(date=date(2024, 1, 1), supplier=ref["supplier"], responsible=ref["user"]),
+            [IncomeItem(material=ref["material"], quantity=Decimal("100"), direction=ref["direction"],
+                        location=location) for location in (ref["location"], ref["location2"])],
+        )
+        errors = []
+
+        def writer(number):
+            source, target = (ref["location"], ref["location2"]) if number % 2 else (ref["location2"], ref["location"])
+            try:
+                for _ in range(self.transfers_per_writer):
+                    post_transfer(MaterialTransfer(date=date(2024, 1, 2), responsible=ref["user"]), [
+                        TransferItem(material=ref["material"], quantity=Decimal("1"),
+                                     from_direction=ref["direction"], from_location=source,
+                                     to_direction=ref["direction"], to_location=target),
+                    ])
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer, args=(number,)) for number in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Stock.objects.aggregate(total=Sum("quantity"))["total"], Decimal("200"))
+
+
+class ConcurrentStockUpdateTests(TransactionTestCase):
+    writers = 8
+    items_per_writer = 10
+
+    def test_no_lost_updates(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("Для конкурентной записи нужна файловая или серверная БД")
+        ref = make_reference_data()
+        errors = []
+
+        def writer():
+            try:
+                income = MaterialIncome.objects.create(
+                    date=date.today(), supplier=ref["supplier"], responsible=ref["user"]
+                )
+                for _ in range(self.items_per_writer):
+                    IncomeItem.objects.create(
+                        income=income, material=ref["material"], quantity=Decimal("1"),
+                        direction=ref["direction"], location=ref["location"],
+                    )
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        stock = Stock.objects.get(material=ref["material"], direction=ref["direction"], location=ref["location"])
+        self.assertEqual(stock.quantity, Decimal(self.writers * self.items_per_writer))
+
+
+class PostingLoadTestTests(TransactionTestCase):
+    def test_invariants_hold_under_contention(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("Для конкурентной записи нужна файловая или серверная БД")
+        report = PostingLoadTest(workers=4, operations=10, hot_materials=2, locations=2, seed=1).run()
+
+        self.assertEqual(report["errors"], [])
+        committed = sum(count for name, count in report["counters"].items() if name.endswith("_committed"))
+        self.assertGreater(committed, 0)
+        self.assertIsNotNone(report["latency_ms"]["p95"])
+        for name in ("no_lost_updates", "stock_matches_documents", "stock_matches_ledger", "no_negative_stock",
+                     "no_deadlocks"):
+            self.assertTrue(report["invariants"][name], report["invariants"]["details"])
+
+
+class ConcurrencyBenchmarkTests(TransactionTestCase):
+    def test_wsgi_and_asgi_serve_same_export(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("Потокам нужна файловая или серверная БД")
+        generator = DataGenerator(materials=5, locations=2, directions=1, suppliers=1, seed=1)
+        generator.generate(50)
+
+        report = ConcurrencyBenchmark(generator.user, "export_movement_csv", clients=4, workers=2,
+                                      bandwidth=10 ** 9).run()
+        self.assertEqual(report["wsgi"]["bytes"], report["asgi"]["bytes"])
+        self.assertGreater(report["wsgi"]["bytes"], 0)
+        self.assertLessEqual(report["wsgi"]["peak_in_flight"], 2)
+        self.assertEqual(report["asgi"]["requests"], 4)
@@ -1,8 +1,14 @@
+from django.conf import settings
 from django.urls import path
 
 from main import views
 
 
+def _report_view(name):
+    # Под ASGI отчёты и выгрузки обслуживают async-версии представлений (см. asgi.py)
+    return getattr(views, f"{name}_async" if getattr(settings, "ASYNC_REPORT_VIEWS", False) else name)
+
+
 urlpatterns = [
     path('', views.home, name='home'),
     # path("register/", views.register, name="register"),
@@ -29,6 +35,8 @@ urlpatterns = [
     path("incomes/<int:pk>/", views.income_detail, name="income_detail"),
     path("incomes/<int:pk>/delete/", views.income_delete, name="income_delete"),
     path('incomes/import/', views.import_income_excel, name='import_income_excel'),
+    path("incomes/import/<int:pk>/", views.import_job_detail, name="import_job_detail"),
+    path("incomes/import/<int:pk>/status/", views.import_job_status, name="import_job_status"),
     path("transfers/", views.transfer_list, name="transfer_list"),
     path("transfers/add/", views.transfer_create, name="transfer_add"),
     path("transfers/<int:pk>/", views.transfer_detail, name="transfer_detail"),
@@ -37,9 +45,21 @@ urlpatterns = [
     path("writeoffs/add/", views.writeoff_create, name="writeoff_add"),
     path("writeoffs/<int:pk>/", views.writeoff_detail, name="writeoff_detail"),
     path("writeoffs/<int:pk>/delete/", views.writeoff_delete, name="writeoff_delete"),
-    path("reports/stock/", views.report_stock, name="report_stock"),
-    path("reports/movement/", views.report_movement, name="report_movement"),
-    path("reports/deficit/", views.report_deficit, name="report_deficit"),
-    path("reports/movement/export/", views.export_movement_excel, name="export_movement_excel"),
-    path("reports/deficit/export/", views.export_deficit_excel, name="export_deficit_excel"),
+    path("reports/stock/", _report_view("report_stock"), name="report_stock"),
+    path("reports/movement/", _report_view("report_movement"), name="report_movement"),
+    path("reports/deficit/", _report_view("report_deficit"), name="report_deficit"),
+    path("reports/turnover/", _report_view("report_turnover"), name="report_turnover"),
+    path("reports/movement/export/", _report_view("export_movement_excel"), name="export_movement_excel"),
+    path("reports/movement/export/csv/", _report_view("export_movement_csv"), name="export_movement_csv"),
+    path("reports/deficit/export/", _report_view("export_deficit_excel"), name="export_deficit_excel"),
+    path("reports/turnover/export/", _report_view("export_turnover_excel"), name="export_turnover_excel"),
+    path("exports/", views.export_job_create, name="export_job_create"),
+    path("exports/<int:pk>/", views.export_job_detail, name="export_job_detail"),
+    path("exports/<int:pk>/status/", views.export_job_status, name="export_job_status"),
+    path("exports/<int:pk>/download/", views.export_job_download, name="export_job_download"),
+    path("stats/requests/", views.request_stats_view, name="request_stats"),
+    path("metrics", views.metrics_view, name="metrics"),
+    path("api/documents/", views.api_documents, name="api_documents"),
+    path("api/stock/", views.api_stock_stream, name="api_stock_stream"),
+    path("api/movements/", views.api_movement_stream, name="api_movement_stream"),
 ]
\ No newline at end of file
@@ -1,17 +1,47 @@
+import json
+import os
 from datetime import datetime
 
-import openpyxl
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.db.models import Count, Prefetch
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, FileResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.http import content_disposition_header
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.contrib.auth import login, logout, authenticate
 from .forms import CustomLoginForm, MaterialForm, DirectionForm, LocationForm, SupplierForm, MaterialIncomeForm, \
     IncomeItemForm, IncomeItemFormSet, MaterialTransferForm, TransferItemFormSet, MaterialWriteOffForm, \
     WriteOffItemFormSet
 from .models import Material, Direction, Location, Supplier, MaterialIncome, MaterialTransfer, MaterialWriteOff, Stock, \
-    IncomeItem
+    IncomeItem, TransferItem, WriteOffItem, ImportJob, ExportJob
+from .export_jobs import request_export
+from .api import ApiError, api_user, post_documents, stream_movements, stream_stock
+from .instrumentation import request_stats
+from .metrics import PROMETHEUS_CONTENT_TYPE, render_metrics
+from .exporting import MOVEMENT_HEADER, DEFICIT_HEADER, XLSX_CONTENT_TYPE, movement_rows, deficit_stocks, \
+    deficit_rows, write_xlsx, iter_csv, iter_ndjson, NDJSON_CONTENT_TYPE, amovement_rows, aiter_csv, aiter_file, \
+    TURNOVER_HEADER, turnover_rows
+from .pagination import keyset_paginate
+from .report_cache import acached_report, cached_report, conditional_report
+from .search import search_materials
+from .snapshots import stock_as_of
+from .posting import post_income, post_transfer, post_writeoff
+from .stock import InsufficientStock
+from .turnover import turnover_statement
 from django.contrib import messages
 
+MAX_IMPORT_ERROR_MESSAGES = 50
+# Наибольшее значение первичного ключа (bigint)
+MAX_PK = 2 ** 63 - 1
+
+
 def home(request):
   return render(request, 'home.html', {})
 
@@ -45,10 +75,12 @@ def custom_login(request):
 @login_required
 def material_list(request):
     query = request.GET.get("q")
-    materials = Material.objects.all()
+    materials = Material.objects.select_related("unit")
     if query:
-        materials = materials.filter(name__icontains=query)
-    return render(request, "material_list.html", {"materials": materials})
+        materials = keyset_paginate(request, search_materials(materials, query), ("-rank", "id"))
+    else:
+        materials = keyset_paginate(request, materials, ("name", "id"))
+    return render(request, "material_list.html", {"materials": materials, "page": materials})
 
 
 @login_required
@@ -152,8 +184,8 @@ def location_delete(request, pk):
 # --- Supplier ---
 @login_required
 def supplier_list(request):
-    suppliers = Supplier.objects.all()
-    return render(request, "supplier_list.html", {"suppliers": suppliers})
+    suppliers = keyset_paginate(request, Supplier.objects.all(), ("name", "id"))
+    return render(request, "supplier_list.html", {"suppliers": suppliers, "page": suppliers})
 
 
 @login_required
@@ -186,17 +218,23 @@ def supplier_delete(request, pk):
 
 @login_required
 def income_list(request):
-    incomes = MaterialIncome.objects.all().order_by("-date")
-    return render(request, "income_list.html", {"incomes": incomes})
+    incomes = MaterialIncome.objects.select_related("supplier", "responsible")
+    incomes = keyset_paginate(request, incomes, ("-date", "-id"))
+    return render(request, "income_list.html", {"incomes": incomes, "page": incomes})
 
 @login_required
 def income_detail(request, pk):
-    income = get_object_or_404(MaterialIncome, pk=pk)
+    income = get_object_or_404(
+        MaterialIncome.objects.select_related("supplier", "responsible").prefetch_related(
+            Prefetch("items", queryset=IncomeItem.objects.select_related("material", "direction", "location"))
+        ),
+        pk=pk,
+    )
     return render(request, "income_detail.html", {"income": income})
 
 @login_required
 def income_delete(request, pk):
-    income = get_object_or_404(MaterialIncome, pk=pk)
+    income = get_object_or_404(MaterialIncome.objects.select_related("supplier"), pk=pk)
     if request.method == "POST":
         income.delete()
         return redirect("income_list")
@@ -211,11 +249,7 @@ def income_create(request):
         if form_income.is_valid() and formset.is_valid():
             income = form_income.save(commit=False)
             income.responsible = request.user
-            income.save()
-            items = formset.save(commit=False)
-            for item in items:
-                item.income = income
-                item.save()
+            post_income(income, formset.save(commit=False))
             return redirect("income_list")
     else:
         form_income = MaterialIncomeForm()
@@ -229,8 +263,9 @@ def income_create(request):
 
 @login_required
 def transfer_list(request):
-    transfers = MaterialTransfer.objects.all().order_by("-date")
-    return render(request, "transfer_list.html", {"transfers": transfers})
+    transfers = MaterialTransfer.objects.select_related("responsible")
+    transfers = keyset_paginate(request, transfers, ("-date", "-id"))
+    return render(request, "transfer_list.html", {"transfers": transfers, "page": transfers})
 
 
 @login_required
@@ -241,12 +276,13 @@ def transfer_create(request):
         if form_transfer.is_valid() and formset.is_valid():
             transfer = form_transfer.save(commit=False)
             transfer.responsible = request.user
-            transfer.save()
-            items = formset.save(commit=False)
-            for item in items:
-                item.transfer = transfer
-                item.save()
-            return redirect("transfer_list")
+            try:
+                post_transfer(transfer, formset.save(commit=False))
+            except InsufficientStock as e:
+                # Остаток успели изменить параллельно после проверки формы
+                form_transfer.add_error(None, e)
+            else:
+                return redirect("transfer_list")
     else:
         form_transfer = MaterialTransferForm()
         formset = TransferItemFormSet()
@@ -260,7 +296,14 @@ def transfer_create(request):
 
 @login_required
 def transfer_detail(request, pk):
-    transfer = get_object_or_404(MaterialTransfer, pk=pk)
+    transfer = get_object_or_404(
+        MaterialTransfer.objects.select_related("responsible").prefetch_related(
+            Prefetch("items", queryset=TransferItem.objects.select_related(
+                "material", "from_direction", "from_location", "to_direction", "to_location"
+            ))
+        ),
+        pk=pk,
+    )
     return render(request, "transfer_detail.html", {"transfer": transfer})
 
 
@@ -275,8 +318,9 @@ def transfer_delete(request, pk):
 
 @login_required
 def writeoff_list(request):
-    writeoffs = MaterialWriteOff.objects.all().order_by("-date")
-    return render(request, "writeoff_list.html", {"writeoffs": writeoffs})
+    writeoffs = MaterialWriteOff.objects.select_related("responsible")
+    writeoffs = keyset_paginate(request, writeoffs, ("-date", "-id"))
+    return render(request, "writeoff_list.html", {"writeoffs": writeoffs, "page": writeoffs})
 
 
 @login_required
@@ -287,12 +331,13 @@ def writeoff_create(request):
         if form_writeoff.is_valid() and formset.is_valid():
             writeoff = form_writeoff.save(commit=False)
             writeoff.responsible = request.user
-            writeoff.save()
-            items = formset.save(commit=False)
-            for item in items:
-                item.writeoff = writeoff
-                item.save()
-            return redirect("writeoff_list")
+            try:
+                post_writeoff(writeoff, formset.save(commit=False))
+            except InsufficientStock as e:
+                # Остаток успели изменить параллельно после проверки формы
+                form_writeoff.add_error(None, e)
+            else:
+                return redirect("writeoff_list")
     else:
         form_writeoff = MaterialWriteOffForm()
         formset = WriteOffItemFormSet()
@@ -306,7 +351,12 @@ def writeoff_create(request):
 
 @login_required
 def writeoff_detail(request, pk):
-    writeoff = get_object_or_404(MaterialWriteOff, pk=pk)
+    writeoff = get_object_or_404(
+        MaterialWriteOff.objects.select_related("responsible").prefetch_related(
+            Prefetch("items", queryset=WriteOffItem.objects.select_related("material", "direction", "location"))
+        ),
+        pk=pk,
+    )
     return render(request, "writeoff_detail.html", {"writeoff": writeoff})
 
 
@@ -320,202 +370,424 @@ def writeoff_delete(request, pk):
 
 
 @login_required
+@conditional_report
 def report_stock(request):
-    stocks = Stock.objects.select_related("material", "direction", "location").order_by("material__name")
+    as_of_date = _parse_as_of(request)
+    stocks = cached_report("stock", request, lambda: _stock_report(request, as_of_date))
+    return render(request, "report_stock.html", {
+        "stocks": stocks,
+        "page": stocks if not as_of_date else None,
+        "as_of": as_of_date,
+    })
 
+
+def _parse_as_of(request):
+    as_of = request.GET.get("date")
+    try:
+        return datetime.strptime(as_of, "%Y-%m-%d").date() if as_of else None
+    except ValueError:
+        return None
+
+
+def _stock_report(request, as_of_date):
     query = request.GET.get("q")
+    if as_of_date:
+        return _stock_rows_as_of(as_of_date, query)
+    stocks = Stock.objects.select_related("material__unit", "direction", "location")
     if query:
-        stocks = stocks.filter(material__name__icontains=query)
+        stocks = stocks.filter(material__in=search_materials(Material.objects.all(), query).values("id"))
+    return keyset_paginate(request, stocks, ("material__name", "id"))
 
-    return render(request, "report_stock.html", {"stocks": stocks})
 
-
-@login_required
-def report_movement(request):
+def _stock_rows_as_of(day, query=None):
+    material_ids = None
+    if query:
+        material_ids = search_materials(Material.objects.all(), query).values("id")
+    balances = stock_as_of(day, material_ids=material_ids)
+
+    materials = Material.objects.select_related("unit").in_bulk({key[0] for key in balances})
+    directions = Direction.objects.in_bulk({key[1] for key in balances})
+    locations = Location.objects.in_bulk({key[2] for key in balances})
+    rows = [
+        Stock(
+            material=materials[material_id], direction=directions[direction_id],
+            location=locations[location_id], quantity=quantity,
+        )
+        for (material_id, direction_id, location_id), quantity in balances.items()
+    ]
+    rows.sort(key=lambda row: (row.material.name, row.location.name, row.direction.name))
+    return rows
+
+
+def _parse_period(request):
     start = request.GET.get("start")
     end = request.GET.get("end")
-
-    incomes = MaterialIncome.objects.all()
-    transfers = MaterialTransfer.objects.all()
-    writeoffs = MaterialWriteOff.objects.all()
-
     if start and end and start != "None" and end != "None":
         try:
-            start_date = datetime.strptime(start, "%Y-%m-%d").date()
-            end_date = datetime.strptime(end, "%Y-%m-%d").date()
-            incomes = incomes.filter(date__range=(start_date, end_date))
-            transfers = transfers.filter(date__range=(start_date, end_date))
-            writeoffs = writeoffs.filter(date__range=(start_date, end_date))
+            return datetime.strptime(start, "%Y-%m-%d").date(), datetime.strptime(end, "%Y-%m-%d").date()
         except ValueError:
             pass
+    return None, None
+
+
+@login_required
+@conditional_report
+def report_movement(request):
+    incomes, transfers, writeoffs = _movement_documents(request)
+    incomes, transfers, writeoffs = cached_report(
+        "movement", request, lambda: (list(incomes), list(transfers), list(writeoffs))
+    )
+    return render(request, "report_movement.html", _movement_context(request, incomes, transfers, writeoffs))
+
+
+def _movement_documents(request):
+    start_date, end_date = _parse_period(request)
+
+    items_count = Count("items")
+    incomes = MaterialIncome.objects.select_related("supplier").annotate(items_count=items_count)
+    transfers = MaterialTransfer.objects.select_related("responsible").annotate(items_count=items_count)
+    writeoffs = MaterialWriteOff.objects.annotate(items_count=items_count)
+
+    if start_date and end_date:
+        incomes = incomes.filter(date__range=(start_date, end_date))
+        transfers = transfers.filter(date__range=(start_date, end_date))
+        writeoffs = writeoffs.filter(date__range=(start_date, end_date))
+    return incomes, transfers, writeoffs
+
 
-    return render(request, "report_movement.html", {
+def _movement_context(request, incomes, transfers, writeoffs):
+    return {
         "incomes": incomes,
         "transfers": transfers,
         "writeoffs": writeoffs,
-        "start": start,
-        "end": end,
-    })
+        "start": request.GET.get("start"),
+        "end": request.GET.get("end"),
+    }
 
 
 @login_required
+@conditional_report
 def report_deficit(request):
-    threshold = 10
-    deficit = Stock.objects.filter(quantity__lt=threshold).select_related("material", "location", "direction")
-
-    return render(request, "report_deficit.html", {"deficit": deficit, "threshold": threshold})
+    # Пороги хранятся в строках Stock, выборка идёт по частичному индексу
+    deficit = cached_report("deficit", request, lambda: list(deficit_stocks()))
+    return render(request, "report_deficit.html", {"deficit": deficit})
+
+
+def _turnover_params(request):
+    # Без периода ведомость строится с начала текущего месяца по сегодня
+    start, end = _parse_period(request)
+    if not start:
+        end = timezone.localdate()
+        start = end.replace(day=1)
+    try:
+        location_id = int(request.GET.get("location", ""))
+    except ValueError:
+        location_id = None
+    # Значения вне диапазона первичного ключа отбрасываются до запроса к БД
+    if location_id is not None and not 0 < location_id <= MAX_PK:
+        location_id = None
+    return start, end, location_id
+
+
+def _turnover_context(start, end, location_id, rows):
+    return {
+        "rows": rows,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "location_id": location_id,
+        "locations": Location.objects.order_by("name"),
+    }
+
+
+@login_required
+@conditional_report
+def report_turnover(request):
+    # Остатки и обороты по всем ключам считаются одним сгруппированным запросом
+    start, end, location_id = _turnover_params(request)
+    rows = cached_report("turnover", request, lambda: turnover_statement(start, end, location_id))
+    return render(request, "report_turnover.html", _turnover_context(start, end, location_id, rows))
+
+
+@login_required
+@conditional_report
+def export_turnover_excel(request):
+    start, end, location_id = _turnover_params(request)
+    rows = cached_report("turnover", request, lambda: turnover_statement(start, end, location_id))
+    output = write_xlsx("Оборотная ведомость", TURNOVER_HEADER, turnover_rows(rows))
+    return FileResponse(
+        output, as_attachment=True, filename="turnover_report.xlsx", content_type=XLSX_CONTENT_TYPE
+    )
 
 
 @login_required
+@conditional_report
 def export_movement_excel(request):
-    start = request.GET.get("start")
-    end = request.GET.get("end")
+    start_date, end_date = _parse_period(request)
 
-    # Дата фильтрация
-    incomes = MaterialIncome.objects.all()
-    transfers = MaterialTransfer.objects.all()
-    writeoffs = MaterialWriteOff.objects.all()
+    output = write_xlsx("Движение", MOVEMENT_HEADER, movement_rows(start_date, end_date))
+    return FileResponse(
+        output, as_attachment=True, filename="movement_report.xlsx", content_type=XLSX_CONTENT_TYPE
+    )
 
-    if start and end and start != "None" and end != "None":
-        try:
-            start_date = datetime.strptime(start, "%Y-%m-%d").date()
-            end_date = datetime.strptime(end, "%Y-%m-%d").date()
-            incomes = incomes.filter(date__range=(start_date, end_date))
-            transfers = transfers.filter(date__range=(start_date, end_date))
-            writeoffs = writeoffs.filter(date__range=(start_date, end_date))
-        except ValueError:
-            pass
 
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Движение"
-
-
-    ws.append(["Тип", "Дата", "Описание", "Материал", "Кол-во", "Склад/Направление"])
-
-
-    for income in incomes:
-        for item in income.items.all():
-            ws.append([
-                "Поступление",
-                income.date,
-                f"Поставщик: {income.supplier}",
-                item.material.name,
-                float(item.quantity),
-                f"{item.location} / {item.direction}",
-            ])
-
-    for tr in transfers:
-        for item in tr.items.all():
-            ws.append([
-                "Перемещение",
-                tr.date,
-                f"{item.from_location} → {item.to_location}",
-                item.material.name,
-                float(item.quantity),
-                f"{item.from_direction} → {item.to_direction}",
-            ])
-
-
-    for wr in writeoffs:
-        for item in wr.items.all():
-            ws.append([
-                "Списание",
-                wr.date,
-                wr.reason,
-                item.material.name,
-                float(item.quantity),
-                f"{item.location} / {item.direction}",
-            ])
-
-
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+@login_required
+@conditional_report
+def export_movement_csv(request):
+    start_date, end_date = _parse_period(request)
+
+    response = StreamingHttpResponse(
+        iter_csv(MOVEMENT_HEADER, movement_rows(start_date, end_date)), content_type="text/csv; charset=utf-8"
     )
-    response['Content-Disposition'] = 'attachment; filename=movement_report.xlsx'
-    wb.save(response)
+    response['Content-Disposition'] = 'attachment; filename=movement_report.csv'
     return response
 
 
 @login_required
+@conditional_report
 def export_deficit_excel(request):
-    threshold = 10  # фиксированный порог (можно сделать настройку)
-    deficit = Stock.objects.filter(quantity__lt=threshold).select_related("material", "location", "direction")
+    output = write_xlsx("Дефицит", DEFICIT_HEADER, deficit_rows())
+    return FileResponse(
+        output, as_attachment=True, filename="deficit_report.xlsx", content_type=XLSX_CONTENT_TYPE
+    )
+
+
+# Асинхронные версии отчётов и выгрузок для ASGI (см. ASYNC_REPORT_VIEWS в urls.py):
+# пока клиент медленно скачивает файл, процесс обслуживает другие запросы
 
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Дефицит"
+@login_required
+@conditional_report
+async def report_stock_async(request):
+    as_of_date = _parse_as_of(request)
+    # Постраничный вывод и срезы остатков синхронные: считаются в потоке
+    stocks = await acached_report("stock", request, sync_to_async(lambda: _stock_report(request, as_of_date)))
+    return await sync_to_async(render)(request, "report_stock.html", {
+        "stocks": stocks,
+        "page": stocks if not as_of_date else None,
+        "as_of": as_of_date,
+    })
 
 
-    ws.append(["Материал", "Артикул", "Остаток", "Ед. изм.", "Склад", "Направление"])
+@login_required
+@conditional_report
+async def report_movement_async(request):
+    incomes, transfers, writeoffs = _movement_documents(request)
 
-    for item in deficit:
-        ws.append([
-            item.material.name,
-            item.material.article,
-            float(item.quantity),
-            item.material.unit.name,
-            item.location.name,
-            item.direction.name
-        ])
+    async def compute():
+        return [x async for x in incomes], [x async for x in transfers], [x async for x in writeoffs]
 
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    incomes, transfers, writeoffs = await acached_report("movement", request, compute)
+    return await sync_to_async(render)(
+        request, "report_movement.html", _movement_context(request, incomes, transfers, writeoffs)
     )
-    response['Content-Disposition'] = 'attachment; filename=deficit_report.xlsx'
-    wb.save(response)
+
+
+@login_required
+@conditional_report
+async def report_deficit_async(request):
+    async def compute():
+        return [stock async for stock in deficit_stocks()]
+
+    deficit = await acached_report("deficit", request, compute)
+    return await sync_to_async(render)(request, "report_deficit.html", {"deficit": deficit})
+
+
+@login_required
+@conditional_report
+async def export_movement_excel_async(request):
+    start_date, end_date = _parse_period(request)
+    # openpyxl пишет синхронно: файл собирается в потоке, отдаётся из цикла событий
+    output = await sync_to_async(write_xlsx)("Движение", MOVEMENT_HEADER, movement_rows(start_date, end_date))
+    return _xlsx_stream(output, "movement_report.xlsx")
+
+
+@login_required
+@conditional_report
+async def export_movement_csv_async(request):
+    start_date, end_date = _parse_period(request)
+
+    response = StreamingHttpResponse(
+        aiter_csv(MOVEMENT_HEADER, amovement_rows(start_date, end_date)), content_type="text/csv; charset=utf-8"
+    )
+    response['Content-Disposition'] = 'attachment; filename=movement_report.csv'
+    return response
+
+
+@login_required
+@conditional_report
+async def export_deficit_excel_async(request):
+    output = await sync_to_async(write_xlsx)("Дефицит", DEFICIT_HEADER, deficit_rows())
+    return _xlsx_stream(output, "deficit_report.xlsx")
+
+
+@login_required
+@conditional_report
+async def report_turnover_async(request):
+    start, end, location_id = _turnover_params(request)
+    rows = await acached_report("turnover", request, sync_to_async(lambda: turnover_statement(start, end, location_id)))
+    return await sync_to_async(render)(
+        request, "report_turnover.html", _turnover_context(start, end, location_id, rows)
+    )
+
+
+@login_required
+@conditional_report
+async def export_turnover_excel_async(request):
+    start, end, location_id = _turnover_params(request)
+    rows = await acached_report("turnover", request, sync_to_async(lambda: turnover_statement(start, end, location_id)))
+    output = await sync_to_async(write_xlsx)("Оборотная ведомость", TURNOVER_HEADER, turnover_rows(rows))
+    return _xlsx_stream(output, "turnover_report.xlsx")
+
+
+def _xlsx_stream(output, filename):
+    size = output.seek(0, os.SEEK_END)
+    output.seek(0)
+    response = StreamingHttpResponse(aiter_file(output), content_type=XLSX_CONTENT_TYPE)
+    response["Content-Length"] = str(size)
+    response["Content-Disposition"] = content_disposition_header(True, filename)
     return response
 
 
 @login_required
 def import_income_excel(request):
     if request.method == "POST" and request.FILES.get("file"):
-        wb = openpyxl.load_workbook(request.FILES["file"])
-        ws = wb.active
+        # Файл обрабатывается фоновым обработчиком (manage.py run_import_jobs)
+        job = ImportJob.objects.create(
+            file=request.FILES["file"],
+            user=request.user,
+            group=bool(request.POST.get("group")),
+        )
+        return redirect("import_job_detail", pk=job.pk)
 
-        current_user = request.user
-        created_docs = 0
-        error_rows = []
+    return render(request, "import_income.html")
 
-        for i, row in enumerate(ws.iter_rows(min_row=2), start=2):
-            try:
-                date = row[0].value
-                supplier_name = row[1].value
-                material_name = row[2].value
-                quantity = row[3].value
-                direction_name = row[4].value
-                location_name = row[5].value
-
-
-                supplier, _ = Supplier.objects.get_or_create(name=supplier_name)
-                material = Material.objects.get(name=material_name)
-                direction = Direction.objects.get(name=direction_name)
-                location = Location.objects.get(name=location_name)
-
-
-                income = MaterialIncome.objects.create(
-                    date=date,
-                    supplier=supplier,
-                    responsible=current_user
-                )
-
-                IncomeItem.objects.create(
-                    income=income,
-                    material=material,
-                    quantity=quantity,
-                    direction=direction,
-                    location=location
-                )
-                created_docs += 1
-            except Exception as e:
-                error_rows.append((i, str(e)))
-
-        if error_rows:
-            for row_num, err in error_rows:
-                messages.error(request, f"Ошибка в строке {row_num}: {err}")
-        else:
-            messages.success(request, f"Успешно импортировано {created_docs} поступлений.")
 
-        return redirect("income_list")
+@login_required
+def import_job_detail(request, pk):
+    job = get_object_or_404(_user_jobs(request, ImportJob), pk=pk)
+    return render(request, "import_job.html", {"job": job})
+
+
+@login_required
+def import_job_status(request, pk):
+    job = get_object_or_404(_user_jobs(request, ImportJob), pk=pk)
+    return JsonResponse({
+        "status": job.status,
+        "status_display": job.get_status_display(),
+        "finished": job.status in (ImportJob.STATUS_DONE, ImportJob.STATUS_FAILED),
+        "last_row": job.last_row,
+        "imported_rows": job.imported_rows,
+        "created_docs": job.created_docs,
+        "error_count": job.error_count,
+        "errors": job.errors[:MAX_IMPORT_ERROR_MESSAGES],
+        "message": job.message,
+    })
+
+
+@login_required
+@require_POST
+def export_job_create(request):
+    # Файл строит фоновый обработчик (manage.py run_export_jobs); одинаковые
+    # запросы при неизменных данных получают уже готовый файл
+    kind = request.POST.get("kind")
+    if kind not in dict(ExportJob.KINDS):
+        return HttpResponse(status=400)
+    job = request_export(request.user, kind, request.POST)
+    return redirect("export_job_detail", pk=job.pk)
+
+
+def _user_jobs(request, model):
+    # Задания фоновой обработки видны своему пользователю и персоналу
+    jobs = model.objects.all()
+    return jobs if request.user.is_staff else jobs.filter(user=request.user)
 
-    return render(request, "import_income.html")
\ No newline at end of file
+
+@login_required
+def export_job_detail(request, pk):
+    job = get_object_or_404(_user_jobs(request, ExportJob), pk=pk)
+    return render(request, "export_job.html", {"job": job})
+
+
+@login_required
+def export_job_status(request, pk):
+    job = get_object_or_404(_user_jobs(request, ExportJob), pk=pk)
+    done = job.status == ExportJob.STATUS_DONE
+    return JsonResponse({
+        "status": job.status,
+        "status_display": job.get_status_display(),
+        "finished": done or job.status == ExportJob.STATUS_FAILED,
+        "size": job.size,
+        "download_url": reverse("export_job_download", args=[job.pk]) if done else None,
+        "message": job.message,
+    })
+
+
+@login_required
+def export_job_download(request, pk):
+    job = get_object_or_404(_user_jobs(request, ExportJob), pk=pk, status=ExportJob.STATUS_DONE)
+    try:
+        file = job.file.open("rb")
+    except FileNotFoundError:
+        # Файл удалён очисткой кэша выгрузок: выгрузка ставится в очередь заново
+        return redirect("export_job_detail", pk=request_export(request.user, job.kind, job.params).pk)
+    ExportJob.objects.filter(pk=job.pk).update(last_used_at=timezone.now())
+    content_type = XLSX_CONTENT_TYPE if job.file.name.endswith(".xlsx") else "text/csv; charset=utf-8"
+    filename = f"{job.kind}_{'_'.join(job.params.values()) or 'all'}.{job.file.name.rsplit('.', 1)[-1]}"
+    return FileResponse(file, as_attachment=True, filename=filename, content_type=content_type)
+
+
+@staff_member_required
+def request_stats_view(request):
+    # POST сбрасывает накопленную статистику текущего процесса
+    if request.method == "POST":
+        request_stats.reset()
+    return JsonResponse(request_stats.snapshot())
+
+
+def metrics_view(request):
+    # Сборщику — по токену (bearer_token в Prometheus), иначе только staff. Адрес клиента
+    # не проверяется: за обратным прокси на том же сервере все запросы идут с 127.0.0.1
+    token = getattr(settings, "METRICS_TOKEN", None)
+    scheme, _, key = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+    by_token = bool(token) and scheme.lower() == "bearer" and constant_time_compare(key.strip(), token)
+    if not by_token and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@csrf_exempt
+@require_POST
+def api_documents(request):
+    # Только по токену: сессия без CSRF-проверки сюда не пускается
+    user = api_user(request)
+    if user is None:
+        return JsonResponse({"error": "Нужен заголовок Authorization: Token <ключ>"}, status=401)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"error": "Тело запроса не является JSON"}, status=400)
+    try:
+        results = post_documents(user, payload)
+    except ApiError as e:
+        return JsonResponse(e.payload, status=e.status)
+    status = 201 if any(result["status"] == "created" for result in results) else 200
+    return JsonResponse({"results": results}, status=status)
+
+
+def api_stock_stream(request):
+    return _ndjson_stream(request, stream_stock)
+
+
+def api_movement_stream(request):
+    return _ndjson_stream(request, stream_movements)
+
+
+def _ndjson_stream(request, stream):
+    # Чтение доступно по токену API или из сессии пользователя
+    user = api_user(request) or (request.user if request.user.is_authenticated else None)
+    if user is None:
+        return JsonResponse({"error": "Нужен заголовок Authorization: Token <ключ>"}, status=401)
+    try:
+        rows = stream(request.GET)
+    except ApiError as e:
+        return JsonResponse(e.payload, status=e.status)
+    return StreamingHttpResponse(iter_ndjson(rows), content_type=NDJSON_CONTENT_TYPE)
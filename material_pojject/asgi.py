@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'material_pojject.settings')
+# Отчёты и выгрузки обслуживаются async-представлениями, не занимая поток на время скачивания
+os.environ.setdefault('ASYNC_REPORT_VIEWS', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.instrumentation.RequestStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -122,6 +125,39 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Загруженные файлы (задания импорта)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Кэш: версия данных отчётов хранится в default (для нескольких процессов
+# нужен общий бэкенд), готовые отчёты — в reports с вытеснением старых (LRU)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reports': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'reports',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 500},
+    },
+}
+
+# Статистика запросов по представлениям (/stats/requests/, только для staff)
+REQUEST_STATS_ENABLED = True
+# Запросы к БД дольше порога пишутся в лог main.requests
+SLOW_QUERY_THRESHOLD_MS = 300
+# Токен сборщика для /metrics (формат Prometheus): заголовок Authorization: Bearer <токен>.
+# Без токена метрики видны только staff
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+# Async-версии отчётов и выгрузок; включается в asgi.py, под WSGI остаются синхронные
+ASYNC_REPORT_VIEWS = os.environ.get("ASYNC_REPORT_VIEWS") == "1"
+# Файлы фоновых выгрузок (MEDIA_ROOT/exports): срок хранения без обращений и общий предел размера
+EXPORT_CACHE_MAX_AGE = timedelta(days=7)
+EXPORT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Выгрузка /api/stock/ не отдаёт строки моложе стольких секунд
+API_SYNC_SETTLE_SECONDS = 5
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 